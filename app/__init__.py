@@ -17,13 +17,16 @@ def create_app(config_class=Config):
     register_url_converters(app)
     register_blueprints(app)
     register_error_handlers(app)
+    register_commands(app)
     configure_logging(app)
     return app
 
 
 def configure_extensions(app):
+    from .jobs import job_queue
     db.init_app(app)
     migrate.init_app(app, db)
+    job_queue.init_app(app)
 
 
 def register_blueprints(app):
@@ -40,6 +43,11 @@ def register_error_handlers(app):
     e.register_request_exception_handlers(app)
 
 
+def register_commands(app):
+    from .commands import register_commands
+    register_commands(app)
+
+
 def register_url_converters(app):
     # url converters need to be registered
     # before the blueprint registers the url rules!
@@ -49,10 +57,17 @@ def register_url_converters(app):
 
 def configure_logging(app):
     from app.utils import print_json
+    from app.models.database import LookupCache
     if app.config['DEBUG']:
         @app.after_request
         def log_response(response):
-            print_json(response.data)
+            # reading the data of a streamed response would buffer it,
+            # and 304 responses have no body
+            if not response.is_streamed and response.status_code != 304:
+                print_json(response.data)
+            cache = LookupCache.current()
+            response.headers['X-Lookup-Cache'] = (
+                'hits={hits}; misses={misses}'.format(**cache.stats()))
             return response
 
 
@@ -6,7 +6,8 @@ from .user import UserSchema, PersonSchema, DependentSchema
 from .lesson import LessonSchema, RepeatedLessonSchema, TemplateLessonSchema
 from .address import AddressSchema
 from .class_session import ClassSchema, ClassSessionSchema
-from .enrollment import EnrollmentSchema
+from .enrollment import EnrollmentSchema, WaitlistEntrySchema
 from .notification import NotificationSchema, NotificationDeliverySchema
 from .organization import OrganizationPersonSchema, OrganizationSchema
 from .schedule import TimeSlotSchema, ScheduleSchema
+from .job import JobSchema
@@ -1,10 +1,9 @@
 from flask import request, g, abort, jsonify
 from flask.views import MethodView
 from sqlalchemy.exc import IntegrityError
-from marshmallow import (Schema, fields, validate, ValidationError,
-                         validates_schema)
+from marshmallow import Schema, fields, validate, ValidationError
 from app.errors.request_exception import RequestException
-from app.models import APIConst, Address, User
+from app.models import APIConst, Address, User, Lesson
 from . import bp
 from .schema_mixins import BaseSchemaMixin, TimestampSchemaMixin
 from .method_view_mixins import BaseMethodViewMixin
@@ -12,6 +11,7 @@ from .method_view_mixins import BaseMethodViewMixin
 
 class AddressSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
     __model__ = Address
+    __related_ids__ = {'creator_id': User}
     primary_street = fields.String(
         required=True,
         validate=validate.Length(min=1, max=100),
@@ -36,14 +36,24 @@ class AddressSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
     creator_id = fields.Integer(required=True,
                                 validate=validate.Range(min=1))
 
-    @validates_schema
-    def validate_creator_id(self, data):
-        self.validate_item_existence_with_id(User, data.get('creator_id'))
+
+class OccupancyEntrySchema(Schema):
+    lesson_id = fields.Integer()
+    start_at = fields.DateTime()
+    end_at = fields.DateTime()
+    class_session_id = fields.Integer()
+    conflicting_lesson_ids = fields.List(fields.Integer())
+
+
+class AddressOccupancySchema(Schema):
+    address_id = fields.Integer()
+    lessons = fields.Nested(OccupancyEntrySchema, many=True)
 
 
 address_schema = AddressSchema()
 addresses_schema = AddressSchema(many=True)
 address_patch_schema = AddressSchema(exclude=['id', 'creator_id'])
+address_occupancies_schema = AddressOccupancySchema(many=True)
 
 
 class AddressResource(BaseMethodViewMixin, MethodView):
@@ -53,6 +63,7 @@ class AddressResource(BaseMethodViewMixin, MethodView):
 
     def patch(self, id=None):
         address = self.get_resource_with_ids(Address, id)
+        self.check_if_match(Address, address_schema, id)
         json_data = request.get_json()
         try:
             data = address_patch_schema.load(
@@ -72,14 +83,24 @@ class AddressResource(BaseMethodViewMixin, MethodView):
 
 
 class AddressCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('creator_id', 'city', 'state', 'zipcode', 'country')
+
     def get(self, ids=None):
-        return self.response_to_get_with_ids(
-            Address, address_schema, ids)
+        if ids is None:
+            return self.response_to_get_page(Address, address_schema)
+        return self.response_to_get_with_ids(Address, address_schema, ids)
+
+    def patch(self, ids):
+        return self.response_to_bulk_patch(
+            Address, address_patch_schema, address_schema, ids)
 
     def post(self):
         json_data = request.get_json()
         if not json_data:
             raise RequestException("No input data", 400)
+        if isinstance(json_data, list):
+            return self.response_to_bulk_post(
+                Address, address_schema, json_data)
         try:
             data = address_schema.load(json_data)
         except ValidationError as err:
@@ -92,6 +113,18 @@ class AddressCollectionResource(BaseMethodViewMixin, MethodView):
         return response
 
 
+class AddressOccupancyResource(BaseMethodViewMixin, MethodView):
+
+    def get(self, id=None, ids=None):
+        id_list = [id] if ids is None else list(dict.fromkeys(ids))
+        self.get_resource_with_ids(Address, id_list)
+        start, end = self.get_time_window()
+        occupancy = Lesson.get_occupancy(id_list, start, end)
+        result = address_occupancies_schema.dump(
+            [dict(address_id=id, lessons=occupancy[id]) for id in id_list])
+        return jsonify({APIConst.DATA: result})
+
+
 address_view = AddressResource.as_view('address_api')
 address_collection_view = AddressCollectionResource.as_view(
     'address_collection_api')
@@ -100,7 +133,16 @@ bp.add_url_rule('/addresses/<int:id>',
                 methods=['GET', 'PATCH'])
 bp.add_url_rule('/addresses/<int_list:ids>',
                 view_func=address_collection_view,
-                methods=['GET'])
+                methods=['GET', 'PATCH'])
 bp.add_url_rule('/addresses',
                 view_func=address_collection_view,
                 methods=['GET', 'POST'])
+
+address_occupancy_view = AddressOccupancyResource.as_view(
+    'address_occupancy_api')
+bp.add_url_rule('/addresses/<int:id>/occupancy',
+                view_func=address_occupancy_view,
+                methods=['GET'])
+bp.add_url_rule('/addresses/<int_list:ids>/occupancy',
+                view_func=address_occupancy_view,
+                methods=['GET'])
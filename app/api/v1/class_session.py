@@ -1,8 +1,7 @@
 from flask import request, g, abort, jsonify
 from flask.views import MethodView
 from sqlalchemy.exc import IntegrityError
-from marshmallow import (Schema, fields, validate, ValidationError,
-                         validates_schema)
+from marshmallow import Schema, fields, validate, ValidationError
 from app.errors.request_exception import RequestException
 from app.models import (APIConst, Class, ClassSession, Address, User,
                         Organization, Schedule)
@@ -13,6 +12,10 @@ from .method_view_mixins import BaseMethodViewMixin
 
 class ClassSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
     __model__ = Class
+    __related_ids__ = {
+        'organization_id': Organization,
+        'creator_id': User,
+    }
     title = fields.String(required=True, validate=validate.Length(
         min=1, max=80))
     duration = fields.Integer(required=True,
@@ -27,6 +30,7 @@ class ClassSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
     num_of_lessons_per_session = fields.Integer(
         validate=validate.Range(min=1))
     capacity = fields.Integer(validate=validate.Range(min=1))
+    session_count = fields.Integer(dump_only=True)
     min_age = fields.Integer(validate=validate.Range(min=0))
     max_age = fields.Integer(validate=validate.Range(min=0))
 
@@ -72,21 +76,22 @@ class ClassSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
 
         return de_data if many else de_data[0]
 
-    @validates_schema
-    def validate_related_ids(self, data):
-        self.validate_item_existence_with_id(Organization,
-                                             data.get('organization_id'))
-        self.validate_item_existence_with_id(User,
-                                             data.get('creator_id'))
-
 
 class ClassSessionSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
     __model__ = ClassSession
+    __related_ids__ = {
+        'class_id': Class,
+        'creator_id': User,
+        'schedule_id': Schedule,
+    }
     class_id = fields.Integer(required=True, validate=validate.Range(min=1))
     creator_id = fields.Integer(required=True, validate=validate.Range(min=1))
     schedule_id = fields.Integer(required=True, validate=validate.Range(min=1))
 
     capacity = fields.Integer(validate=validate.Range(min=1))
+    enrollment_count = fields.Integer(dump_only=True)
+    lesson_count = fields.Integer(dump_only=True)
+    waitlist_count = fields.Integer(dump_only=True)
     template_lessons = fields.Nested(
         'TemplateLessonSchema',
         only=['id', '_type', 'time_slot', 'class_session_id'],
@@ -116,15 +121,6 @@ class ClassSessionSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
         dump_only=True,
     )
 
-    @validates_schema
-    def validate_related_ids(self, data):
-        self.validate_item_existence_with_id(Class,
-                                             data.get('class_id'))
-        self.validate_item_existence_with_id(User,
-                                             data.get('creator_id'))
-        self.validate_item_existence_with_id(Schedule,
-                                             data.get('schedule_id'))
-
 
 class_schema = ClassSchema()
 classes_schema = ClassSchema(many=True)
@@ -143,6 +139,7 @@ class ClassResource(BaseMethodViewMixin, MethodView):
 
     def patch(self, id):
         _class = self.get_resource_with_ids(Class, id)
+        self.check_if_match(Class, class_schema, id)
         json_data = request.get_json()
         try:
             data = class_patch_schema.load(json_data, partial=True)
@@ -161,10 +158,18 @@ class ClassResource(BaseMethodViewMixin, MethodView):
 
 
 class ClassCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('creator_id', 'organization_id', 'capacity', 'min_age',
+                     'max_age', 'session_count')
 
-    def get(self, ids):
+    def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(Class, class_schema)
         return self.response_to_get_with_ids(Class, class_schema, ids)
 
+    def patch(self, ids):
+        return self.response_to_bulk_patch(
+            Class, class_patch_schema, class_schema, ids)
+
     def post(self):
         json_data = request.get_json()
         if not json_data:
@@ -189,6 +194,7 @@ class ClassSessionResource(BaseMethodViewMixin, MethodView):
 
     def patch(self, id):
         class_session = self.get_resource_with_ids(ClassSession, id)
+        self.check_if_match(ClassSession, class_session_schema, id)
         json_data = request.get_json()
         try:
             data = class_session_patch_schema.load(json_data, partial=True)
@@ -207,12 +213,29 @@ class ClassSessionResource(BaseMethodViewMixin, MethodView):
         return response
 
 
+class ClassSessionICalendarResource(BaseMethodViewMixin, MethodView):
+
+    def get(self, id):
+        self.get_resource_with_ids(ClassSession, id)
+        return self.stream_calendar([id])
+
+
 class ClassSessionCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('class_id', 'creator_id', 'schedule_id', 'capacity',
+                     'enrollment_count', 'lesson_count', 'waitlist_count')
 
-    def get(self, ids):
+    def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(
+                ClassSession, class_session_schema)
         return self.response_to_get_with_ids(
             ClassSession, class_session_schema, ids)
 
+    def patch(self, ids):
+        return self.response_to_bulk_patch(
+            ClassSession, class_session_patch_schema,
+            class_session_schema, ids)
+
     def post(self):
         json_data = request.get_json()
         if not json_data:
@@ -238,7 +261,7 @@ bp.add_url_rule('/classes/<int:id>',
                 methods=['GET', 'PATCH'])
 bp.add_url_rule('/classes/<int_list:ids>',
                 view_func=class_collection_view,
-                methods=['GET'])
+                methods=['GET', 'PATCH'])
 bp.add_url_rule('/classes',
                 view_func=class_collection_view,
                 methods=['GET', 'POST'])
@@ -251,7 +274,13 @@ bp.add_url_rule('/class-sessions/<int:id>',
                 methods=['GET', 'PATCH'])
 bp.add_url_rule('/class-sessions/<int_list:ids>',
                 view_func=class_session_collection_view,
-                methods=['GET'])
+                methods=['GET', 'PATCH'])
 bp.add_url_rule('/class-sessions',
                 view_func=class_session_collection_view,
                 methods=['GET', 'POST'])
+
+class_session_icalendar_view = ClassSessionICalendarResource.as_view(
+    'class_session_icalendar_api')
+bp.add_url_rule('/class-sessions/<int:id>/calendar.ics',
+                view_func=class_session_icalendar_view,
+                methods=['GET'])
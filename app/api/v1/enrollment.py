@@ -1,9 +1,11 @@
-from flask import request, g, abort, jsonify
+from flask import request, g, abort, jsonify, url_for
 from flask.views import MethodView
-from marshmallow import (Schema, fields, validate, ValidationError,
-                         validates_schema)
+from sqlalchemy.exc import IntegrityError
+from marshmallow import Schema, fields, validate, ValidationError
 from app.errors.request_exception import RequestException
-from app.models import (APIConst, Enrollment, Person, User, ClassSession)
+from app import db
+from app.models import (APIConst, Enrollment, Person, User, ClassSession,
+                        ClassSessionFullError, WaitlistEntry)
 from . import bp
 from .schema_mixins import BaseSchemaMixin, TimestampSchemaMixin
 from .method_view_mixins import BaseMethodViewMixin
@@ -11,6 +13,11 @@ from .method_view_mixins import BaseMethodViewMixin
 
 class EnrollmentSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
     __model__ = Enrollment
+    __related_ids__ = {
+        'class_session_id': ClassSession,
+        'enrolled_person_id': Person,
+        'initiator_id': User,
+    }
     class_session_id = fields.Integer(
         required=True,
         validate=validate.Range(min=1),
@@ -40,14 +47,29 @@ class EnrollmentSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
         dump_only=True,
     )
 
-    @validates_schema
-    def validate_related_ids(self, data):
-        self.validate_item_existence_with_id(ClassSession,
-                                             data.get('class_session_id'))
-        self.validate_item_existence_with_id(Person,
-                                             data.get('enrolled_person_id'))
-        self.validate_item_existence_with_id(User,
-                                             data.get('initiator_id'))
+
+class WaitlistEntrySchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
+    __model__ = WaitlistEntry
+    __related_ids__ = {
+        'class_session_id': ClassSession,
+        'person_id': Person,
+        'initiator_id': User,
+    }
+    class_session_id = fields.Integer(
+        required=True,
+        validate=validate.Range(min=1),
+    )
+    person_id = fields.Integer(
+        required=True,
+        validate=validate.Range(min=1),
+    )
+    initiator_id = fields.Integer(validate=validate.Range(min=1))
+    position = fields.Integer(dump_only=True)
+    person = fields.Nested(
+        'PersonSchema',
+        only=['id', '_type', 'first_name', 'last_name'],
+        dump_only=True,
+    )
 
 
 enrollment_schema = EnrollmentSchema()
@@ -56,6 +78,42 @@ enrollment_patch_schema = EnrollmentSchema(
     only=['terminated'],
 )
 
+waitlist_entry_schema = WaitlistEntrySchema()
+
+
+def join_waitlist(class_session_id, person_id, initiator_id=None):
+    """Respond with the new waitlist entry of the person, or with their
+    enrollment if a seat was free after all."""
+    if db.session.query(Enrollment.query.filter_by(
+            class_session_id=class_session_id, enrolled_person_id=person_id,
+            terminated=False).exists()).scalar():
+        raise RequestException(
+            'person {} is enrolled in class session {} already'.format(
+                person_id, class_session_id), 409)
+    try:
+        entry, enrollment_id = WaitlistEntry.join(
+            class_session_id, person_id, initiator_id)
+    except IntegrityError:
+        db.session.rollback()
+        raise RequestException(
+            'person {} is on the waitlist of class session {} already'
+            .format(person_id, class_session_id), 409)
+    if entry is None:
+        return jsonify({
+            APIConst.MESSAGE: 'enrolled into class session {}'.format(
+                class_session_id),
+            APIConst.DATA: enrollment_schema.dump(
+                Enrollment.get_with_id(enrollment_id))})
+    response = jsonify({
+        APIConst.MESSAGE: 'class session {} is full, joined its waitlist '
+                          'at position {}'.format(class_session_id,
+                                                  entry.position),
+        APIConst.WAITLIST_ENTRY: waitlist_entry_schema.dump(entry)})
+    response.status_code = 202
+    response.headers['Location'] = url_for('api.waitlist_entry_api',
+                                           id=entry.id)
+    return response
+
 
 class EnrollmentResource(BaseMethodViewMixin, MethodView):
 
@@ -65,6 +123,7 @@ class EnrollmentResource(BaseMethodViewMixin, MethodView):
 
     def patch(self, id):
         enrollment = self.get_resource_with_ids(Enrollment, id)
+        self.check_if_match(Enrollment, enrollment_schema, id)
         json_data = request.get_json()
         try:
             data = enrollment_patch_schema.load(json_data, partial=True)
@@ -72,6 +131,10 @@ class EnrollmentResource(BaseMethodViewMixin, MethodView):
             raise RequestException("Invalid input data", 400, err.messages)
         try:
             enrollment.update(**data)
+        except ClassSessionFullError as err:
+            db.session.rollback()
+            raise RequestException(str(err), 409,
+                                   {APIConst.INPUT: json_data}) from err
         except Exception as err:
             raise RequestException(
                 payload={APIConst.INPUT: json_data}) from err
@@ -84,19 +147,40 @@ class EnrollmentResource(BaseMethodViewMixin, MethodView):
 
 
 class EnrollmentCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('class_session_id', 'enrolled_person_id', 'initiator_id',
+                     'terminated', 'created_at')
+
     def get(self, ids=None):
-        return self.response_to_get_with_ids(Enrollment,
-                                             enrollment_schema, ids)
+        if ids is None:
+            return self.response_to_get_page(Enrollment, enrollment_schema)
+        return self.response_to_get_with_ids(
+            Enrollment, enrollment_schema, ids)
+
+    def patch(self, ids):
+        return self.response_to_bulk_patch(
+            Enrollment, enrollment_patch_schema, enrollment_schema, ids)
 
     def post(self):
         json_data = request.get_json()
         if not json_data:
             raise RequestException("No input data", 400)
+        if isinstance(json_data, list):
+            return self.response_to_bulk_post(
+                Enrollment, enrollment_schema, json_data)
         try:
             data = enrollment_schema.load(json_data)
         except ValidationError as err:
             raise RequestException("Invalid input data", 400, err.messages)
-        enrollment = Enrollment.create(**data)
+        try:
+            enrollment = Enrollment.create(**data)
+        except ClassSessionFullError as err:
+            db.session.rollback()
+            if request.args.get('waitlist', 'false').lower() == 'true':
+                return join_waitlist(data['class_session_id'],
+                                     data['enrolled_person_id'],
+                                     data.get('initiator_id'))
+            raise RequestException(str(err), 409,
+                                   {APIConst.INPUT: json_data}) from err
         result = enrollment_schema.dump(enrollment)
         response = jsonify(
             {APIConst.MESSAGE: 'created new enrollment',
@@ -105,6 +189,41 @@ class EnrollmentCollectionResource(BaseMethodViewMixin, MethodView):
         return response
 
 
+class WaitlistEntryResource(BaseMethodViewMixin, MethodView):
+
+    def get(self, id):
+        return self.response_to_get_with_ids(
+            WaitlistEntry, waitlist_entry_schema, id)
+
+    def delete(self, id):
+        entry = self.get_resource_with_ids(WaitlistEntry, id)
+        entry.delete()
+        return jsonify({APIConst.MESSAGE: 'deleted waitlist entry {}'.format(
+            id)})
+
+
+class WaitlistEntryCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('class_session_id', 'person_id', 'initiator_id')
+
+    def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(
+                WaitlistEntry, waitlist_entry_schema)
+        return self.response_to_get_with_ids(
+            WaitlistEntry, waitlist_entry_schema, ids)
+
+    def post(self):
+        json_data = request.get_json()
+        if not json_data:
+            raise RequestException("No input data", 400)
+        try:
+            data = waitlist_entry_schema.load(json_data)
+        except ValidationError as err:
+            raise RequestException("Invalid input data", 400, err.messages)
+        return join_waitlist(data['class_session_id'], data['person_id'],
+                             data.get('initiator_id'))
+
+
 enrollment_view = EnrollmentResource.as_view('enrollment_api')
 enrollment_collection_view = EnrollmentCollectionResource.as_view(
     'enrollment_colection_api')
@@ -113,8 +232,20 @@ bp.add_url_rule('/enrollments/<int:id>',
                 methods=['GET', 'PATCH'])
 bp.add_url_rule('/enrollments/<int_list:ids>',
                 view_func=enrollment_collection_view,
-                methods=['GET'])
+                methods=['GET', 'PATCH'])
 bp.add_url_rule('/enrollments',
                 view_func=enrollment_collection_view,
                 methods=['GET', 'POST'])
 
+waitlist_entry_view = WaitlistEntryResource.as_view('waitlist_entry_api')
+waitlist_entry_collection_view = WaitlistEntryCollectionResource.as_view(
+    'waitlist_entry_collection_api')
+bp.add_url_rule('/waitlist-entries/<int:id>',
+                view_func=waitlist_entry_view,
+                methods=['GET', 'DELETE'])
+bp.add_url_rule('/waitlist-entries/<int_list:ids>',
+                view_func=waitlist_entry_collection_view,
+                methods=['GET'])
+bp.add_url_rule('/waitlist-entries',
+                view_func=waitlist_entry_collection_view,
+                methods=['GET', 'POST'])
@@ -0,0 +1,101 @@
+from datetime import datetime
+from flask import request
+from marshmallow import fields
+from sqlalchemy import inspect
+from sqlalchemy.orm import aliased
+from werkzeug.http import generate_etag
+from app import db
+from app.models.database import TimestampMixin
+from .schema_mixins import BaseSchemaMixin
+
+
+def row_version(entity):
+    return db.func.coalesce(entity.updated_at, entity.created_at)
+
+
+def get_version_paths(schema, model):
+    """Return the relationship paths whose rows schema dumps for model.
+
+    None means that some dumped data cannot be versioned by timestamps:
+    a model without TimestampMixin, a computed field, or a nested field
+    that is not a relationship.
+    """
+    if not issubclass(model, TimestampMixin):
+        return None
+    mapper = inspect(model)
+    paths = []
+    for name, field in schema.fields.items():
+        if (isinstance(field, (fields.Method, fields.Function))
+                and name != '_type'):
+            return None
+        if not isinstance(field, fields.Nested):
+            continue
+        nested_schema = field.schema
+        if (name not in mapper.relationships
+                or not isinstance(nested_schema, BaseSchemaMixin)):
+            return None
+        relationship = mapper.relationships[name]
+        sub_paths = get_version_paths(nested_schema,
+                                      relationship.mapper.class_)
+        if sub_paths is None:
+            return None
+        attr = getattr(model, name)
+        paths.append([attr])
+        paths.extend([attr] + sub_path for sub_path in sub_paths)
+    return paths
+
+
+def get_version_columns(model, paths):
+    """Columns that change whenever a row of model, or a row it reaches
+    through one of paths, is inserted, updated or deleted.
+
+    Every path contributes correlated count, sum of ids and latest
+    timestamp of the rows at its end, so the whole version of a row is
+    read with one SELECT.
+    """
+    columns = [model.id, row_version(model)]
+    for path in paths:
+        parent = aliased(model)
+        joins = []
+        entity = parent
+        for attr in path:
+            target = aliased(attr.property.mapper.class_, flat=True)
+            joins.append((target, getattr(entity, attr.key)))
+            entity = target
+
+        def aggregate(expression):
+            query = db.session.query(expression).select_from(parent)
+            for target, onclause in joins:
+                query = query.join(target, onclause)
+            return query.filter(parent.id == model.id).correlate(
+                model).as_scalar()
+        columns.extend([
+            aggregate(db.func.count(db.distinct(entity.id))),
+            aggregate(db.func.sum(db.distinct(entity.id))),
+            aggregate(db.func.max(row_version(entity))),
+        ])
+    return columns
+
+
+def get_entity_tag(model, schema, ids):
+    """Return the strong entity tag and the last modification time of the
+    representation of the model rows with ids dumped by schema.
+
+    Only timestamps are read, nothing is dumped. Return None when the
+    representation cannot be versioned that way or some ids are missing.
+    """
+    paths = get_version_paths(schema, model)
+    if paths is None:
+        return None
+    rows = db.session.query(*get_version_columns(model, paths)).filter(
+        model.id.in_(ids)).all()
+    rows_by_id = {row[0]: tuple(row) for row in rows}
+    if any(id not in rows_by_id for id in ids):
+        return None
+    versions = [rows_by_id[id] for id in ids]
+    timestamps = [value for version in versions for value in version
+                  if isinstance(value, datetime)]
+    last_modified = max(timestamps) if timestamps else None
+    # the same rows are represented differently per path and query string
+    digest = repr((request.path, request.query_string, versions))
+    return generate_etag(digest.encode()), last_modified
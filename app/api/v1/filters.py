@@ -0,0 +1,103 @@
+"""Query argument filters of collection resources.
+
+Every query argument named after a whitelisted attribute filters the
+collection, optionally with an operator in brackets:
+
+    GET /enrollments?class_session_id=3&terminated=false
+    GET /lessons?start_at[gte]=2018-03-01T00:00:00&start_at[lt]=2018-04-01
+    GET /enrollments?enrolled_person_id[in]=1,2,5
+
+All of them are ANDed into the WHERE clause of the queries that read the
+page, next to the keyset condition, so they are answered from the indexes
+of the filtered columns. A value of null matches NULL with eq and
+ne. Arguments that are not attributes of the model, like limit, are left
+to the other parts of the resource.
+"""
+import operator
+import re
+from datetime import datetime, timezone
+from marshmallow import ValidationError, fields
+from sqlalchemy import inspect
+from app import db
+from app.errors import RequestException
+from app.models import APIConst
+
+OPERATORS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'in': lambda attr, values: attr.in_(values),
+}
+
+FILTER_ARGUMENT = re.compile(r'^(\w+)(?:\[(\w+)\])?$')
+
+
+def parse_value(name, sql_type, value):
+    """Convert the query argument value of name to the Python type of
+    sql_type."""
+    try:
+        if isinstance(sql_type, db.Boolean):
+            if value.lower() not in ('true', 'false'):
+                raise ValueError
+            return value.lower() == 'true'
+        if isinstance(sql_type, db.Integer):
+            return int(value)
+        if isinstance(sql_type, (db.Float, db.Numeric)):
+            return float(value)
+        if isinstance(sql_type, db.DateTime):
+            if len(value) == len('YYYY-MM-DD'):
+                day = fields.Date().deserialize(value)
+                return datetime(day.year, day.month, day.day)
+            dt = fields.DateTime().deserialize(value)
+            if dt.tzinfo is not None:
+                dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+            return dt
+        if isinstance(sql_type, db.Enum) and sql_type.enum_class:
+            return sql_type.enum_class[value.upper()]
+    except (ValueError, KeyError, ValidationError):
+        raise RequestException(
+            '{} cannot be {!r}'.format(name, value), 400)
+    return value
+
+
+def get_filter_criteria(model, filter_fields, args):
+    """Return the criteria the query arguments args put on model.
+
+    Only the attributes in filter_fields can be filtered by, filtering by
+    another column of model is a 400.
+    """
+    column_keys = {prop.key for prop in inspect(model).column_attrs}
+    criteria = []
+    for argument, values in args.lists():
+        match = FILTER_ARGUMENT.match(argument)
+        if match is None:
+            continue
+        name, op = match.group(1), match.group(2) or 'eq'
+        if name not in filter_fields:
+            if name in column_keys:
+                raise RequestException(
+                    '{} cannot be filtered by {}'.format(
+                        model.__tablename__, name), 400,
+                    {APIConst.FILTER_FIELDS: sorted(filter_fields)})
+            continue
+        if op not in OPERATORS:
+            raise RequestException(
+                'unknown filter operator {}, use one of {}'.format(
+                    op, ', '.join(sorted(OPERATORS))), 400)
+        attr = getattr(model, name)
+        sql_type = attr.expression.type
+        for value in values:
+            if value == 'null' and op in ('eq', 'ne'):
+                criteria.append(attr.is_(None) if op == 'eq'
+                                else attr.isnot(None))
+                continue
+            if op == 'in':
+                value = [parse_value(name, sql_type, item)
+                         for item in value.split(',')]
+            else:
+                value = parse_value(name, sql_type, value)
+            criteria.append(OPERATORS[op](attr, value))
+    return criteria
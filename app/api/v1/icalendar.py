@@ -0,0 +1,294 @@
+"""iCalendar (RFC 5545) feeds of class sessions.
+
+Every template lesson of a class session becomes one recurring VEVENT with
+an RRULE derived from the schedule, instead of one VEVENT per lesson. Only
+the materialized lessons that differ from their recurrence are listed on
+their own: a moved or changed repeated lesson overrides its occurrence by
+RECURRENCE-ID, a deleted one is left out with EXDATE, and lessons without
+a template lesson are plain VEVENTs.
+
+Naive datetimes are UTC, like everywhere else in the app.
+"""
+from sqlalchemy.orm import joinedload
+from werkzeug.http import generate_etag
+import numpy as np
+from app import db
+from app.models import (Address, Class, ClassSession, Enrollment, Lesson,
+                        RepeatedLesson, RepeatOption, Schedule, TemplateLesson,
+                        TimeSlot)
+from app.models.class_session import (class_session_address_association,
+                                      class_session_instructor_association)
+from app.models.lesson import (lesson_guest_student_association,
+                               lesson_instructor_association)
+from app.models.recurrence import repeat_datetimes, to_datetimes
+from .etags import row_version
+
+PRODID = '-//ClassDoor//ClassDoor API//EN'
+#  RFC 5545 asks for lines of at most 75 octets, folded with CRLF + space
+MAX_LINE_LENGTH = 75
+
+#  repeat option -> RRULE parts of its frequency
+FREQUENCIES = {
+    RepeatOption.DAILY: ['FREQ=DAILY'],
+    RepeatOption.WEEKLY: ['FREQ=WEEKLY'],
+    RepeatOption.BIWEEKLY: ['FREQ=WEEKLY', 'INTERVAL=2'],
+    RepeatOption.MONTHLY: ['FREQ=MONTHLY'],
+    RepeatOption.YEARLY: ['FREQ=YEARLY'],
+}
+
+
+def format_datetime(dt):
+    return dt.strftime('%Y%m%dT%H%M%SZ')
+
+
+def escape_text(text):
+    return (text.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def content_line(name, value):
+    line = '{}:{}'.format(name, value)
+    chunks = [line[:MAX_LINE_LENGTH]]
+    for start in range(MAX_LINE_LENGTH, len(line), MAX_LINE_LENGTH - 1):
+        chunks.append(' ' + line[start:start + MAX_LINE_LENGTH - 1])
+    return '\r\n'.join(chunks) + '\r\n'
+
+
+def get_rrule(repeat_option, start_at, count):
+    """Return the RRULE of count occurrences of repeat_option from
+    start_at, or None when the option does not repeat periodically.
+
+    Monthly and yearly repeats keep the day of start_at and fall back to
+    the last day of shorter months, like RepeatOption.get_repeat_datetime:
+    BYMONTHDAY lists the days from the 28th to that day and BYSETPOS=-1
+    picks the last of them each month.
+    """
+    if repeat_option not in FREQUENCIES:
+        return None
+    parts = list(FREQUENCIES[repeat_option])
+    clamped_days = ','.join(str(day) for day in range(28, start_at.day + 1))
+    if repeat_option == RepeatOption.MONTHLY and start_at.day > 28:
+        parts.extend(['BYMONTHDAY=' + clamped_days, 'BYSETPOS=-1'])
+    elif (repeat_option == RepeatOption.YEARLY
+          and (start_at.month, start_at.day) == (2, 29)):
+        parts.extend(['BYMONTH=2', 'BYMONTHDAY=' + clamped_days,
+                      'BYSETPOS=-1'])
+    parts.append('COUNT={}'.format(count))
+    return ';'.join(parts)
+
+
+def iter_event(uid, stamp, start_at, duration, summary, location=None,
+               rrule=None, exdates=(), recurrence_id=None):
+    yield 'BEGIN:VEVENT\r\n'
+    yield content_line('UID', uid)
+    yield content_line('DTSTAMP', format_datetime(stamp))
+    if recurrence_id is not None:
+        yield content_line('RECURRENCE-ID', format_datetime(recurrence_id))
+    yield content_line('DTSTART', format_datetime(start_at))
+    yield content_line('DURATION', 'PT{}M'.format(duration or 0))
+    yield content_line('SUMMARY', escape_text(summary))
+    if location is not None:
+        yield content_line('LOCATION', escape_text(location))
+    if rrule is not None:
+        yield content_line('RRULE', rrule)
+    for exdate in exdates:
+        yield content_line('EXDATE', format_datetime(exdate))
+    yield 'END:VEVENT\r\n'
+
+
+def format_address(address):
+    if address is None:
+        return None
+    return ', '.join(part for part in (
+        address.primary_street, address.secondary_street, address.city,
+        address.state, address.zipcode, address.country) if part)
+
+
+def template_lesson_uid(template_lesson_id):
+    return 'template-lesson-{}@classdoor'.format(template_lesson_id)
+
+
+def lesson_uid(lesson_id):
+    return 'lesson-{}@classdoor'.format(lesson_id)
+
+
+def query_lessons(criterion):
+    """Return id, start_at, duration, location_id, class_session_id,
+    template_lesson_id, index_of_rep and version of the lessons matching
+    criterion, without building ORM instances."""
+    lesson = Lesson.__table__
+    repeated_lesson = RepeatedLesson.__table__
+    return db.session.execute(db.select([
+        lesson.c.id, lesson.c.start_at, lesson.c.duration,
+        lesson.c.location_id, lesson.c.class_session_id,
+        repeated_lesson.c.template_lesson_id, repeated_lesson.c.index_of_rep,
+        row_version(lesson.c).label('version'),
+    ]).select_from(lesson.outerjoin(
+        repeated_lesson, repeated_lesson.c.id == lesson.c.id)).where(
+            db.and_(criterion, lesson.c.start_at.isnot(None))).order_by(
+                lesson.c.start_at, lesson.c.id)).fetchall()
+
+
+def iter_lesson_event(row, summary, locations):
+    return iter_event(lesson_uid(row.id), row.version, row.start_at,
+                      row.duration, summary,
+                      format_address(locations.get(row.location_id)))
+
+
+def iter_class_session_events(class_session):
+    """Yield the lines of the VEVENTs of class_session."""
+    schedule = class_session.schedule
+    summary = class_session.parent_class.title
+    template_lessons = {tl.id: tl for tl in class_session.template_lessons
+                        if tl.time_slot is not None}
+    lessons = query_lessons(
+        Lesson.__table__.c.class_session_id == class_session.id)
+    locations = {address.id: address
+                 for address in class_session.locations}
+    locations.update((tl.location_id, tl.location)
+                     for tl in template_lessons.values())
+    # the locations of moved lessons, in one IN query
+    missing_ids = {row.location_id for row in lessons
+                   if row.location_id not in locations}
+    missing_ids.discard(None)
+    locations.update((address.id, address)
+                     for address in Address.get_with_ids(missing_ids))
+
+    periodic = schedule.repeat_option in FREQUENCIES
+    lessons_by_tl = {}
+    for row in lessons:
+        if periodic and row.template_lesson_id in template_lessons:
+            lessons_by_tl.setdefault(row.template_lesson_id, []).append(row)
+        else:
+            yield from iter_lesson_event(row, summary, locations)
+
+    for tl_id, tl in template_lessons.items():
+        rows = lessons_by_tl.get(tl_id, [])
+        if not rows:
+            continue
+        time_slot = tl.time_slot
+        nums = [row.index_of_rep for row in rows]
+        count = max(nums) + 1
+        expected = to_datetimes(repeat_datetimes(
+            schedule.repeat_option,
+            np.repeat(np.datetime64(time_slot.start_at, 'us'), count),
+            np.arange(count)))
+        materialized = set(nums)
+        exdates = [expected[num] for num in range(count)
+                   if num not in materialized]
+        yield from iter_event(
+            template_lesson_uid(tl_id), tl.updated_at or tl.created_at,
+            time_slot.start_at,
+            time_slot.duration, summary,
+            format_address(locations.get(tl.location_id)),
+            rrule=get_rrule(schedule.repeat_option, time_slot.start_at,
+                            count),
+            exdates=exdates)
+        for row in rows:
+            if (row.start_at, row.duration, row.location_id) != (
+                    expected[row.index_of_rep], time_slot.duration,
+                    tl.location_id):
+                yield from iter_event(
+                    template_lesson_uid(tl_id), row.version, row.start_at,
+                    row.duration, summary,
+                    format_address(locations.get(row.location_id)),
+                    recurrence_id=expected[row.index_of_rep])
+
+
+def iter_calendar(class_session_ids, lesson_ids=()):
+    """Yield the lines of a VCALENDAR with the events of the class sessions
+    with class_session_ids and of the other lessons with lesson_ids, one
+    class session at a time."""
+    yield 'BEGIN:VCALENDAR\r\n'
+    yield content_line('VERSION', '2.0')
+    yield content_line('PRODID', PRODID)
+    yield content_line('CALSCALE', 'GREGORIAN')
+    for class_session_id in class_session_ids:
+        class_session = ClassSession.get_with_id(class_session_id)
+        yield from iter_class_session_events(class_session)
+    if lesson_ids:
+        rows = query_lessons(Lesson.__table__.c.id.in_(lesson_ids))
+        # every lesson with its location and class in one query
+        lessons = {lesson.id: lesson for lesson in Lesson.get_with_ids(
+            [row.id for row in rows],
+            [joinedload(Lesson.location),
+             joinedload(Lesson.class_session).joinedload(
+                 ClassSession.parent_class)])}
+        for row in rows:
+            lesson = lessons[row.id]
+            summary = (lesson.class_session.parent_class.title
+                       if lesson.class_session is not None else 'Lesson')
+            yield from iter_lesson_event(
+                row, summary, {lesson.location_id: lesson.location})
+    yield 'END:VCALENDAR\r\n'
+
+
+def get_person_calendar_ids(person_id):
+    """Return the ids of the class sessions person_id takes or teaches and
+    of the other lessons person_id attends as a guest or teaches."""
+    enrollment = Enrollment.__table__
+    session_instructor = class_session_instructor_association
+    class_session_ids = sorted(
+        {id for (id,) in db.session.execute(db.select(
+            [enrollment.c.class_session_id]).where(db.and_(
+                enrollment.c.enrolled_person_id == person_id,
+                enrollment.c.terminated == db.false(),
+                enrollment.c.class_session_id.isnot(None))))}
+        | {id for (id,) in db.session.execute(db.select(
+            [session_instructor.c.class_session_id]).where(
+                session_instructor.c.instructor_id == person_id))})
+    lesson = Lesson.__table__
+    lesson_ids = set()
+    for table, person_column in (
+            (lesson_guest_student_association,
+             lesson_guest_student_association.c.guest_student_id),
+            (lesson_instructor_association,
+             lesson_instructor_association.c.instructor_id)):
+        lesson_ids.update(id for (id,) in db.session.execute(db.select(
+            [lesson.c.id]).select_from(lesson.join(
+                table, table.c.lesson_id == lesson.c.id)).where(db.and_(
+                    person_column == person_id,
+                    db.or_(lesson.c.class_session_id.is_(None),
+                           lesson.c.class_session_id.notin_(
+                               class_session_ids or [0]))))))
+    return class_session_ids, sorted(lesson_ids)
+
+
+def get_calendar_etag(class_session_ids, lesson_ids=()):
+    """Return the entity tag of the calendar of class_session_ids and
+    lesson_ids, read from the timestamps of every row it is built from,
+    addresses included, in one SELECT."""
+    def aggregates(model, criterion):
+        return [
+            db.select([db.func.count(model.id)]).where(criterion).as_scalar(),
+            db.select([db.func.sum(model.id)]).where(criterion).as_scalar(),
+            db.select([db.func.max(row_version(model))]).where(
+                criterion).as_scalar(),
+        ]
+    session_ids = list(class_session_ids) or [0]
+    schedule_ids = db.select([ClassSession.schedule_id]).where(
+        ClassSession.id.in_(session_ids))
+    class_ids = db.select([ClassSession.class_id]).where(
+        ClassSession.id.in_(session_ids))
+    lesson_criterion = db.or_(Lesson.class_session_id.in_(session_ids),
+                              Lesson.id.in_(list(lesson_ids) or [0]))
+    # the addresses rendered as LOCATION
+    address_ids = db.union(
+        db.select([class_session_address_association.c.address_id]).where(
+            class_session_address_association.c.class_session_id.in_(
+                session_ids)),
+        db.select([TemplateLesson.location_id]).where(
+            TemplateLesson.class_session_id.in_(session_ids)),
+        db.select([Lesson.location_id]).where(lesson_criterion))
+    columns = (
+        aggregates(ClassSession, ClassSession.id.in_(session_ids))
+        + aggregates(Class, Class.id.in_(class_ids))
+        + aggregates(Schedule, Schedule.id.in_(schedule_ids))
+        + aggregates(TimeSlot, TimeSlot.schedule_id.in_(schedule_ids))
+        + aggregates(TemplateLesson,
+                     TemplateLesson.class_session_id.in_(session_ids))
+        + aggregates(Lesson, lesson_criterion)
+        + aggregates(Address, Address.id.in_(address_ids)))
+    version = tuple(db.session.execute(db.select(columns)).first())
+    return generate_etag(repr(
+        (list(class_session_ids), list(lesson_ids), version)).encode())
@@ -0,0 +1,30 @@
+from flask.views import MethodView
+from marshmallow import Schema, fields
+from app.models import Job
+from . import bp
+from .schema_mixins import BaseSchemaMixin, TimestampSchemaMixin
+from .method_view_mixins import BaseMethodViewMixin
+
+
+class JobSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
+    __model__ = Job
+    name = fields.String(dump_only=True)
+    arguments = fields.Dict(dump_only=True)
+    status = fields.String(dump_only=True)
+    error = fields.String(dump_only=True)
+    started_at = fields.DateTime(dump_only=True)
+    finished_at = fields.DateTime(dump_only=True)
+
+
+job_schema = JobSchema()
+
+
+class JobResource(BaseMethodViewMixin, MethodView):
+    def get(self, id):
+        return self.response_to_get_with_ids(Job, job_schema, id)
+
+
+job_view = JobResource.as_view('job_api')
+bp.add_url_rule('/jobs/<int:id>',
+                view_func=job_view,
+                methods=['GET'])
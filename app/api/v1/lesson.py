@@ -1,21 +1,28 @@
-from flask import request, g, abort, jsonify
+from flask import request, g, abort, jsonify, url_for
 from flask.views import MethodView
 from sqlalchemy.exc import IntegrityError
-from marshmallow import (Schema, fields, validate, ValidationError,
-                         validates_schema)
+from marshmallow import Schema, fields, validate, ValidationError
 from app.errors.request_exception import RequestException
+from app.jobs import job_queue
 from app.models import (APIConst, Lesson, RepeatedLesson, Address, TimeSlot,
-                        ClassSession, TemplateLesson)
+                        ClassSession, TemplateLesson, Job)
 from . import bp
 from .schema_mixins import BaseSchemaMixin, TimestampSchemaMixin
 from .method_view_mixins import BaseMethodViewMixin
+from .job import job_schema
 
 
 class TemplateLessonSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
     __model__ = TemplateLesson
+    __related_ids__ = {
+        'class_session_id': ClassSession,
+        'location_id': Address,
+        'time_slot_id': TimeSlot,
+    }
     time_slot_id = fields.Integer(required=True)
     class_session_id = fields.Integer(requird=True)
     location_id = fields.Integer()
+    materialization_job_id = fields.Integer(dump_only=True)
     time_slot = fields.Nested(
         'TimeSlotSchema',
         dump_only=True,
@@ -33,18 +40,13 @@ class TemplateLessonSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
               'schedule_id'],
         dump_only=True)
 
-    @validates_schema
-    def validate_related_ids(self, data):
-        self.validate_item_existence_with_id(ClassSession,
-                                             data.get('class_session_id'))
-        self.validate_item_existence_with_id(Address,
-                                             data.get('location_id'))
-        self.validate_item_existence_with_id(TimeSlot,
-                                             data.get('time_slot_id'))
-
 
 class LessonSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
     __model__ = Lesson
+    __related_ids__ = {
+        'class_session_id': ClassSession,
+        'location_id': Address,
+    }
     class_session_id = fields.Integer(required=True)
     start_at = fields.DateTime()
     duration = fields.Integer(validate=validate.Range(min=0))
@@ -75,16 +77,11 @@ class LessonSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
                 return None
         return dynamic_schema
 
-    @validates_schema
-    def validate_related_ids(self, data):
-        self.validate_item_existence_with_id(ClassSession,
-                                             data.get('class_session_id'))
-        self.validate_item_existence_with_id(Address,
-                                             data.get('location_id'))
-
 
 class RepeatedLessonSchema(LessonSchema):
     __model__ = RepeatedLesson
+    __related_ids__ = dict(LessonSchema.__related_ids__,
+                           template_lesson_id=TemplateLesson)
     start_at = fields.DateTime()
     duration = fields.Integer(validate=validate.Range(min=0))
     template_lesson_id = fields.Integer(
@@ -101,11 +98,6 @@ class RepeatedLessonSchema(LessonSchema):
         dump_only=True,
     )
 
-    @validates_schema
-    def validate_template_lesson_id(self, data):
-        self.validate_item_existence_with_id(TemplateLesson,
-                                             data.get('template_lesson_id'))
-
 
 template_lesson_schema = TemplateLessonSchema()
 template_lessons_schema = TemplateLessonSchema(many=True)
@@ -130,6 +122,7 @@ class TemplateLessonResource(BaseMethodViewMixin, MethodView):
 
     def patch(self, id):
         template_lesson = self.get_resource_with_ids(TemplateLesson, id)
+        self.check_if_match(TemplateLesson, template_lesson_schema, id)
         json_data = request.get_json()
         try:
             data = template_lesson_patch_schema.load(json_data, partial=True)
@@ -149,10 +142,14 @@ class TemplateLessonResource(BaseMethodViewMixin, MethodView):
 
 
 class TemplateLessonCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('class_session_id', 'time_slot_id', 'location_id')
 
-    def get(self, ids):
-        return self.response_to_get_with_ids(TemplateLesson,
-                                             template_lesson_schema, ids)
+    def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(
+                TemplateLesson, template_lesson_schema)
+        return self.response_to_get_with_ids(
+            TemplateLesson, template_lesson_schema, ids)
 
     def post(self):
         json_data = request.get_json()
@@ -164,9 +161,20 @@ class TemplateLessonCollectionResource(BaseMethodViewMixin, MethodView):
             raise RequestException("Invalid input data", 400, err.messages)
         template_lesson = TemplateLesson.create(**data)
         result = template_lesson_schema.dump(template_lesson)
+        job_id = template_lesson.materialization_job_id
+        if job_id is None:
+            return jsonify(
+                {APIConst.MESSAGE: 'created new template lesson',
+                 APIConst.DATA: result})
+        # the lessons are still being created, poll the job for them
+        job_queue.submit(job_id)
         response = jsonify(
-            {APIConst.MESSAGE: 'created new template lesson',
-             APIConst.DATA: result})
+            {APIConst.MESSAGE: 'created new template lesson, its lessons '
+                               'are created by job {}'.format(job_id),
+             APIConst.DATA: result,
+             APIConst.JOB: job_schema.dump(Job.get_with_id(job_id))})
+        response.status_code = 202
+        response.headers['Location'] = url_for('api.job_api', id=job_id)
         return response
 
 
@@ -177,6 +185,7 @@ class LessonResource(BaseMethodViewMixin, MethodView):
 
     def patch(self, id):
         lesson = self.get_resource_with_ids(Lesson, id)
+        self.check_if_match(Lesson, LessonSchema.make_dynamic_schema(), id)
         json_data = request.get_json()
         try:
             data = lesson_patch_schema.load(json_data, partial=True)
@@ -195,6 +204,8 @@ class LessonResource(BaseMethodViewMixin, MethodView):
 
 
 class LessonCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('class_session_id', 'location_id', 'start_at', 'end_at',
+                     'duration')
 
     def get(self, ids=None, cs_id=None):
         if ids is not None:
@@ -205,8 +216,13 @@ class LessonCollectionResource(BaseMethodViewMixin, MethodView):
                 Lesson, LessonSchema.make_dynamic_schema(),
                 {'class_session_id': cs_id})
         else:
-            raise RequestException()
+            return self.response_to_get_page(
+                Lesson, LessonSchema.make_dynamic_schema())
 
+    def patch(self, ids):
+        return self.response_to_bulk_patch(
+            Lesson, lesson_patch_schema,
+            LessonSchema.make_dynamic_schema(), ids)
 
     def post(self):
         json_data = request.get_json()
@@ -231,6 +247,7 @@ class RepeatedLessonResource(BaseMethodViewMixin, MethodView):
 
     def patch(self, id):
         repeated_lesson = self.get_resource_with_ids(RepeatedLesson, id)
+        self.check_if_match(RepeatedLesson, repeated_lesson_schema, id)
         json_data = request.get_json()
         try:
             data = repeated_lesson_patch_schema.load(json_data, partial=True)
@@ -250,10 +267,20 @@ class RepeatedLessonResource(BaseMethodViewMixin, MethodView):
 
 
 class RepeatedLessonCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('class_session_id', 'template_lesson_id', 'location_id',
+                     'start_at', 'end_at', 'duration', 'index_of_rep')
 
-    def get(self, ids):
-        return self.response_to_get_with_ids(RepeatedLesson,
-                                             repeated_lesson_schema, ids)
+    def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(
+                RepeatedLesson, repeated_lesson_schema)
+        return self.response_to_get_with_ids(
+            RepeatedLesson, repeated_lesson_schema, ids)
+
+    def patch(self, ids):
+        return self.response_to_bulk_patch(
+            RepeatedLesson, repeated_lesson_patch_schema,
+            repeated_lesson_schema, ids)
 
     def post(self):
         json_data = request.get_json()
@@ -293,7 +320,7 @@ bp.add_url_rule('/lessons/<int:id>',
                 methods=['GET', 'PATCH'])
 bp.add_url_rule('/lessons/<int_list:ids>',
                 view_func=lesson_collection_view,
-                methods=['GET'])
+                methods=['GET', 'PATCH'])
 bp.add_url_rule('/lessons',
                 view_func=lesson_collection_view,
                 methods=['GET', 'POST'])
@@ -310,7 +337,7 @@ bp.add_url_rule('/repeated-lessons/<int:id>',
                 methods=['GET', 'PATCH'])
 bp.add_url_rule('/repeated-lessons/<int_list:ids>',
                 view_func=repeated_lesson_collection_view,
-                methods=['GET'])
+                methods=['GET', 'PATCH'])
 bp.add_url_rule('/repeated-lessons',
                 view_func=repeated_lesson_collection_view,
                 methods=['GET', 'POST'])
@@ -1,13 +1,150 @@
-from flask import request, g, abort, jsonify
+from datetime import timezone
+from flask import (request, g, abort, jsonify, current_app, json, Response,
+                   stream_with_context)
 from flask.views import MethodView
+from sqlalchemy.exc import IntegrityError
+from werkzeug.http import generate_etag, is_resource_modified
+from app import db
 from app.errors import RequestException
-from app.models import APIConst, Model
-from marshmallow import Schema
+from app.models import APIConst, ConflictError, Model
+from marshmallow import Schema, ValidationError, fields
+from .etags import get_entity_tag
+from .filters import get_filter_criteria
+from .icalendar import get_calendar_etag, iter_calendar
+from .pagination import paginate, next_page_url, keyset_queries
+from .schema_mixins import schemas_by_model
 
 
 class BaseMethodViewMixin(object):
+    # the attributes collection GETs can be filtered by, see filters.py
+    filter_fields = ()
 
-    def get_resource_with_ids(self, item_class, ids):
+    def get_filter_criteria(self, item_class):
+        return get_filter_criteria(item_class, self.filter_fields,
+                                   request.args)
+
+    def get_sparse_fields(self, item_class):
+        """Return the field names asked for by fields[<type>], looking the
+        type up along the class hierarchy of item_class, or None."""
+        for cls in item_class.__mro__:
+            value = request.args.get('fields[{}]'.format(cls.__name__))
+            if value is not None:
+                return [name for name in value.split(',') if name]
+        return None
+
+    def get_loading_profile(self, item_class, schema_or_callable,
+                            default_profile, required_columns=()):
+        """Apply the loading profile selected by the 'profile' and
+        'include' query arguments, or the sparse fieldset selected by
+        'fields[<type>]'.
+
+        Return the schema (or schema callable) restricted accordingly and
+        the loader options item_class has to be queried with.
+        """
+        include = [name for name in request.args.get('include', '').split(',')
+                   if name]
+        profile = request.args.get(
+            'profile', 'summary' if include else default_profile)
+
+        base_schema = schema_or_callable
+        if not isinstance(schema_or_callable, Schema):
+            base_schema = schemas_by_model[item_class]()
+        if profile not in base_schema.__loading_profiles__:
+            raise RequestException(
+                'unknown loading profile {}'.format(profile), 400)
+        unknown_names = set(include) - set(base_schema.nested_field_names)
+        if unknown_names:
+            raise RequestException(
+                '{} cannot be included'.format(', '.join(unknown_names)),
+                400)
+
+        sparse_fields = self.get_sparse_fields(item_class)
+        if sparse_fields is not None:
+            unknown_names = set(sparse_fields) - set(base_schema.fields)
+            if unknown_names:
+                raise RequestException(
+                    '{} {} cannot be selected'.format(
+                        item_class.__name__, ', '.join(unknown_names)),
+                    400)
+
+        def restrict(schema, item_class):
+            fields = self.get_sparse_fields(item_class)
+            if fields is None:
+                return schema.with_profile(profile, include)
+            # only the nested fields listed in fields[<type>] are loaded
+            return schema.with_profile('summary', fields).with_fields(fields)
+
+        schema = restrict(base_schema, item_class)
+        options = schema.get_loader_options(
+            item_class, load_only_dumped=sparse_fields is not None,
+            required_columns=required_columns)
+        if isinstance(schema_or_callable, Schema):
+            return schema, options
+
+        def schema_callable(item):
+            return restrict(schema_or_callable(item), type(item))
+        return schema_callable, options
+
+    def wants_stream(self):
+        return request.args.get('stream', 'false').lower() == 'true'
+
+    def stream_items(self, schema_or_callable, batches):
+        """Respond with a JSON envelope that is written out while batches
+        (an iterable of item iterables) is consumed, dumping each item as
+        it arrives. Only one batch of rows is held in memory at a time."""
+        schema_callable = schema_or_callable
+        if isinstance(schema_or_callable, Schema):
+            schema_callable = (lambda obj: schema_or_callable)
+
+        def generate():
+            yield '{{"{}": ['.format(APIConst.DATA)
+            separator = ''
+            for batch in batches:
+                for item in batch:
+                    yield separator + json.dumps(
+                        schema_callable(item).dump(item))
+                    separator = ','
+            yield ']}'
+        return Response(stream_with_context(generate()),
+                        mimetype='application/json')
+
+    def stream_calendar(self, class_session_ids, lesson_ids=()):
+        """Respond with the iCalendar feed of the class sessions and lessons,
+        written out one class session at a time. The entity tag comes from
+        the row timestamps alone, so an unchanged feed is answered with 304
+        without building it."""
+        etag = get_calendar_etag(class_session_ids, lesson_ids)
+        if not is_resource_modified(request.environ, etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        response = Response(
+            stream_with_context(iter_calendar(class_session_ids, lesson_ids)),
+            mimetype='text/calendar')
+        response.set_etag(etag)
+        return response
+
+    def get_time_window(self):
+        """Return the naive UTC datetimes of the required 'from' and 'to'
+        query arguments, 'from' being before 'to'."""
+        window = []
+        for name in ('from', 'to'):
+            value = request.args.get(name)
+            if value is None:
+                raise RequestException('{} is required'.format(name), 400)
+            try:
+                dt = fields.DateTime().deserialize(value)
+            except ValidationError:
+                raise RequestException(
+                    '{} has to be an ISO 8601 datetime'.format(name), 400)
+            if dt.tzinfo is not None:
+                dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+            window.append(dt)
+        if window[0] >= window[1]:
+            raise RequestException('from has to be before to', 400)
+        return tuple(window)
+
+    def get_resource_with_ids(self, item_class, ids, options=()):
         if ids is None:
             raise RequestException('Bad request', 400)
 
@@ -15,14 +152,19 @@ class BaseMethodViewMixin(object):
             raise ValueError('item_class has to be a subclass of Model', 500)
 
         id_list = ids if isinstance(ids, list) else [ids]
-        items = []
-        for id in id_list:
-            item = item_class.get_with_id(id)
-            if item is None:
-                raise RequestException(
-                    '{} {} could not be found'.format(
-                        item_class.__name__, id), 404)
-            items.append(item)
+        # one IN query for the whole list, then restore the requested order
+        items_by_id = {item.id: item
+                       for item in item_class.get_with_ids(id_list, options)}
+        missing_ids = [id for id in dict.fromkeys(id_list)
+                       if id not in items_by_id]
+        if missing_ids:
+            raise RequestException(
+                '{} {} could not be found'.format(
+                    item_class.__name__,
+                    ', '.join(str(id) for id in missing_ids)),
+                404,
+                {APIConst.MISSING_IDS: missing_ids})
+        items = [items_by_id[id] for id in id_list]
         return items if isinstance(ids, list) else items[0]
 
     def get_resource_with_keyvalue_dict(self, item_class, kv_dict,
@@ -59,25 +201,14 @@ class BaseMethodViewMixin(object):
                     {APIConst.INPUT: kv_dict})
             return items[0]
 
-    def response_to_get_with_ids(self, item_class, schema_or_callable, ids):
-
-        if ids is None:
-            raise RequestException()
-
-        if not issubclass(item_class, Model):
-            raise ValueError('item_class has to be a subclass of Model', 500)
-
+    def dump_items(self, schema_or_callable, items):
         if not isinstance(schema_or_callable, Schema) and not callable(
                 schema_or_callable):
-            print(schema_or_callable)
             raise ValueError(
                 'schema_or_callable has to be an instance of'
                 'marshmallow.Schema'
                 'or a callable that return such an instance.', 500)
 
-        id_list = ids if isinstance(ids, list) else [ids]
-        items = self.get_resource_with_ids(item_class, id_list)
-
         schema_callable = schema_or_callable
         if not callable(schema_or_callable):
             schema_callable = (lambda obj: schema_or_callable)
@@ -86,40 +217,331 @@ class BaseMethodViewMixin(object):
         for item in items:
             item_dict = schema_callable(item).dump(item)
             result.append(item_dict)
+        return result
+
+    def response_to_get_with_ids(self, item_class, schema_or_callable, ids,
+                                 profile='detail'):
+
+        if ids is None:
+            raise RequestException()
+
+        if not issubclass(item_class, Model):
+            raise ValueError('item_class has to be a subclass of Model', 500)
+
+        schema_or_callable, options = self.get_loading_profile(
+            item_class, schema_or_callable, profile)
+        id_list = ids if isinstance(ids, list) else [ids]
+        if isinstance(ids, list) and self.wants_stream():
+            return self.stream_with_ids(item_class, schema_or_callable,
+                                        id_list, options)
+
+        entity_tag = self.get_entity_tag(item_class, schema_or_callable,
+                                         id_list)
+        if entity_tag is not None:
+            etag, last_modified = entity_tag
+            if not is_resource_modified(request.environ, etag,
+                                        last_modified=last_modified):
+                # answered from timestamps alone, nothing is dumped
+                response = Response(status=304)
+                response.set_etag(etag)
+                response.last_modified = last_modified
+                return response
+
+        response = self.render_items(item_class, schema_or_callable, ids,
+                                     options)
+        if entity_tag is not None:
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            return response
+        # without timestamps to go by, the tag is a hash of the body
+        response.add_etag()
+        return response.make_conditional(request)
+
+    def render_items(self, item_class, schema_or_callable, ids, options=()):
+        id_list = ids if isinstance(ids, list) else [ids]
+        items = self.get_resource_with_ids(item_class, id_list, options)
+        result = self.dump_items(schema_or_callable, items)
 
         if not isinstance(ids, list):
             return jsonify({APIConst.DATA: result[0]})
         return jsonify({APIConst.DATA: result})
 
+    def get_entity_tag(self, item_class, schema_or_callable, id_list):
+        """Return the entity tag and last modification time of the items
+        with id_list as read from their timestamps, or None."""
+        if not isinstance(schema_or_callable, Schema):
+            # the dumped relationships depend on the class of each item
+            return None
+        return get_entity_tag(item_class, schema_or_callable, id_list)
+
+    def check_if_match(self, item_class, schema_or_callable, ids):
+        """Refuse to modify the items with ids with a 412 unless the
+        If-Match header names the entity tag of their current detail
+        representation, as returned by a plain GET."""
+        if not request.if_match or request.if_match.star_tag:
+            return
+        schema_or_callable, options = self.get_loading_profile(
+            item_class, schema_or_callable, 'detail')
+        id_list = ids if isinstance(ids, list) else [ids]
+        entity_tag = self.get_entity_tag(item_class, schema_or_callable,
+                                         id_list)
+        if entity_tag is not None:
+            etag = entity_tag[0]
+        else:
+            etag = generate_etag(self.render_items(
+                item_class, schema_or_callable, ids, options).get_data())
+        if not request.if_match.is_strong(etag):
+            raise RequestException(
+                '{} {} has been modified'.format(
+                    item_class.__name__,
+                    ', '.join(str(id) for id in id_list)),
+                412)
+
+    def stream_with_ids(self, item_class, schema_or_callable, id_list,
+                        options):
+        # missing ids have to be reported before the body starts
+        existing_ids = item_class.get_existing_ids(id_list)
+        missing_ids = [id for id in dict.fromkeys(id_list)
+                       if id not in existing_ids]
+        if missing_ids:
+            raise RequestException(
+                '{} {} could not be found'.format(
+                    item_class.__name__,
+                    ', '.join(str(id) for id in missing_ids)),
+                404,
+                {APIConst.MISSING_IDS: missing_ids})
+        batch_size = current_app.config['API_STREAM_BATCH_SIZE']
+
+        def batches():
+            # plain queries rather than get_resource_with_ids, the lookup
+            # cache would hold every streamed item until the request ends
+            query = db.session.query(item_class).options(*options)
+            for start in range(0, len(id_list), batch_size):
+                batch_ids = id_list[start:start + batch_size]
+                items_by_id = {item.id: item for item in query.filter(
+                    item_class.id.in_(batch_ids))}
+                yield [items_by_id[id] for id in batch_ids]
+        return self.stream_items(schema_or_callable, batches())
+
     def response_to_get_with_keyvalue_dict(self, item_class,
                                            schema_or_callable,
                                            kv_dict,
-                                           unique=False):
+                                           unique=False,
+                                           profile='detail'):
         if kv_dict is None:
             raise RequestException()
 
         if not issubclass(item_class, Model):
             raise ValueError('item_class has to be a subclass of Model', 500)
 
-        if not isinstance(schema_or_callable, Schema) and not callable(
-                schema_or_callable):
-            raise ValueError(
-                'schema_or_callable has to be an instance of'
-                'marshmallow.Schema'
-                'or a callable that return such an instance.', 500)
+        if not unique:
+            try:
+                query = db.session.query(item_class).filter_by(**kv_dict)
+            except Exception:
+                raise RequestException(
+                    'query cannot be completed with input data',
+                    400,
+                    {APIConst.INPUT: kv_dict})
+            return self.response_to_get_page(item_class, schema_or_callable,
+                                             query, profile)
 
-        items = self.get_resource_with_keyvalue_dict(item_class, kv_dict,
-                                                     unique)
-        items = [items] if unique else items
-        schema_callable = schema_or_callable
-        if not callable(schema_or_callable):
-            schema_callable = (lambda obj: schema_or_callable)
+        item = self.get_resource_with_keyvalue_dict(item_class, kv_dict,
+                                                    unique)
+        result = self.dump_items(schema_or_callable, [item])
+        return jsonify({APIConst.DATA: result[0]})
 
-        result = []
-        for item in items:
-            item_dict = schema_callable(item).dump(item)
-            result.append(item_dict)
+    def response_to_get_page(self, item_class, schema_or_callable,
+                             query=None, profile='summary'):
+        """Respond with one keyset page of query, ordered by the keyset of
+        item_class and narrowed by the filters in the query arguments. The
+        whole table is paged when query is None.
 
-        if unique:
-            return jsonify({APIConst.DATA: result[0]})
-        return jsonify({APIConst.DATA: result})
+        With ?stream=true every row is streamed instead of one page.
+        """
+        if not issubclass(item_class, Model):
+            raise ValueError('item_class has to be a subclass of Model', 500)
+
+        keyset = item_class.get_keyset()
+        schema_or_callable, options = self.get_loading_profile(
+            item_class, schema_or_callable, profile,
+            required_columns=[attr.key for attr in keyset])
+        if query is None:
+            query = db.session.query(item_class)
+        query = query.filter(*self.get_filter_criteria(item_class))
+        if self.wants_stream():
+            # every row, read from the cursor batch by batch
+            batch_size = current_app.config['API_STREAM_BATCH_SIZE']
+            return self.stream_items(schema_or_callable, [
+                keyset_query.yield_per(batch_size) for keyset_query in
+                keyset_queries(query.options(*options), keyset)])
+        items, continuation_token = paginate(query.options(*options), keyset)
+        result = self.dump_items(schema_or_callable, items)
+
+        return jsonify({
+            APIConst.DATA: result,
+            APIConst.PAGINATION: {
+                APIConst.CONTINUATION_TOKEN: continuation_token,
+                APIConst.NEXT: next_page_url(continuation_token),
+            }
+        })
+
+    def load_bulk(self, schema, json_data):
+        """Validate the objects of json_data as one batch.
+
+        Return the loaded data and the validation errors, both keyed by the
+        index of the object in json_data. Schema level checks skip a batch
+        with field errors, so the objects left are validated again until
+        they all pass.
+        """
+        data_by_index = {}
+        errors = {}
+        indexes = list(range(len(json_data)))
+        while indexes:
+            try:
+                loaded = schema.load([json_data[i] for i in indexes],
+                                     many=True)
+            except ValidationError as err:
+                failed = [indexes[position] for position in err.messages
+                          if isinstance(position, int)]
+                if not failed:
+                    raise RequestException("Invalid input data", 400,
+                                           err.messages)
+                for position in err.messages:
+                    errors[indexes[position]] = err.messages[position]
+                indexes = [i for i in indexes if i not in errors]
+                continue
+            data_by_index.update(zip(indexes, loaded))
+            break
+        return data_by_index, errors
+
+    def response_to_bulk_post(self, item_class, schema, json_data,
+                              check_conflicts=None):
+        """Create one item_class per object of the json_data list.
+
+        The objects are validated in one batch and inserted with one
+        set-based write per table. With ?atomic=true nothing is created
+        unless every object is; otherwise the valid objects are created and
+        the response carries the outcome of each object, in input order.
+
+        check_conflicts, if given, takes the loaded data by index and
+        returns the errors by index of objects clashing with stored rows.
+        """
+        if not issubclass(item_class, Model):
+            raise ValueError('item_class has to be a subclass of Model', 500)
+        max_size = current_app.config['API_MAX_BULK_SIZE']
+        if len(json_data) > max_size:
+            raise RequestException(
+                'at most {} items can be created at once'.format(max_size),
+                413)
+        atomic = request.args.get('atomic', 'false').lower() == 'true'
+
+        data_by_index, errors = self.load_bulk(schema, json_data)
+        conflicts = {}
+        if check_conflicts is not None and data_by_index:
+            conflicts = check_conflicts(data_by_index)
+            for i in conflicts:
+                data_by_index.pop(i, None)
+        if atomic and (errors or conflicts):
+            errors.update(conflicts)
+            raise RequestException("Invalid input data", 400,
+                                   {APIConst.ERRORS: errors})
+
+        indexes = sorted(data_by_index)
+        try:
+            ids = item_class.bulk_create(
+                [data_by_index[i] for i in indexes])
+            ids_by_index = dict(zip(indexes, ids))
+        except (IntegrityError, ConflictError):
+            db.session.rollback()
+            if atomic:
+                raise RequestException(
+                    '{} conflict with existing data'.format(
+                        item_class.__tablename__), 409)
+            # find the offending objects by creating them one at a time
+            ids_by_index = {}
+            for i in indexes:
+                try:
+                    ids_by_index[i] = item_class.bulk_create(
+                        [data_by_index[i]])[0]
+                except IntegrityError:
+                    db.session.rollback()
+                    conflicts[i] = {'_schema': [
+                        'conflicts with existing data']}
+                except ConflictError as err:
+                    db.session.rollback()
+                    conflicts[i] = {'_schema': [str(err)]}
+
+        schema, options = self.get_loading_profile(item_class, schema,
+                                                   'summary')
+        items_by_id = {item.id: item for item in item_class.get_with_ids(
+            list(ids_by_index.values()), options)}
+        results = []
+        for i in range(len(json_data)):
+            if i in ids_by_index:
+                results.append({
+                    APIConst.INDEX: i,
+                    APIConst.STATUS: 201,
+                    APIConst.DATA: schema.dump(items_by_id[ids_by_index[i]])})
+            elif i in conflicts:
+                results.append({APIConst.INDEX: i,
+                                APIConst.STATUS: 409,
+                                APIConst.ERRORS: conflicts[i]})
+            else:
+                results.append({APIConst.INDEX: i,
+                                APIConst.STATUS: 400,
+                                APIConst.ERRORS: errors[i]})
+        response = jsonify({
+            APIConst.MESSAGE: 'created {} of {} {}'.format(
+                len(ids_by_index), len(json_data), item_class.__tablename__),
+            APIConst.DATA: results})
+        response.status_code = 207 if errors or conflicts else 200
+        return response
+
+    def response_to_bulk_patch(self, item_class, patch_schema,
+                               schema_or_callable, ids):
+        """Apply the change set in the request body to every item_class
+        with ids using one UPDATE statement, and respond with the updated
+        items."""
+        if not issubclass(item_class, Model):
+            raise ValueError('item_class has to be a subclass of Model', 500)
+        self.check_if_match(item_class, schema_or_callable, ids)
+        json_data = request.get_json()
+        if not json_data:
+            raise RequestException("No input data", 400)
+        try:
+            data = patch_schema.load(json_data, partial=True)
+        except ValidationError as err:
+            raise RequestException("Invalid input data", 400, err.messages)
+
+        existing_ids = item_class.get_existing_ids(ids)
+        missing_ids = [id for id in dict.fromkeys(ids)
+                       if id not in existing_ids]
+        if missing_ids:
+            raise RequestException(
+                '{} {} could not be found'.format(
+                    item_class.__name__,
+                    ', '.join(str(id) for id in missing_ids)),
+                404,
+                {APIConst.MISSING_IDS: missing_ids})
+        try:
+            item_class.bulk_update(ids, data)
+        except ValueError as err:
+            raise RequestException(str(err), 400,
+                                   {APIConst.INPUT: json_data})
+        except IntegrityError:
+            db.session.rollback()
+            raise RequestException(
+                'update conflicts with existing data', 409,
+                {APIConst.INPUT: json_data})
+        except ConflictError as err:
+            db.session.rollback()
+            raise RequestException(str(err), 409,
+                                   {APIConst.INPUT: json_data})
+
+        schema_or_callable, options = self.get_loading_profile(
+            item_class, schema_or_callable, 'detail')
+        items = self.get_resource_with_ids(item_class, ids, options)
+        return jsonify({
+            APIConst.MESSAGE: 'updated {} {}'.format(
+                len(items), item_class.__tablename__),
+            APIConst.DATA: self.dump_items(schema_or_callable, items)})
@@ -1,8 +1,7 @@
 from flask import request, g, abort, jsonify
 from flask.views import MethodView
 from sqlalchemy.exc import IntegrityError
-from marshmallow import (Schema, fields, validate, ValidationError,
-                         validates_schema)
+from marshmallow import Schema, fields, validate, ValidationError
 from app.errors.request_exception import RequestException
 from app.models import (APIConst, Person, User, Notification,
                         NotificationDelivery)
@@ -14,6 +13,10 @@ from .method_view_mixins import BaseMethodViewMixin
 class NotificationDeliverySchema(BaseSchemaMixin,
                                  TimestampSchemaMixin, Schema):
     __model__ = NotificationDelivery
+    __related_ids__ = {
+        'notification_id': Notification,
+        'receiver_id': Person,
+    }
     notification_id = fields.Integer(
         required=True,
         validate=validate.Range(min=1),
@@ -31,16 +34,10 @@ class NotificationDeliverySchema(BaseSchemaMixin,
         dump_only=True,
     )
 
-    @validates_schema
-    def validate_related_ids(self, data):
-        self.validate_item_existence_with_id(Notification,
-                                             data.get('notification_id'))
-        self.validate_item_existence_with_id(Person,
-                                             data.get('receiver_id'))
-
 
 class NotificationSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
     __model__ = Notification
+    __related_ids__ = {'sender_id': Person}
     content = fields.String(
         required=True,
         validate=validate.Length(min=1, max=200),
@@ -58,11 +55,6 @@ class NotificationSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
         dump_only=True,
     )
 
-    @validates_schema
-    def validate_sender_id(self, data):
-        self.validate_item_existence_with_id(Person,
-                                             data.get('sender_id'))
-
 
 notif_delivery_schema = NotificationDeliverySchema()
 notif_deliveries_schema = NotificationDeliverySchema(many=True)
@@ -77,8 +69,12 @@ class NotifDeliveryResource(BaseMethodViewMixin, MethodView):
 
 
 class NotifDeliveryCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('notification_id', 'receiver_id', 'delivered_at')
 
-    def get(self, ids):
+    def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(
+                NotificationDelivery, notif_delivery_schema)
         return self.response_to_get_with_ids(
             NotificationDelivery, notif_delivery_schema, ids)
 
@@ -86,6 +82,9 @@ class NotifDeliveryCollectionResource(BaseMethodViewMixin, MethodView):
         json_data = request.get_json()
         if not json_data:
             raise RequestException("No input data", 400)
+        if isinstance(json_data, list):
+            return self.response_to_bulk_post(
+                NotificationDelivery, notif_delivery_schema, json_data)
         try:
             data = notif_delivery_schema.load(json_data)
         except ValidationError as err:
@@ -105,8 +104,11 @@ class NotificationResource(BaseMethodViewMixin, MethodView):
 
 
 class NotificationCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('sender_id',)
 
-    def get(self, ids):
+    def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(Notification, notification_schema)
         return self.response_to_get_with_ids(
             Notification, notification_schema, ids)
 
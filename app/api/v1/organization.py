@@ -1,8 +1,7 @@
 from flask import request, g, abort, jsonify
 from flask.views import MethodView
 from sqlalchemy.exc import IntegrityError
-from marshmallow import (Schema, fields, validate, ValidationError,
-                         validates_schema)
+from marshmallow import Schema, fields, validate, ValidationError
 from app.errors.request_exception import RequestException
 from app.models import (APIConst, Organization, OrganizationPersonAssociation,
                         User, Person)
@@ -13,6 +12,11 @@ from .method_view_mixins import BaseMethodViewMixin
 
 class OrganizationPersonSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
     __model__ = OrganizationPersonAssociation
+    __related_ids__ = {
+        'initiator_id': User,
+        'organization_id': Organization,
+        'associated_person_id': Person,
+    }
     organization_id = fields.Integer(
         requried=True,
         validate=validate.Range(min=1),
@@ -37,17 +41,10 @@ class OrganizationPersonSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
         dump_only=True,
     )
 
-    @validates_schema
-    def validate_related_ids(self, data):
-        self.validate_item_existence_with_id(User, data.get('initiator_id'))
-        self.validate_item_existence_with_id(Organization,
-                                             data.get('organization_id'))
-        self.validate_item_existence_with_id(Person,
-                                             data.get('associated_person_id'))
-
 
 class OrganizationSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
     __model__ = Organization
+    __related_ids__ = {'creator_id': User}
     name = fields.String(required=True,
                          validate=validate.Length(min=1, max=100))
     creator_id = fields.Integer(required=True, validate=validate.Range(min=1))
@@ -63,10 +60,6 @@ class OrganizationSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
         dump_only=True,
     )
 
-    @validates_schema
-    def validate_creator_id(self, data):
-        self.validate_item_existence_with_id(User, data.get('creator_id'))
-
 
 orgper_schema = OrganizationPersonSchema()
 orgpers_schema = OrganizationPersonSchema(many=True)
@@ -87,6 +80,7 @@ class OrganizationPersonResource(BaseMethodViewMixin, MethodView):
 
     def patch(self, id):
         orgper = self.get_resource_with_ids(OrganizationPersonAssociation, id)
+        self.check_if_match(OrganizationPersonAssociation, orgper_schema, id)
         json_data = request.get_json()
         try:
             data = orgper_patch_schema.load(json_data)
@@ -107,15 +101,27 @@ class OrganizationPersonResource(BaseMethodViewMixin, MethodView):
 
 
 class OrganizationPersonCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('organization_id', 'associated_person_id', 'terminated')
 
-    def get(self, ids):
+    def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(
+                OrganizationPersonAssociation, orgper_schema)
         return self.response_to_get_with_ids(
             OrganizationPersonAssociation, orgper_schema, ids)
 
+    def patch(self, ids):
+        return self.response_to_bulk_patch(
+            OrganizationPersonAssociation, orgper_patch_schema,
+            orgper_schema, ids)
+
     def post(self):
         json_data = request.get_json()
         if not json_data:
             raise RequestException("No input data", 400)
+        if isinstance(json_data, list):
+            return self.response_to_bulk_post(
+                OrganizationPersonAssociation, orgper_schema, json_data)
         try:
             data = orgper_schema.load(json_data)
         except ValidationError as err:
@@ -136,6 +142,7 @@ class OrganizationResource(BaseMethodViewMixin, MethodView):
 
     def patch(self, id):
         organization = self.get_resource_with_ids(Organization, id)
+        self.check_if_match(Organization, organization_schema, id)
         json_data = request.get_json()
         try:
             data = organization_patch_schema.load(json_data)
@@ -155,11 +162,18 @@ class OrganizationResource(BaseMethodViewMixin, MethodView):
 
 
 class OrganizationCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('name',)
 
-    def get(self, ids):
+    def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(Organization, organization_schema)
         return self.response_to_get_with_ids(
             Organization, organization_schema, ids)
 
+    def patch(self, ids):
+        return self.response_to_bulk_patch(
+            Organization, organization_patch_schema, organization_schema, ids)
+
     def post(self):
         json_data = request.get_json()
         if not json_data:
@@ -186,7 +200,7 @@ bp.add_url_rule('/org-per-assns/<int:id>',
                 methods=['GET', 'PATCH'])
 bp.add_url_rule('/org-per-assns/<int_list:ids>',
                 view_func=orgper_collection_view,
-                methods=['GET'])
+                methods=['GET', 'PATCH'])
 bp.add_url_rule('/org-per-assns',
                 view_func=orgper_collection_view,
                 methods=['GET', 'POST'])
@@ -199,7 +213,7 @@ bp.add_url_rule('/organizations/<int:id>',
                 methods=['GET', 'PATCH'])
 bp.add_url_rule('/organizations/<int_list:ids>',
                 view_func=organization_collection_view,
-                methods=['GET'])
+                methods=['GET', 'PATCH'])
 bp.add_url_rule('/organizations',
                 view_func=organization_collection_view,
                 methods=['GET', 'POST'])
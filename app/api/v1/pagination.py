@@ -0,0 +1,119 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from flask import request, current_app, url_for
+from app import db
+from app.errors import RequestException
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def get_page_limit():
+    limit = request.args.get('limit', current_app.config['API_PAGE_SIZE'])
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise RequestException('limit has to be an integer', 400)
+    if limit < 1:
+        raise RequestException('limit has to be positive', 400)
+    return min(limit, current_app.config['API_MAX_PAGE_SIZE'])
+
+
+def keyset_column(attr):
+    return attr.property.columns[0]
+
+
+def encode_continuation_token(keyset, item):
+    values = []
+    for attr in keyset:
+        value = getattr(item, attr.key)
+        if isinstance(value, datetime):
+            value = value.strftime(DATETIME_FORMAT)
+        values.append(value)
+    token = json.dumps({'k': [attr.key for attr in keyset], 'v': values})
+    return base64.urlsafe_b64encode(token.encode()).decode()
+
+
+def decode_continuation_token(keyset, token):
+    try:
+        token = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        if token['k'] != [attr.key for attr in keyset]:
+            raise ValueError('token was issued for another ordering')
+        values = []
+        for attr, value in zip(keyset, token['v']):
+            if (value is not None and
+                    isinstance(keyset_column(attr).type, db.DateTime)):
+                value = datetime.strptime(value, DATETIME_FORMAT)
+            values.append(value)
+        return values
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        raise RequestException('Invalid continuation token', 400)
+
+
+def keyset_filter(keyset, values):
+    """Build the "row comes after values" condition for keyset ordering."""
+    attr, value = keyset[0], values[0]
+    after = attr > value
+    if len(keyset) == 1:
+        return after
+    return db.or_(after, db.and_(attr == value,
+                                 keyset_filter(keyset[1:], values[1:])))
+
+
+def keyset_queries(query, keyset, values=None):
+    """Return the queries reading the rows of query after values, or all
+    of them without values, in keyset order.
+
+    Each query orders by plain keyset columns, so an index on them returns
+    the rows in order. When the first keyset column is nullable, the rows
+    where it is NULL come first, read by a query of their own; the other
+    keyset columns cannot be NULL.
+    """
+    first = keyset[0]
+    if not keyset_column(first).nullable:
+        if values is not None:
+            query = query.filter(keyset_filter(keyset, values))
+        return [query.order_by(*keyset)]
+    queries = []
+    if values is None or values[0] is None:
+        nulls = query.filter(first.is_(None))
+        if values is not None:
+            nulls = nulls.filter(keyset_filter(keyset[1:], values[1:]))
+        queries.append(nulls.order_by(*keyset[1:]))
+        values = None
+    rest = query.filter(first.isnot(None))
+    if values is not None:
+        rest = rest.filter(keyset_filter(keyset, values))
+    queries.append(rest.order_by(*keyset))
+    return queries
+
+
+def paginate(query, keyset):
+    """Return one page of query results and the token for the next one.
+
+    The page is located with a keyset condition instead of an OFFSET, so
+    fetching the last page costs the same as fetching the first one.
+    """
+    limit = get_page_limit()
+    token = request.args.get('continuation_token')
+    values = decode_continuation_token(keyset, token) if token else None
+    items = []
+    for page_query in keyset_queries(query, keyset, values):
+        items.extend(page_query.limit(limit + 1 - len(items)).all())
+        if len(items) > limit:
+            break
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_continuation_token(keyset, items[-1])
+
+
+def next_page_url(continuation_token):
+    if continuation_token is None:
+        return None
+    # every value of repeated arguments, the filters AND them
+    args = request.args.to_dict(flat=False)
+    args.update(request.view_args or {})
+    args['continuation_token'] = continuation_token
+    return url_for(request.endpoint, **args)
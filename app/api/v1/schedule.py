@@ -1,8 +1,7 @@
 from flask import request, g, abort, jsonify
 from flask.views import MethodView
 from sqlalchemy.exc import IntegrityError
-from marshmallow import (Schema, fields, validate, ValidationError,
-                         validates_schema)
+from marshmallow import Schema, fields, validate, ValidationError
 from app.errors.request_exception import RequestException
 from app.models import APIConst, TimeSlot, Schedule
 from . import bp
@@ -13,15 +12,11 @@ from app.models import RepeatOption
 
 class TimeSlotSchema(BaseSchemaMixin, Schema):
     __model__ = TimeSlot
+    __related_ids__ = {'schedule_id': Schedule}
     start_at = fields.DateTime(required=True)
     duration = fields.Integer(required=True, validate=validate.Range(min=0))
     schedule_id = fields.Integer(validate=validate.Range(min=1))
 
-    @validates_schema
-    def validate_sender_id(self, data):
-        self.validate_item_existence_with_id(Schedule,
-                                             data.get('schedule_id'))
-
 
 class ScheduleSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
     __model__ = Schedule
@@ -61,11 +56,19 @@ class ScheduleSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
         return de_data if many else de_data[0]
 
 
+class OccurrenceSchema(Schema):
+    start_at = fields.DateTime()
+    duration = fields.Integer()
+    base_slot_id = fields.Integer()
+    repeat_num = fields.Integer()
+
+
 timeslot_schema = TimeSlotSchema()
 timeslots_schema = TimeSlotSchema(many=True)
 timeslot_patch_schema = TimeSlotSchema(exclude=['schedule_id'])
 schedule_schema = ScheduleSchema()
 schedule_patch_schema = ScheduleSchema()
+occurrences_schema = OccurrenceSchema(many=True)
 
 
 class TimeSlotResource(BaseMethodViewMixin, MethodView):
@@ -75,6 +78,7 @@ class TimeSlotResource(BaseMethodViewMixin, MethodView):
 
     def patch(self, id):
         timeslot = self.get_resource_with_ids(TimeSlot, id)
+        self.check_if_match(TimeSlot, timeslot_schema, id)
         json_data = request.get_json()
         try:
             data = timeslot_patch_schema.load(json_data, partial=True)
@@ -93,8 +97,11 @@ class TimeSlotResource(BaseMethodViewMixin, MethodView):
 
 
 class TimeSlotCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('schedule_id', 'start_at', 'duration')
 
-    def get(self, ids):
+    def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(TimeSlot, timeslot_schema)
         return self.response_to_get_with_ids(TimeSlot, timeslot_schema, ids)
 
     def post(self):
@@ -120,6 +127,7 @@ class ScheduleResource(BaseMethodViewMixin, MethodView):
 
     def patch(self, id):
         schedule = self.get_resource_with_ids(Schedule, id)
+        self.check_if_match(Schedule, schedule_schema, id)
         json_data = request.get_json()
         try:
             data = schedule_patch_schema.load(json_data, partial=True)
@@ -138,8 +146,11 @@ class ScheduleResource(BaseMethodViewMixin, MethodView):
 
 
 class ScheduleCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('repeat_option', 'repeat_end_at')
 
-    def get(self, ids):
+    def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(Schedule, schedule_schema)
         return self.response_to_get_with_ids(Schedule, schedule_schema, ids)
 
     def post(self):
@@ -159,6 +170,16 @@ class ScheduleCollectionResource(BaseMethodViewMixin, MethodView):
         return response
 
 
+class ScheduleOccurrenceResource(BaseMethodViewMixin, MethodView):
+
+    def get(self, id):
+        schedule = self.get_resource_with_ids(Schedule, id)
+        start, end = self.get_time_window()
+        result = occurrences_schema.dump(
+            schedule.occurrences_between(start, end))
+        return jsonify({APIConst.DATA: result})
+
+
 timeslot_view = TimeSlotResource.as_view('timeslot_api')
 timeslot_collection_view = TimeSlotCollectionResource.as_view(
     'timeslot_collection_api')
@@ -185,3 +206,9 @@ bp.add_url_rule('/schedules/<int_list:ids>',
 bp.add_url_rule('/schedules',
                 view_func=schedule_collection_view,
                 methods=['GET', 'POST'])
+
+schedule_occurrence_view = ScheduleOccurrenceResource.as_view(
+    'schedule_occurrence_api')
+bp.add_url_rule('/schedules/<int:id>/occurrences',
+                view_func=schedule_occurrence_view,
+                methods=['GET'])
@@ -1,26 +1,178 @@
-from marshmallow import (Schema, fields, validate, ValidationError, pprint)
+from collections import defaultdict
+from marshmallow import (Schema, fields, validate, ValidationError, pprint,
+                         validates_schema)
+from sqlalchemy import inspect
+from sqlalchemy.orm import (selectinload, joinedload, noload, load_only,
+                            selectin_polymorphic)
 from app.models import Model
 
+#  Model class -> schema class serializing it
+schemas_by_model = {}
+#  (schema class, fields) -> schema instance restricted to those fields
+_restricted_schemas = {}
+
 
 class BaseSchemaMixin(object):
     #  To be set by sub class
     __model__ = None
+    #  Maps id fields to the Model class they reference,
+    #  to be set by sub class
+    __related_ids__ = {}
+    #  Nested fields dumped by each loading profile, None meaning all
+    __loading_profiles__ = {
+        'summary': (),
+        'detail': None,
+    }
     id = fields.Integer(dump_only=True)
     _type = fields.Method('get_type', dump_only=True)
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.__model__ is not None:
+            schemas_by_model[cls.__model__] = cls
+
     def get_type(self, obj):
         return self.__model__.__name__
 
-    def validate_item_existence_with_id(self, item_class, id):
-        if id is None:
+    @property
+    def nested_field_names(self):
+        return [name for name, field in self.fields.items()
+                if isinstance(field, fields.Nested)]
+
+    def with_profile(self, profile, include=()):
+        """Return a schema dumping the fields of this one, minus the nested
+        fields that neither the loading profile nor include ask for."""
+        nested_names = self.__loading_profiles__[profile]
+        if nested_names is None and not include:
+            return self
+        kept_nested = set(include)
+        kept_nested.update(self.nested_field_names if nested_names is None
+                           else nested_names)
+        return self.restricted_to(
+            name for name in self.fields
+            if name not in self.nested_field_names or name in kept_nested)
+
+    def with_fields(self, field_names):
+        """Return a schema dumping only field_names, plus id and _type."""
+        field_names = set(field_names) | {'id', '_type'}
+        return self.restricted_to(
+            name for name in self.fields if name in field_names)
+
+    def restricted_to(self, field_names):
+        only = frozenset(field_names)
+        if only == frozenset(self.fields):
+            return self
+        key = (type(self), only, self.many)
+        if key not in _restricted_schemas:
+            _restricted_schemas[key] = type(self)(only=only, many=self.many)
+        return _restricted_schemas[key]
+
+    def get_loader_paths(self, model):
+        paths = []
+        mapper = inspect(model)
+        for name, field in self.fields.items():
+            if (not isinstance(field, fields.Nested)
+                    or name not in mapper.relationships):
+                continue
+            relationship = mapper.relationships[name]
+            if relationship.lazy == 'dynamic':
+                continue
+            step = (getattr(model, name), relationship.uselist)
+            paths.append([step])
+            nested_schema = field.schema
+            if isinstance(nested_schema, BaseSchemaMixin):
+                for sub_path in nested_schema.get_loader_paths(
+                        relationship.mapper.class_):
+                    paths.append([step] + sub_path)
+        return paths
+
+    def get_loader_options(self, model=None, load_only_dumped=False,
+                           required_columns=()):
+        """Loader options that eagerly load exactly the relationships this
+        schema dumps: selectinload for collections, joinedload for many to
+        one, and noload for the relationships it does not dump.
+
+        With load_only_dumped, the columns this schema does not dump are
+        not selected either, except for the required_columns.
+        """
+        model = model or self.__model__
+        options = []
+        for path in self.get_loader_paths(model):
+            option = None
+            for attr, uselist in path:
+                if option is None:
+                    option = (selectinload(attr) if uselist
+                              else joinedload(attr))
+                else:
+                    option = (option.selectinload(attr) if uselist
+                              else option.joinedload(attr))
+            options.append(option)
+
+        mapper = inspect(model)
+        dumped_names = set(self.fields)
+        for relationship in mapper.relationships:
+            if (relationship.key not in dumped_names
+                    and relationship.lazy != 'dynamic'):
+                options.append(noload(getattr(model, relationship.key)))
+
+        # load the tables of joined inheritance sub classes in one query
+        # per sub class instead of one query per polymorphic row
+        sub_classes = [sub_mapper.class_
+                       for sub_mapper in mapper.self_and_descendants
+                       if sub_mapper.local_table is not mapper.local_table]
+        if sub_classes:
+            options.append(selectin_polymorphic(model, sub_classes))
+
+        if load_only_dumped:
+            column_names = [prop.key for prop in mapper.column_attrs
+                            if prop.key in dumped_names
+                            or prop.key in required_columns]
+            if mapper.polymorphic_on is not None:
+                column_names.append(mapper.get_property_by_column(
+                    mapper.polymorphic_on).key)
+            options.append(load_only(*column_names))
+        return options
+
+    @validates_schema(pass_many=True)
+    def validate_related_ids(self, data, many):
+        """Check that every id referenced through __related_ids__ exists.
+
+        The ids of the whole payload are collected per Model class first,
+        so each class is resolved with a single IN query no matter how
+        many items are loaded.
+        """
+        if not self.__related_ids__:
             return
-        if not issubclass(item_class, Model):
-            raise ValueError('item_class has to be a subclass of Model', 500)
+        items = data if many else [data]
+
+        ids_per_class = defaultdict(set)
+        for item in items:
+            for field_name, item_class in self.__related_ids__.items():
+                id = item.get(field_name)
+                if id is not None:
+                    ids_per_class[item_class].add(id)
+
+        existing_ids = {}
+        for item_class, ids in ids_per_class.items():
+            if not issubclass(item_class, Model):
+                raise ValueError(
+                    'item_class has to be a subclass of Model', 500)
+            existing_ids[item_class] = item_class.get_existing_ids(ids)
 
-        item = item_class.get_with_id(id)
-        if item is None:
-            raise ValidationError('{} {} cannot be found'.format(
-                item_class.__name__, id))
+        errors = {}
+        for index, item in enumerate(items):
+            item_errors = {}
+            for field_name, item_class in self.__related_ids__.items():
+                id = item.get(field_name)
+                if id is not None and id not in existing_ids[item_class]:
+                    item_errors[field_name] = ['{} {} cannot be found'.format(
+                        item_class.__name__, id)]
+            if item_errors and many:
+                errors[index] = item_errors
+            elif item_errors:
+                errors.update(item_errors)
+        if errors:
+            raise ValidationError(errors)
 
 
 class TimestampSchemaMixin(object):
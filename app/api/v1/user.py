@@ -1,11 +1,12 @@
 from flask import request, g, abort, jsonify
 from flask.views import MethodView
-from marshmallow import (Schema, fields, validate, ValidationError,
-                         validates_schema)
+from marshmallow import Schema, fields, validate, ValidationError
+from app import db
 from app.errors import RequestException
-from app.models import APIConst, User, Person, Dependent
+from app.models import APIConst, User, Person, Dependent, Lesson
 from .schema_mixins import BaseSchemaMixin, TimestampSchemaMixin
 from .method_view_mixins import BaseMethodViewMixin
+from .icalendar import get_person_calendar_ids
 from . import bp
 
 
@@ -65,13 +66,10 @@ class PersonSchema(BaseSchemaMixin, TimestampSchemaMixin, Schema):
 
 class DependentSchema(PersonSchema):
     __model__ = Dependent
+    __related_ids__ = {'dependency_id': User}
     dependency_id = fields.Integer(required=True,
                                    validate=validate.Range(min=1))
 
-    @validates_schema
-    def validate_creator_id(self, data):
-        self.validate_item_existence_with_id(User, data.get('dependency_id'))
-
 
 class UserSchema(PersonSchema):
     __model__ = User
@@ -118,12 +116,51 @@ class UserSchema(PersonSchema):
     #              email))
 
 
+class CalendarEntrySchema(Schema):
+    lesson_id = fields.Integer()
+    start_at = fields.DateTime()
+    duration = fields.Integer()
+    class_session_id = fields.Integer()
+    location_id = fields.Integer()
+    role = fields.String()
+
+
+class ConflictSchema(Schema):
+    lesson_ids = fields.List(fields.Integer())
+    start_at = fields.DateTime()
+    end_at = fields.DateTime()
+
+
 user_schema = UserSchema()
 users_schema = UserSchema(many=True)
 user_patch_schema = UserSchema(exclude=['username'])
 dependent_schema = DependentSchema()
 dependents_schema = DependentSchema(many=True)
 dependent_patch_schema = DependentSchema()
+calendar_entries_schema = CalendarEntrySchema(many=True)
+conflicts_schema = ConflictSchema(many=True)
+
+
+def check_user_conflicts(data_by_index):
+    """Return the errors by index of new users whose username or email is
+    taken, by a stored user or by an earlier user of the same batch."""
+    taken = {}
+    for key in ('username', 'email'):
+        column = getattr(User, key)
+        values = [data[key] for data in data_by_index.values()]
+        taken[key] = {value for (value,) in db.session.query(column).filter(
+            column.in_(values))}
+    conflicts = {}
+    for i in sorted(data_by_index):
+        data = data_by_index[i]
+        for key in ('username', 'email'):
+            if data[key] in taken[key]:
+                conflicts.setdefault(i, {})[key] = [
+                    "{} '{}' has been taken".format(key, data[key])]
+        if i not in conflicts:
+            for key in ('username', 'email'):
+                taken[key].add(data[key])
+    return conflicts
 
 
 class PersonResource(BaseMethodViewMixin, MethodView):
@@ -134,12 +171,44 @@ class PersonResource(BaseMethodViewMixin, MethodView):
 
 
 class PersonCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('first_name', 'last_name')
 
-    def get(self, ids):
+    def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(
+                Person, PersonSchema.make_dynamic_schema())
         return self.response_to_get_with_ids(
             Person, PersonSchema.make_dynamic_schema(), ids)
 
 
+class PersonCalendarResource(BaseMethodViewMixin, MethodView):
+
+    def get(self, id):
+        self.get_resource_with_ids(Person, id)
+        start, end = self.get_time_window()
+        result = calendar_entries_schema.dump(
+            Lesson.get_calendar(id, start, end))
+        return jsonify({APIConst.DATA: result})
+
+
+class PersonICalendarResource(BaseMethodViewMixin, MethodView):
+
+    def get(self, id):
+        self.get_resource_with_ids(Person, id)
+        return self.stream_calendar(*get_person_calendar_ids(id))
+
+
+class PersonConflictResource(BaseMethodViewMixin, MethodView):
+
+    def get(self, id):
+        self.get_resource_with_ids(Person, id)
+        conflicts = [
+            dict(lesson_ids=[first.key, second.key], start_at=second.start,
+                 end_at=min(first.end, second.end))
+            for first, second in Lesson.get_instructor_index(id).conflicts()]
+        return jsonify({APIConst.DATA: conflicts_schema.dump(conflicts)})
+
+
 class DependentResource(BaseMethodViewMixin, MethodView):
 
     def get(self, id):
@@ -148,6 +217,7 @@ class DependentResource(BaseMethodViewMixin, MethodView):
 
     def patch(self, id):
         dependent = self.get_resource_with_ids(Dependent, id)
+        self.check_if_match(Dependent, dependent_schema, id)
         json_data = request.get_json()
         try:
             data = dependent_patch_schema.load(json_data, partial=True)
@@ -166,14 +236,20 @@ class DependentResource(BaseMethodViewMixin, MethodView):
 
 
 class DependentCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('dependency_id', 'first_name', 'last_name')
 
-    def get(self, ids):
+    def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(Dependent, dependent_schema)
         return self.response_to_get_with_ids(Dependent, dependent_schema, ids)
 
     def post(self):
         json_data = request.get_json()
         if not json_data:
             raise RequestException("No input data", 400)
+        if isinstance(json_data, list):
+            return self.response_to_bulk_post(
+                Dependent, dependent_schema, json_data)
         try:
             data = dependent_schema.load(json_data)
         except ValidationError as err:
@@ -202,6 +278,7 @@ class UserResource(BaseMethodViewMixin, MethodView):
             user = self.get_resource_with_keyvalue_dict(User,
                                                         {'username': username},
                                                         unique=True)
+        self.check_if_match(User, user_schema, user.id)
         json_data = request.get_json()
         try:
             data = user_patch_schema.load(json_data, partial=True)
@@ -237,13 +314,20 @@ class UserResource(BaseMethodViewMixin, MethodView):
 
 
 class UserCollectionResource(BaseMethodViewMixin, MethodView):
+    filter_fields = ('first_name', 'last_name')
+
     def get(self, ids=None):
+        if ids is None:
+            return self.response_to_get_page(User, user_schema)
         return self.response_to_get_with_ids(User, user_schema, ids)
 
     def post(self):
         json_data = request.get_json()
         if not json_data:
             raise RequestException("No input data", 400)
+        if isinstance(json_data, list):
+            return self.response_to_bulk_post(
+                User, user_schema, json_data, check_user_conflicts)
         try:
             data = user_schema.load(json_data)
         except ValidationError as err:
@@ -275,6 +359,22 @@ bp.add_url_rule('/persons',
                 view_func=person_collection_view,
                 methods=['GET', 'POST'])
 
+person_calendar_view = PersonCalendarResource.as_view('person_calendar_api')
+bp.add_url_rule('/persons/<int:id>/calendar',
+                view_func=person_calendar_view,
+                methods=['GET'])
+
+person_icalendar_view = PersonICalendarResource.as_view(
+    'person_icalendar_api')
+bp.add_url_rule('/persons/<int:id>/calendar.ics',
+                view_func=person_icalendar_view,
+                methods=['GET'])
+
+person_conflict_view = PersonConflictResource.as_view('person_conflict_api')
+bp.add_url_rule('/persons/<int:id>/conflicts',
+                view_func=person_conflict_view,
+                methods=['GET'])
+
 dependent_view = DependentResource.as_view('dependent_api')
 dependent_collection_view = DependentCollectionResource.as_view(
     'dependent_collection_api')
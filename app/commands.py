@@ -0,0 +1,82 @@
+"""Maintenance commands, run with the flask command line:
+
+    FLASK_APP=app:create_app flask reconcile-counters
+    FLASK_APP=app:create_app flask index-advisor
+    FLASK_APP=app:create_app flask run-jobs
+"""
+import click
+from flask.cli import with_appcontext
+from app import db
+from app.jobs import job_queue
+from app.models.counters import RowCount
+from app.models.query_plans import find_full_scans, hot_queries
+
+
+@click.command('reconcile-counters')
+@click.option('--dry-run', is_flag=True,
+              help='Report the drift without repairing it.')
+@with_appcontext
+def reconcile_counters_command(dry_run):
+    """Repair the denormalized counter columns that drifted from the rows
+    they count."""
+    connection = db.session.connection()
+    for row_count in RowCount.instances:
+        if dry_run:
+            drift = row_count.get_drift(connection)
+        else:
+            drift = row_count.reconcile(connection)
+        click.echo('{}: {} {}'.format(
+            row_count.name, len(drift),
+            'drifted' if dry_run else 'repaired'))
+        for id, stored, actual in drift:
+            click.echo('  {} {} -> {}'.format(id, stored, actual))
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+
+
+@click.command('index-advisor')
+@click.option('--verbose', is_flag=True,
+              help='Print the plan of every query, not only of the flagged '
+                   'ones.')
+@with_appcontext
+def index_advisor_command(verbose):
+    """Explain the hot queries and flag the tables they read in full.
+    Exits with status 1 when a query scans a table."""
+    connection = db.session.connection()
+    flagged = 0
+    for name, build in hot_queries.items():
+        tables, plan = find_full_scans(connection, build())
+        if tables:
+            flagged += 1
+            click.echo('{}: full scan of {}'.format(name, ', '.join(tables)))
+        else:
+            click.echo('{}: ok'.format(name))
+        if tables or verbose:
+            for line in plan:
+                click.echo('  {}'.format(line))
+    db.session.rollback()
+    click.echo('{} of {} queries scan a table'.format(
+        flagged, len(hot_queries)))
+    if flagged:
+        raise SystemExit(1)
+
+
+@click.command('run-jobs')
+@with_appcontext
+def run_jobs_command():
+    """Requeue the jobs whose worker died and run every pending job, e.g.
+    from cron."""
+    requeued, job_ids = job_queue.recover()
+    if job_queue.executor is not None:
+        # the submitted jobs finish before the command exits
+        job_queue.executor.shutdown(wait=True)
+    click.echo('requeued {} stale jobs, ran {} jobs'.format(
+        requeued, len(job_ids)))
+
+
+def register_commands(app):
+    app.cli.add_command(reconcile_counters_command)
+    app.cli.add_command(index_advisor_command)
+    app.cli.add_command(run_jobs_command)
@@ -0,0 +1,110 @@
+"""Local job queue backed by the job table.
+
+Jobs are rows of app.models.Job, so they survive restarts and can be
+polled through the API. Submitted jobs run on a thread pool inside an app
+context; with JOB_QUEUE_EAGER they run right away in the submitting
+thread, which is what tests use.
+
+The jobs a restart left pending, and those running for longer than
+JOB_RUNNING_TIMEOUT seconds because their worker died, are run again by
+recover: before the first request of every process, and by the run-jobs
+command.
+"""
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Job, JobStatus, TemplateLesson
+
+
+class JobQueue(object):
+
+    def __init__(self, app=None):
+        self.app = None
+        self.executor = None
+        self.handlers = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        if not app.config.get('JOB_QUEUE_EAGER'):
+            self.executor = ThreadPoolExecutor(
+                max_workers=app.config.get('JOB_QUEUE_WORKERS', 4))
+            app.before_first_request(self.recover)
+
+    def handler(self, name):
+        """Register the decorated function as the handler of jobs named
+        name; it gets the job arguments as keyword arguments."""
+        def register(func):
+            self.handlers[name] = func
+            return func
+        return register
+
+    def submit(self, job_id):
+        """Run the committed job with job_id, in the background unless the
+        queue is eager."""
+        if self.executor is None:
+            self.run(job_id)
+        else:
+            self.executor.submit(self.run_in_app_context, job_id)
+
+    def submit_pending(self):
+        """Submit every pending job, e.g. those left over by a restart."""
+        job_ids = [id for (id,) in db.session.query(Job.id).filter(
+            Job.status == JobStatus.PENDING).order_by(Job.id)]
+        for job_id in job_ids:
+            self.submit(job_id)
+        return job_ids
+
+    def recover(self):
+        """Requeue the jobs of dead workers and submit every pending job;
+        return the number of requeued jobs and the submitted job ids."""
+        timeout = self.app.config.get('JOB_RUNNING_TIMEOUT')
+        requeued = 0
+        if timeout is not None:
+            requeued = Job.requeue_stale(
+                datetime.utcnow() - timedelta(seconds=timeout))
+        return requeued, self.submit_pending()
+
+    def run_in_app_context(self, job_id):
+        with self.app.app_context():
+            self.run(job_id)
+
+    def run(self, job_id):
+        """Run the job unless another worker claimed it already."""
+        if not Job.claim(job_id):
+            return
+        job = Job.get_with_id(job_id)
+        try:
+            self.handlers[job.name](**job.arguments)
+        except Exception:
+            db.session.rollback()
+            job = Job.get_with_id(job_id)
+            job.finish(error=traceback.format_exc())
+        else:
+            job.finish()
+
+
+job_queue = JobQueue()
+
+
+@job_queue.handler('materialize_lessons')
+def materialize_lessons(template_lesson_id):
+    # idempotent: only the lessons missing per (template_lesson_id,
+    # index_of_rep) are inserted, so a retried job creates no duplicates
+    for attempt in range(2):
+        template_lesson = TemplateLesson.get_with_id(template_lesson_id)
+        if template_lesson is None or template_lesson.class_session is None:
+            return
+        try:
+            template_lesson.class_session.materialize_lessons(
+                [template_lesson])
+            db.session.commit()
+            return
+        except IntegrityError:
+            # a concurrent worker inserted some of them first
+            db.session.rollback()
+            if attempt:
+                raise
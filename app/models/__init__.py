@@ -1,10 +1,12 @@
-from .database import Model
+from .database import Model, ConflictError
 from .constants import APIConst
 from .address import Address
 from .user import Person, User, Dependent
-from .enrollment import Enrollment
-from .class_session import Class, ClassSession
-from .schedule import Schedule, TimeSlot, RepeatOption
+from .enrollment import Enrollment, WaitlistEntry
+from .class_session import Class, ClassSession, ClassSessionFullError
+from .schedule import Schedule, TimeSlot, RepeatOption, Occurrence
 from .notification import NotificationDelivery, Notification
-from .lesson import TemplateLesson, Lesson, RepeatedLesson
+from .lesson import (TemplateLesson, Lesson, RepeatedLesson,
+                     InstructorConflictError)
 from .organization import OrganizationPersonAssociation, Organization
+from .job import Job, JobStatus
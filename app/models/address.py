@@ -1,7 +1,7 @@
-from .database import db, Model, SurrogatePK
+from .database import db, Model, SurrogatePK, TimestampMixin
 
 
-class Address(SurrogatePK, Model):
+class Address(SurrogatePK, TimestampMixin, Model):
     __tablename__ = 'address'
     primary_street = db.Column(db.String(100), nullable=False)
     secondary_street = db.Column(db.String(100), default='')
@@ -11,13 +11,14 @@ class Address(SurrogatePK, Model):
     country = db.Column(db.String(30), nullable=False)
     creator_id = db.Column(
         db.Integer,
-        db.ForeignKey('user.id')
+        db.ForeignKey('user.id'),
+        index=True,
     )
 
     creator = db.relationship(
         'User',
         backref='created_addresses',
-        lazy='subquery'
+        lazy='select'
     )
 
     def __repr__(self):
@@ -1,8 +1,15 @@
 from datetime import datetime
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy import event
-from .database import db, Model, SurrogatePK, TimestampMixin
-from .lesson import Lesson, RepeatedLesson
+from sqlalchemy import event, inspect
+import numpy as np
+from .counters import RowCount
+from .database import (db, Model, ConflictError, SurrogatePK,
+                       TimestampMixin, invalidate_lookup_cache)
+from .lesson import (Lesson, RepeatedLesson, TemplateLesson, get_end_at,
+                     lesson_count, lesson_instructor_association,
+                     lesson_guest_student_association)
+from .recurrence import count_occurrences, expand, to_datetimes
+from .schedule import RepeatOption, Schedule
 
 
 class_address_association = (
@@ -10,7 +17,7 @@ class_address_association = (
              db.Column('class_id', db.Integer, db.ForeignKey('class.id'),
                        primary_key=True),
              db.Column('address_id', db.Integer, db.ForeignKey('address.id'),
-                       primary_key=True)
+                       primary_key=True, index=True)
              )
 )
 
@@ -20,7 +27,7 @@ class_instructor_association = (
                        db.ForeignKey('class.id'),
                        primary_key=True),
              db.Column('instructor_id', db.Integer, db.ForeignKey('person.id'),
-                       primary_key=True)
+                       primary_key=True, index=True)
              )
 )
 
@@ -31,7 +38,7 @@ class_session_instructor_association = (
                        db.ForeignKey('class_session.id'),
                        primary_key=True),
              db.Column('instructor_id', db.Integer, db.ForeignKey('person.id'),
-                       primary_key=True)
+                       primary_key=True, index=True)
              )
 )
 
@@ -42,7 +49,7 @@ class_session_address_association = (
                        db.ForeignKey('class_session.id'),
                        primary_key=True),
              db.Column('address_id', db.Integer, db.ForeignKey('address.id'),
-                       primary_key=True)
+                       primary_key=True, index=True)
              )
 )
 
@@ -56,38 +63,42 @@ class Class(SurrogatePK, TimestampMixin, Model):
     num_of_lessons_per_session = db.Column(
         db.Integer)
     capacity = db.Column(db.Integer)
+    session_count = db.Column(db.Integer, nullable=False, default=0,
+                              server_default='0')
     min_age = db.Column(db.Integer)
     max_age = db.Column(db.Integer)
     creator_id = db.Column(
         db.Integer,
         db.ForeignKey('user.id'),
-        nullable=False
+        nullable=False,
+        index=True,
     )
-    organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'))
+    organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'),
+                                index=True)
 
     locations = db.relationship(
         'Address',
         secondary=class_address_association,
-        lazy='subquery',
+        lazy='select',
         backref=db.backref('classes', lazy='dynamic')
     )
 
     sessions = db.relationship(
         'ClassSession',
-        lazy='subquery',
+        lazy='select',
         backref='parent_class'
     )
 
     instructors = db.relationship(
         'Person',
         secondary=class_instructor_association,
-        lazy='subquery',
+        lazy='select',
         backref=db.backref('instructed_classes', lazy='dynamic')
     )
 
     organization = db.relationship(
         'Organization',
-        lazy='subquery',
+        lazy='select',
         backref=db.backref('classes', lazy='dynamic')
     )
 
@@ -97,24 +108,62 @@ class Class(SurrogatePK, TimestampMixin, Model):
                             name='title_creator_unique'),
     )
 
+    @hybrid_property
+    def num_of_sessions(self):
+        return self.session_count
+
+    @classmethod
+    def bulk_update(cls, ids, values, commit=True):
+        from .enrollment import WaitlistEntry
+        count = super().bulk_update(ids, values, commit=False)
+        if 'capacity' in values:
+            # the sessions without a capacity of their own use this one
+            for (class_session_id,) in db.session.query(
+                    ClassSession.id).filter(
+                        ClassSession.class_id.in_(list(set(ids))),
+                        ClassSession.capacity.is_(None)).order_by(
+                            ClassSession.id):
+                WaitlistEntry.promote(db.session, class_session_id)
+        if commit:
+            db.session.commit()
+        return count
+
+
+class ClassSessionFullError(ConflictError):
+
+    def __init__(self, class_session_id):
+        super().__init__('class session {} is full'.format(class_session_id))
+        self.class_session_id = class_session_id
+
 
 class ClassSession(SurrogatePK, TimestampMixin, Model):
     __tablename__ = 'class_session'
     capacity = db.Column(db.Integer)
+    # seats taken by enrollments that are not terminated, kept by admit and
+    # release; a capacity of None falls back to the capacity of the class
+    enrollment_count = db.Column(db.Integer, nullable=False, default=0,
+                                 server_default='0')
+    lesson_count = db.Column(db.Integer, nullable=False, default=0,
+                             server_default='0')
+    waitlist_count = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
     class_id = db.Column(
         db.Integer,
         db.ForeignKey('class.id'),
-        nullable=False
+        nullable=False,
+        index=True,
     )
     creator_id = db.Column(
         db.Integer,
         db.ForeignKey('user.id'),
-        nullable=False
+        nullable=False,
+        index=True,
     )
     schedule_id = db.Column(
         db.Integer,
         db.ForeignKey('schedule.id'),
-        nullable=False
+        nullable=False,
+        index=True,
     )
 
     enrollments = db.relationship(
@@ -126,7 +175,7 @@ class ClassSession(SurrogatePK, TimestampMixin, Model):
         'Schedule',
         cascade="all, delete-orphan",
         single_parent=True,
-        lazy='subquery',
+        lazy='select',
     )
 
     template_lessons = db.relationship(
@@ -139,62 +188,282 @@ class ClassSession(SurrogatePK, TimestampMixin, Model):
     instructors = db.relationship(
         'Person',
         secondary=class_session_instructor_association,
-        lazy='subquery',
+        lazy='select',
         backref=db.backref('instructed_class_sessions', lazy='dynamic')
     )
 
     locations = db.relationship(
         'Address',
         secondary=class_session_address_association,
-        lazy='subquery',
+        lazy='select',
         backref=db.backref('class_sessions', lazy='dynamic')
     )
 
     lessons = db.relationship(
         'Lesson',
         lazy='dynamic',
-        backref=db.backref('class_session', lazy='subquery'),
+        backref=db.backref('class_session', lazy='select'),
         enable_typechecks=False
     )
 
     @hybrid_property
     def num_of_enrollments(self):
-        pass
+        return self.enrollment_count
+
+    @hybrid_property
+    def num_of_lessons(self):
+        return self.lesson_count
+
+    @classmethod
+    def bulk_create(cls, mappings, commit=True):
+        session_count.increment(db.session, [
+            mapping.get('class_id') for mapping in mappings])
+        return super().bulk_create(mappings, commit=commit)
+
+    @classmethod
+    def bulk_update(cls, ids, values, commit=True):
+        from .enrollment import WaitlistEntry
+        if 'class_id' in values:
+            old_ids = [id for (id,) in db.session.query(
+                ClassSession.class_id).filter(
+                    ClassSession.id.in_(list(dict.fromkeys(ids))))]
+            session_count.decrement(db.session, old_ids)
+            session_count.increment(
+                db.session, [values['class_id']] * len(old_ids))
+        count = super().bulk_update(ids, values, commit=False)
+        if 'capacity' in values or 'class_id' in values:
+            # like the mapper events, seats freed by a raise or by moving
+            # to a larger class go to the waitlist
+            for id in sorted(set(ids)):
+                WaitlistEntry.promote(db.session, id)
+        if commit:
+            db.session.commit()
+        return count
+
+    @classmethod
+    def admit(cls, connection, class_session_id, count=1):
+        """Take count seats of the class session and return whether they
+        were free.
+
+        The capacity check and the increment are one conditional UPDATE, so
+        concurrent admissions cannot oversell: the row stays locked (the
+        whole database on SQLite) until the transaction ends, and a waiting
+        UPDATE checks the capacity against the committed count.
+        """
+        table = cls.__table__
+        class_capacity = db.select([Class.__table__.c.capacity]).where(
+            Class.__table__.c.id == table.c.class_id).as_scalar()
+        capacity = db.func.coalesce(table.c.capacity, class_capacity)
+        result = connection.execute(table.update().where(db.and_(
+            table.c.id == class_session_id,
+            db.or_(capacity.is_(None),
+                   table.c.enrollment_count + count <= capacity))).values(
+                       enrollment_count=table.c.enrollment_count + count))
+        return result.rowcount == 1
+
+    @classmethod
+    def get_free_seats(cls, connection, class_session_id):
+        """Return how many seats of the class session are free, None if it
+        has no capacity."""
+        session = cls.__table__
+        parent_class = Class.__table__
+        row = connection.execute(db.select([
+            db.func.coalesce(session.c.capacity, parent_class.c.capacity),
+            session.c.enrollment_count]).select_from(session.join(
+                parent_class, parent_class.c.id == session.c.class_id)).where(
+                    session.c.id == class_session_id)).first()
+        if row is None or row[0] is None:
+            return None
+        return row[0] - row[1]
+
+    @classmethod
+    def release(cls, connection, class_session_id, count=1):
+        """Give back count seats of the class session."""
+        table = cls.__table__
+        connection.execute(table.update().where(
+            table.c.id == class_session_id).values(
+                enrollment_count=db.case(
+                    [(table.c.enrollment_count > count,
+                      table.c.enrollment_count - count)], else_=0)))
 
     def create_lessons(self):
-        lessons = []
-        for tl in self.template_lessons:
-            start_at = tl.time_slot.start_at
-            index_of_rep = 0
-            while start_at < self.schedule.repeat_end_at:
-                lesson = RepeatedLesson(index_of_rep=index_of_rep,
-                                        template_lesson=tl,
-                                        class_session=self)
-                lessons.append(lesson)
-                start_at = self.schedule.repeat_option.get_repeat_datetime(
-                    start_at, 1)
-                index_of_rep += 1
-        return lessons
+        return self.create_lessons_for_template_lessons(
+            list(self.template_lessons))
 
     def create_lessons_for_template_lesson(self, tl):
+        return self.create_lessons_for_template_lessons([tl])
+
+    def create_lessons_for_template_lessons(self, template_lessons):
+        """Build a RepeatedLesson for every repeat of the time slots of
+        template_lessons before the schedule ends, expanding all of them
+        in one batch.
+
+        Like materialize_lessons, lessons that exist already are skipped,
+        so nothing is built for template lessons a flush has materialized.
+        """
+        # the flush materializes the template lessons linked by now and
+        # gives new ones the ids they are counted by
+        db.session.flush()
+        current_counts = self.count_materialized_lessons(template_lessons)
+        repeat_option, counts = self.count_lessons(template_lessons)
+        starts = [tl.time_slot.start_at for tl in template_lessons]
+        occurrences, indexes, nums = expand(
+            repeat_option, starts, np.maximum(counts - current_counts, 0),
+            current_counts)
         lessons = []
-        start_at = tl.time_slot.start_at
-        index_of_rep = 0
-        while start_at < self.schedule.repeat_end_at:
-            lesson = RepeatedLesson(index_of_rep=index_of_rep,
-                                    template_lesson=tl,
-                                    class_session=self)
-            lessons.append(lesson)
-            start_at = self.schedule.repeat_option.get_repeat_datetime(
-                start_at, 1)
-            index_of_rep += 1
+        for start_at, index, num in zip(to_datetimes(occurrences),
+                                        indexes.tolist(), nums.tolist()):
+            tl = template_lessons[index]
+            lessons.append(RepeatedLesson(index_of_rep=num,
+                                          template_lesson=tl,
+                                          class_session=self,
+                                          location_id=tl.location_id,
+                                          start_at=start_at,
+                                          duration=tl.time_slot.duration))
         return lessons
 
+    def materialize_lessons(self, template_lessons):
+        """Insert the repeated lessons of template_lessons, which have to be
+        flushed, and return their ids.
+
+        Unlike create_lessons_for_template_lessons no ORM instances are
+        built: all occurrences are computed up front and both tables of
+        RepeatedLesson are filled with one executemany each. Lessons that
+        exist already are skipped, so materializing twice is harmless.
+        """
+        repeat_option, counts = self.count_lessons(template_lessons)
+        current_counts = self.count_materialized_lessons(template_lessons)
+        return RepeatedLesson.bulk_create(
+            self.get_lesson_mappings(
+                template_lessons, repeat_option,
+                np.maximum(counts - current_counts, 0), current_counts),
+            commit=False)
+
+    def count_materialized_lessons(self, template_lessons):
+        """Return how many lessons of each of template_lessons exist, as
+        the number following their highest index_of_rep."""
+        tl_ids = [tl.id for tl in template_lessons]
+        counts = dict(db.session.query(
+            RepeatedLesson.template_lesson_id,
+            db.func.max(RepeatedLesson.index_of_rep) + 1).filter(
+                RepeatedLesson.template_lesson_id.in_(tl_ids)).group_by(
+                    RepeatedLesson.template_lesson_id))
+        return np.array([counts.get(id, 0) for id in tl_ids],
+                        dtype=np.int64)
+
+    def count_lessons(self, template_lessons):
+        """Return the repeat option the time slots of template_lessons
+        repeat with and how many lessons each of them has before the
+        schedule ends."""
+        repeat_option = self.schedule.repeat_option
+        if repeat_option in (RepeatOption.NEVER, RepeatOption.SPECIFIC):
+            return (RepeatOption.NEVER,
+                    np.ones(len(template_lessons), dtype=np.int64))
+        starts = [tl.time_slot.start_at for tl in template_lessons]
+        return repeat_option, count_occurrences(
+            repeat_option, starts, self.schedule.repeat_end_at,
+            inclusive=False)
+
+    def get_lesson_mappings(self, template_lessons, repeat_option, counts,
+                            first_nums=None):
+        """Return the column values of counts[i] repeated lessons of every
+        template_lessons[i], from its repeat number first_nums[i] on."""
+        starts = [tl.time_slot.start_at for tl in template_lessons]
+        occurrences, indexes, nums = expand(repeat_option, starts, counts,
+                                            first_nums)
+        mappings = []
+        for start_at, index, num in zip(to_datetimes(occurrences),
+                                        indexes.tolist(), nums.tolist()):
+            tl = template_lessons[index]
+            mappings.append(dict(index_of_rep=num,
+                                 template_lesson_id=tl.id,
+                                 class_session_id=self.id,
+                                 location_id=tl.location_id,
+                                 start_at=start_at,
+                                 duration=tl.time_slot.duration,
+                                 end_at=get_end_at(start_at,
+                                                   tl.time_slot.duration)))
+        return mappings
+
+    def sync_lessons(self):
+        """Bring the repeated lessons of the template lessons in line with
+        the end of the schedule, after repeat_end_at moved.
+
+        Only the difference is written: the missing tail of each template
+        lesson is inserted and the truncated tail deleted, one statement
+        per table. Return the number of lessons inserted and deleted.
+        """
+        schedule = self.schedule
+        if (schedule.repeat_option in (RepeatOption.NEVER,
+                                       RepeatOption.SPECIFIC)
+                or schedule.repeat_end_at is None):
+            return 0, 0
+        # not self.template_lessons, a dynamic relationship flushes first
+        template_lessons = [
+            tl for tl in db.session.query(TemplateLesson).filter_by(
+                class_session_id=self.id).order_by(TemplateLesson.id)
+            if tl.time_slot is not None]
+        if not template_lessons:
+            return 0, 0
+        tl_ids = [tl.id for tl in template_lessons]
+        starts = [tl.time_slot.start_at for tl in template_lessons]
+        current_counts = self.count_materialized_lessons(template_lessons)
+        counts = count_occurrences(schedule.repeat_option, starts,
+                                   schedule.repeat_end_at, inclusive=False)
+
+        truncated = [
+            db.and_(RepeatedLesson.template_lesson_id == id,
+                    RepeatedLesson.index_of_rep >= count)
+            for id, count, current_count in zip(
+                tl_ids, counts.tolist(), current_counts.tolist())
+            if count < current_count]
+        deleted_ids = []
+        if truncated:
+            deleted = db.session.query(
+                RepeatedLesson.id, RepeatedLesson.class_session_id).filter(
+                    db.or_(*truncated)).all()
+            deleted_ids = [id for id, _ in deleted]
+            lesson_count.decrement(db.session, [
+                class_session_id for _, class_session_id in deleted])
+        if deleted_ids:
+            for table in (lesson_instructor_association,
+                          lesson_guest_student_association):
+                db.session.execute(table.delete().where(
+                    table.c.lesson_id.in_(deleted_ids)))
+            for model in (RepeatedLesson, Lesson):
+                db.session.execute(model.__table__.delete().where(
+                    model.__table__.c.id.in_(deleted_ids)))
+
+        mappings = self.get_lesson_mappings(
+            template_lessons, schedule.repeat_option,
+            np.maximum(counts - current_counts, 0), current_counts)
+        RepeatedLesson.bulk_create(mappings, commit=False)
+        invalidate_lookup_cache()
+        return len(mappings), len(deleted_ids)
+
     def __repr__(self):
         return '{} of {}'.format(super().__repr__(),
                                  self.parent_class)
 
 
+# Class.session_count
+session_count = RowCount('session_count', ClassSession.__table__.c.class_id)
+session_count.listen(ClassSession)
+
+
+@event.listens_for(db.session, 'after_flush')
+def sync_lessons_of_rescheduled_class_sessions(session, flush_context):
+    schedule_ids = [
+        schedule.id for schedule in session.dirty
+        if isinstance(schedule, Schedule)
+        and inspect(schedule).attrs.repeat_end_at.history.has_changes()]
+    if not schedule_ids:
+        return
+    for class_session in session.query(ClassSession).filter(
+            ClassSession.schedule_id.in_(schedule_ids)):
+        class_session.sync_lessons()
+
+
 #  @event.listens_for(ClassSession.template_lessons, 'append')
 #  def receive_template_lessons_append(target, value, initiator):
 #      if value not in target.template_lessons.all():
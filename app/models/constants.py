@@ -7,3 +7,10 @@ class APIConst:
     CONTINUATION_TOKEN = 'continuation_token'
     NEXT = 'next'
     INPUT = 'input'
+    MISSING_IDS = 'missing_ids'
+    INDEX = 'index'
+    STATUS = 'status'
+    JOB = 'job'
+    ENROLLMENT = 'enrollment'
+    WAITLIST_ENTRY = 'waitlist_entry'
+    FILTER_FIELDS = 'filter_fields'
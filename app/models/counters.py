@@ -0,0 +1,139 @@
+"""Denormalized row counts kept in counter columns.
+
+A RowCount keeps a counter column of a parent table equal to the number of
+child rows whose foreign key points at the parent row, so listing parents
+with their counts reads no child rows. The counter is moved by one UPDATE
+per distinct change in the same transaction as the child rows, from mapper
+events for ORM changes and from the bulk_create/bulk_update overrides of
+the child model. reconcile repairs counters that drifted anyway, e.g.
+after raw SQL.
+"""
+from collections import Counter
+from sqlalchemy import event, inspect
+from .database import db
+
+
+class RowCount(object):
+
+    instances = []
+
+    def __init__(self, counter_name, foreign_key, criterion=None):
+        """Count the rows of the table of the foreign_key column matching
+        criterion in the counter_name column of the table it refers to."""
+        self.counter_name = counter_name
+        self.foreign_key = foreign_key
+        self.criterion = criterion
+        RowCount.instances.append(self)
+
+    @property
+    def parent(self):
+        # resolved on use, the parent table may be declared after the child
+        return next(iter(self.foreign_key.foreign_keys)).column.table
+
+    @property
+    def counter(self):
+        return self.parent.c[self.counter_name]
+
+    @property
+    def name(self):
+        return '{}.{}'.format(self.parent.name, self.counter_name)
+
+    def increment(self, connection, parent_ids):
+        """Count one more row for every id in parent_ids, which may repeat
+        and may be None."""
+        self.change(connection, Counter(parent_ids), 1)
+
+    def decrement(self, connection, parent_ids):
+        self.change(connection, Counter(parent_ids), -1)
+
+    def change(self, connection, counts, sign):
+        counts.pop(None, None)
+        ids_by_count = {}
+        for parent_id, count in counts.items():
+            if count:
+                ids_by_count.setdefault(count, []).append(parent_id)
+        parent, counter = self.parent, self.counter
+        for count, parent_ids in ids_by_count.items():
+            connection.execute(parent.update().where(
+                parent.c.id.in_(parent_ids)).values(
+                    {counter: counter + sign * count}))
+
+    def listen(self, model):
+        """Keep the counter in line with ORM inserts, deletes and moves of
+        model instances, subclasses included. Only counts without criterion
+        can be kept this way."""
+        if self.criterion is not None:
+            raise ValueError('{} counts a subset of the rows'.format(
+                self.name))
+        key = inspect(model).get_property_by_column(self.foreign_key).key
+
+        @event.listens_for(model, 'before_insert', propagate=True)
+        def count_inserted_row(mapper, connection, target):
+            self.increment(connection, [getattr(target, key)])
+
+        @event.listens_for(model, 'before_update', propagate=True)
+        def count_moved_row(mapper, connection, target):
+            old_id = get_committed_value(connection, target, key)
+            new_id = getattr(target, key)
+            if old_id != new_id:
+                self.decrement(connection, [old_id])
+                self.increment(connection, [new_id])
+
+        @event.listens_for(model, 'before_delete', propagate=True)
+        def count_deleted_row(mapper, connection, target):
+            self.decrement(connection,
+                           [get_committed_value(connection, target, key)])
+
+    def get_drift(self, connection):
+        """Return the id, stored count and actual count of every parent row
+        whose counter is off, with one GROUP BY over the child table."""
+        child = self.foreign_key.table
+        query = db.select([self.foreign_key.label('parent_id'),
+                           db.func.count().label('actual')])
+        if self.criterion is not None:
+            query = query.where(self.criterion)
+        actual_counts = query.group_by(self.foreign_key).alias(
+            '{}_counts'.format(child.name))
+        parent, counter = self.parent, self.counter
+        actual = db.func.coalesce(actual_counts.c.actual, 0)
+        return connection.execute(db.select(
+            [parent.c.id, counter.label('stored'), actual.label('actual')])
+            .select_from(parent.outerjoin(
+                actual_counts, actual_counts.c.parent_id == parent.c.id))
+            .where(counter != actual)
+            .order_by(parent.c.id)).fetchall()
+
+    def reconcile(self, connection):
+        """Set every drifted counter to the actual count and return the
+        drift that was repaired."""
+        drift = self.get_drift(connection)
+        if drift:
+            parent = self.parent
+            connection.execute(
+                parent.update().where(
+                    parent.c.id == db.bindparam('parent_id')).values(
+                        {self.counter: db.bindparam('actual_count')}),
+                [dict(parent_id=id, actual_count=actual)
+                 for id, stored, actual in drift])
+        return drift
+
+
+def get_committed_value(connection, target, key):
+    """Return the value the database holds for the column attribute key of
+    target, from a mapper event before the flush writes target."""
+    state = inspect(target)
+    history = state.attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    if not history.added:
+        return getattr(target, key)
+    # set while expired, the old value was never loaded
+    column = state.mapper.get_property(key).columns[0]
+    return connection.execute(db.select([column]).where(
+        column.table.c.id == target.id)).scalar()
+
+
+def reconcile_counters(connection):
+    """Reconcile every RowCount and return the repaired drift by name."""
+    return {row_count.name: row_count.reconcile(connection)
+            for row_count in RowCount.instances}
@@ -1,4 +1,6 @@
 from datetime import datetime
+from flask import g, has_app_context
+from sqlalchemy import event, inspect
 from sqlalchemy.exc import IntegrityError
 from app import db
 
@@ -44,21 +46,235 @@ class Model(CRUDMixin, db.Model):
     __abstract__ = True
 
 
+class ConflictError(Exception):
+    """A change that the current state of other rows does not allow, like
+    an IntegrityError that no constraint of the database can express."""
+
+
+class LookupCache(object):
+    """Request scoped cache of (mapped class, id) -> item lookups.
+
+    Lives on flask.g, so it is dropped together with the app context.
+    Misses are cached as None so that repeated existence checks stay off
+    the database. The cache is emptied whenever the session flushes,
+    commits, rolls back or runs a bulk update/delete.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def current():
+        if not has_app_context():
+            return None
+        cache = getattr(g, '_lookup_cache', None)
+        if cache is None:
+            cache = g._lookup_cache = LookupCache()
+        return cache
+
+    @staticmethod
+    def usable():
+        # pending inserts or deletes are not visible through the cache,
+        # lookups go to the database (and autoflush) until they are flushed
+        session = db.session
+        return not (session.new or session.deleted)
+
+    def get(self, item_class, id):
+        key = (item_class, id)
+        if key in self.items:
+            self.hits += 1
+            return True, self.items[key]
+        self.misses += 1
+        return False, None
+
+    def set(self, item_class, id, item):
+        self.items[(item_class, id)] = item
+
+    def clear(self):
+        self.items.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.items)}
+
+
+@event.listens_for(db.session, 'after_flush')
+@event.listens_for(db.session, 'after_commit')
+@event.listens_for(db.session, 'after_soft_rollback')
+@event.listens_for(db.session, 'after_bulk_update')
+@event.listens_for(db.session, 'after_bulk_delete')
+def invalidate_lookup_cache(*args):
+    if has_app_context() and getattr(g, '_lookup_cache', None) is not None:
+        g._lookup_cache.clear()
+
+
 class SurrogatePK(object):
     id = db.Column(db.Integer, primary_key=True)
 
+    @classmethod
+    def get_keyset(cls):
+        # columns giving a stable, unique order for keyset pagination
+        return [cls.id]
+
     @classmethod
     def get_with_id(cls, id):
         if id is None:
             return None
-        item = db.session.query(cls).get(id)
+        cache = LookupCache.current()
+        if cache is None or not cache.usable():
+            return db.session.query(cls).get(id)
+        found, item = cache.get(cls, id)
+        if not found:
+            item = db.session.query(cls).get(id)
+            cache.set(cls, id, item)
         return item
 
     @classmethod
-    def get_with_ids(cls, ids):
+    def get_with_ids(cls, ids, options=()):
         if ids is None:
             return None
-        return db.session.query(cls).filter(cls.id.in_(ids)).all()
+        id_list = list(dict.fromkeys(ids))
+        cache = LookupCache.current()
+        if cache is None or not cache.usable():
+            return db.session.query(cls).options(*options).filter(
+                cls.id.in_(id_list)).all()
+
+        items_by_id = {}
+        ids_to_fetch = []
+        for id in id_list:
+            found, item = cache.get(cls, id)
+            if found:
+                items_by_id[id] = item
+            else:
+                ids_to_fetch.append(id)
+        if ids_to_fetch:
+            fetched = {item.id: item
+                       for item in db.session.query(cls).options(
+                           *options).filter(cls.id.in_(ids_to_fetch)).all()}
+            for id in ids_to_fetch:
+                items_by_id[id] = fetched.get(id)
+                cache.set(cls, id, items_by_id[id])
+        return [items_by_id[id] for id in id_list
+                if items_by_id[id] is not None]
+
+    @classmethod
+    def get_existing_ids(cls, ids):
+        """Return the subset of ids that exist, selecting only the id column.
+
+        Ids already answered by the lookup cache are not queried again,
+        ids found missing are cached as misses.
+        """
+        id_list = list(dict.fromkeys(ids))
+        cache = LookupCache.current()
+        if cache is None or not cache.usable():
+            return {id for (id,) in db.session.query(cls.id).filter(
+                cls.id.in_(id_list))}
+
+        existing_ids = set()
+        ids_to_fetch = []
+        for id in id_list:
+            found, item = cache.get(cls, id)
+            if not found:
+                ids_to_fetch.append(id)
+            elif item is not None:
+                existing_ids.add(id)
+        if ids_to_fetch:
+            fetched_ids = {id for (id,) in db.session.query(cls.id).filter(
+                cls.id.in_(ids_to_fetch))}
+            for id in set(ids_to_fetch) - fetched_ids:
+                cache.set(cls, id, None)
+            existing_ids |= fetched_ids
+        return existing_ids
+
+    @classmethod
+    def allocate_ids(cls, count):
+        """Reserve count new primary keys for a bulk insert.
+
+        Postgres draws them from the id sequence of the base table. Other
+        databases continue after its current maximum id, read under the
+        write lock of the table so that no other insert can take the same
+        ids before the transaction ends.
+        """
+        table = inspect(cls).base_mapper.local_table
+        bind = db.session.get_bind(mapper=inspect(cls))
+        if bind.dialect.name == 'postgresql':
+            rows = db.session.execute(
+                db.text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) "
+                        "FROM generate_series(1, :count)"),
+                {'table': table.fullname, 'count': count})
+            return [id for (id,) in rows]
+        max_id_query = db.session.query(db.func.max(table.c.id))
+        if bind.dialect.name == 'sqlite':
+            # SQLite has no row locks and ignores FOR UPDATE, a write that
+            # matches nothing takes the database write lock instead
+            db.session.execute(table.update().where(db.false()).values(
+                id=table.c.id))
+        else:
+            max_id_query = max_id_query.with_for_update()
+        max_id = max_id_query.scalar() or 0
+        return list(range(max_id + 1, max_id + 1 + count))
+
+    @classmethod
+    def bulk_create(cls, mappings, commit=True):
+        """Insert one row per mapping with a single executemany per table
+        and return the ids of the new rows, in the order of mappings.
+
+        Unlike create, no objects are built and no session events fire;
+        models that maintain state on insert override this.
+        """
+        if not mappings:
+            return []
+        mapper = inspect(cls)
+        ids = cls.allocate_ids(len(mappings))
+        rows = [dict(mapping, id=id) for id, mapping in zip(ids, mappings)]
+        if mapper.polymorphic_on is not None:
+            type_key = mapper.get_property_by_column(mapper.polymorphic_on).key
+            for row in rows:
+                row[type_key] = mapper.polymorphic_identity
+        db.session.bulk_insert_mappings(cls, rows)
+        # bulk inserts bypass the flush events that keep the cache coherent
+        invalidate_lookup_cache()
+        if commit:
+            db.session.commit()
+        return ids
+
+    @classmethod
+    def bulk_update(cls, ids, values, commit=True):
+        """Set the same values on the rows with ids, with one UPDATE per
+        table the values live in, and return the number of rows matched.
+
+        Only column attributes can be set. Like bulk_create, no objects
+        are loaded and no attribute events fire.
+        """
+        mapper = inspect(cls)
+        columns_by_key = {prop.key: prop.columns[0]
+                          for prop in mapper.column_attrs}
+        unknown_keys = [key for key in values
+                        if key not in columns_by_key or key == 'id']
+        if unknown_keys:
+            raise ValueError('{} cannot be updated on {}'.format(
+                ', '.join(sorted(unknown_keys)), cls.__name__))
+        values = dict(values)
+        if 'updated_at' in columns_by_key:
+            values['updated_at'] = datetime.utcnow()
+
+        values_by_table = {}
+        for key, value in values.items():
+            column = columns_by_key[key]
+            values_by_table.setdefault(column.table, {})[column] = value
+        id_list = list(dict.fromkeys(ids))
+        count = 0
+        for table, table_values in values_by_table.items():
+            result = db.session.execute(table.update().where(
+                table.c.id.in_(id_list)).values(table_values))
+            count = max(count, result.rowcount)
+        # like bulk_create, this bypasses the flush events of the cache
+        invalidate_lookup_cache()
+        if commit:
+            db.session.commit()
+        return count
 
     # def __repr__(self):
     #     return '<{}>:{}'.format(self.__class__.__name__, self.id)
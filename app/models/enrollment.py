@@ -1,24 +1,35 @@
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import event, inspect
+from .counters import RowCount, get_committed_value
 from .database import db, Model, SurrogatePK, TimestampMixin
-from .class_session import ClassSession
-from .user import Person, User
+from .class_session import Class, ClassSession, ClassSessionFullError
 
 
 class Enrollment(SurrogatePK, TimestampMixin, Model):
     __tablename__ = 'enrollment'
     class_session_id = db.Column(db.Integer, db.ForeignKey('class_session.id'))
-    enrolled_person_id = db.Column(db.Integer, db.ForeignKey('person.id'))
+    enrolled_person_id = db.Column(db.Integer, db.ForeignKey('person.id'),
+                                   index=True)
     terminated = db.Column(db.Boolean, nullable=False, default=False)
-    initiator_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    initiator_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
 
     class_session = db.relationship(
         'ClassSession',
         back_populates='enrollments',
-        lazy='subquery'
+        lazy='select'
     )
     enrolled_person = db.relationship(
         'Person',
         back_populates='enrollments',
-        lazy='subquery'
+        lazy='select'
+    )
+
+    __table_args__ = (
+        #  the active enrollments of a class session, and every enrollment
+        #  of it through the leftmost column
+        db.Index('ix_enrollment_class_session_id_terminated',
+                 'class_session_id', 'terminated'),
     )
 
     def __repr__(self):
@@ -28,28 +39,244 @@ class Enrollment(SurrogatePK, TimestampMixin, Model):
             self.class_session
         )
 
+    @classmethod
+    def bulk_create(cls, mappings, commit=True):
+        seats = Counter(get_seat(mapping.get('class_session_id'),
+                                 mapping.get('terminated'))
+                        for mapping in mappings)
+        cls.move_seats(db.session, Counter(), seats)
+        return super().bulk_create(mappings, commit=commit)
+
+    @classmethod
+    def bulk_update(cls, ids, values, commit=True):
+        if 'class_session_id' in values or 'terminated' in values:
+            table = cls.__table__
+            rows = db.session.execute(db.select([
+                table.c.class_session_id, table.c.terminated]).where(
+                    table.c.id.in_(list(dict.fromkeys(ids))))).fetchall()
+            cls.move_seats(
+                db.session,
+                Counter(get_seat(*row) for row in rows),
+                Counter(get_seat(
+                    values.get('class_session_id', row.class_session_id),
+                    values.get('terminated', row.terminated))
+                    for row in rows))
+        return super().bulk_update(ids, values, commit=commit)
+
+    @staticmethod
+    def move_seats(connection, old_seats, new_seats):
+        """Release the seats in old_seats but not in new_seats and admit
+        those in new_seats but not in old_seats; both count seats by class
+        session id. Raise ClassSessionFullError if a class session has too
+        few seats left, which leaves the transaction to be rolled back."""
+        released = old_seats - new_seats
+        admitted = new_seats - old_seats
+        released.pop(None, None)
+        admitted.pop(None, None)
+        for class_session_id, count in released.items():
+            ClassSession.release(connection, class_session_id, count)
+        # a fixed order keeps concurrent admissions from deadlocking
+        for class_session_id in sorted(admitted):
+            if not ClassSession.admit(connection, class_session_id,
+                                      admitted[class_session_id]):
+                raise ClassSessionFullError(class_session_id)
+        # the seats given back go to the waitlist first
+        for class_session_id in sorted(released):
+            WaitlistEntry.promote(connection, class_session_id)
+
     @classmethod
     def get_enrollments(cls, class_session_id=None, enrolled_person_id=None,
-                        initiator_id=None):
-        if (class_session_id is not None
-                and enrolled_person_id is None
-                and initiator_id is None):
-            class_session = ClassSession.get_with_id(class_session_id)
-            return class_session.enrollments[:]
-
-        elif (class_session_id is None
-                and enrolled_person_id is not None
-                and initiator_id is None):
-            enrolled_person = Person.get_with_id(enrolled_person_id)
-            return enrolled_person.enrollments[:]
-        elif (class_session_id is None
-                and enrolled_person_id is None
-                and initiator_id is not None):
-            initiator = User.get_with_id(initiator_id)
-            return initiator.initiated_enrollments[:]
-        elif (class_session_id is not None
-              and enrolled_person_id is not None
-              and initiator_id is None):
-            return db.session.query(Enrollment).filter(
-                Enrollment.class_session_id == class_session_id,
-                Enrollment.enrolled_person_id == enrolled_person_id).all()
+                        initiator_id=None, terminated=None):
+        """Return the enrollments matching every argument that is not None,
+        in order of id, with one query. At least one argument is required,
+        so that the whole table is never read by accident."""
+        criteria = {key: value for key, value in dict(
+            class_session_id=class_session_id,
+            enrolled_person_id=enrolled_person_id,
+            initiator_id=initiator_id, terminated=terminated).items()
+            if value is not None}
+        if not criteria:
+            raise ValueError('get_enrollments needs at least one criterion')
+        return cls.query.filter_by(**criteria).order_by(cls.id).all()
+
+
+class WaitlistEntry(SurrogatePK, TimestampMixin, Model):
+    """A person waiting for a seat in a full class session.
+
+    Entries are served in order of position. The unique index on
+    (class_session_id, position) keeps them sorted, so finding who is next
+    in line is one index lookup rather than a scan.
+    """
+    __tablename__ = 'waitlist_entry'
+    class_session_id = db.Column(db.Integer,
+                                 db.ForeignKey('class_session.id'),
+                                 nullable=False)
+    person_id = db.Column(db.Integer, db.ForeignKey('person.id'),
+                          nullable=False, index=True)
+    initiator_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    position = db.Column(db.Integer, nullable=False)
+
+    class_session = db.relationship(
+        'ClassSession',
+        lazy='select',
+        backref=db.backref('waitlist_entries', lazy='dynamic',
+                           order_by='WaitlistEntry.position')
+    )
+    person = db.relationship('Person', foreign_keys=[person_id],
+                             lazy='select')
+    initiator = db.relationship('User', foreign_keys=[initiator_id],
+                                lazy='select')
+
+    __table_args__ = (
+        db.UniqueConstraint('class_session_id', 'position',
+                            name='class_session_position_unique'),
+        db.UniqueConstraint('class_session_id', 'person_id',
+                            name='class_session_person_unique'),
+    )
+
+    def __repr__(self):
+        return '{} for {} in {} at {}'.format(
+            super().__repr__(), self.person, self.class_session,
+            self.position)
+
+    @classmethod
+    def join(cls, class_session_id, person_id, initiator_id=None):
+        """Put the person at the end of the waitlist of the class session,
+        and enroll them right away if a seat is free by now.
+
+        Return the waiting entry, or None together with the id of the new
+        enrollment. The free seats go to whoever is first in line, which
+        need not be the person.
+        """
+        entry = cls.create(commit=False, class_session_id=class_session_id,
+                           person_id=person_id, initiator_id=initiator_id)
+        db.session.flush()
+        enrollment_id = dict(cls.promote(db.session.connection(),
+                                         class_session_id)).get(entry.id)
+        if enrollment_id is not None:
+            db.session.expunge(entry)
+            entry = None
+        db.session.commit()
+        return entry, enrollment_id
+
+    @classmethod
+    def promote(cls, connection, class_session_id):
+        """Enroll the people waiting for the class session into its free
+        seats, first in line first, and return (entry id, enrollment id)
+        pairs of the people enrolled.
+
+        The head of the line is read with one indexed LIMIT query, the
+        seats are taken for all of them with one conditional UPDATE and the
+        entries removed with one DELETE.
+        """
+        entry = cls.__table__
+        enrollment = Enrollment.__table__
+        enrolled = []
+        while True:
+            free_seats = ClassSession.get_free_seats(connection,
+                                                     class_session_id)
+            if free_seats is not None and free_seats <= 0:
+                break
+            query = db.select([entry.c.id, entry.c.person_id,
+                               entry.c.initiator_id]).where(
+                entry.c.class_session_id == class_session_id).order_by(
+                    entry.c.position)
+            if free_seats is not None:
+                query = query.limit(free_seats)
+            rows = connection.execute(query).fetchall()
+            if not rows:
+                break
+            if not ClassSession.admit(connection, class_session_id,
+                                      len(rows)):
+                # taken by a concurrent admission, count the seats again
+                continue
+            connection.execute(entry.delete().where(
+                entry.c.id.in_([row.id for row in rows])))
+            waitlist_count.decrement(connection,
+                                     [class_session_id] * len(rows))
+            now = datetime.utcnow()
+            for row in rows:
+                enrolled.append((row.id, connection.execute(
+                    enrollment.insert().values(
+                        class_session_id=class_session_id,
+                        enrolled_person_id=row.person_id,
+                        initiator_id=row.initiator_id,
+                        terminated=False,
+                        created_at=now)).inserted_primary_key[0]))
+            if free_seats is None:
+                break
+        return enrolled
+
+
+# ClassSession.waitlist_count
+waitlist_count = RowCount('waitlist_count',
+                          WaitlistEntry.__table__.c.class_session_id)
+waitlist_count.listen(WaitlistEntry)
+
+
+@event.listens_for(WaitlistEntry, 'before_insert')
+def set_waitlist_position(mapper, connection, target):
+    # counting the entry locked the class session row already, so
+    # concurrent entries of the session get their positions in turn
+    entry = WaitlistEntry.__table__
+    target.position = connection.execute(db.select([
+        db.func.coalesce(db.func.max(entry.c.position), 0) + 1]).where(
+            entry.c.class_session_id == target.class_session_id)).scalar()
+
+
+@event.listens_for(ClassSession, 'after_update')
+def promote_waitlist_of_class_session(mapper, connection, target):
+    # moving to another class changes the capacity of sessions without
+    # their own
+    attrs = inspect(target).attrs
+    if (attrs.capacity.history.has_changes()
+            or attrs.class_id.history.has_changes()):
+        WaitlistEntry.promote(connection, target.id)
+
+
+@event.listens_for(Class, 'after_update')
+def promote_waitlists_of_class(mapper, connection, target):
+    # the capacity of the class applies to sessions without their own
+    if inspect(target).attrs.capacity.history.has_changes():
+        session = ClassSession.__table__
+        for (class_session_id,) in connection.execute(db.select(
+                [session.c.id]).where(db.and_(
+                    session.c.class_id == target.id,
+                    session.c.capacity.is_(None))).order_by(session.c.id)):
+            WaitlistEntry.promote(connection, class_session_id)
+
+
+# ClassSession.enrollment_count, kept by admitting and releasing seats
+enrollment_count = RowCount(
+    'enrollment_count', Enrollment.__table__.c.class_session_id,
+    Enrollment.__table__.c.terminated == db.false())
+
+
+def get_seat(class_session_id, terminated):
+    # the class session whose seat an enrollment takes, if any
+    return None if terminated else class_session_id
+
+
+def get_committed_seat(connection, enrollment):
+    return get_seat(*(get_committed_value(connection, enrollment, key)
+                      for key in ('class_session_id', 'terminated')))
+
+
+@event.listens_for(Enrollment, 'before_insert')
+def admit_enrollment(mapper, connection, target):
+    Enrollment.move_seats(connection, Counter(), Counter(
+        [get_seat(target.class_session_id, target.terminated)]))
+
+
+@event.listens_for(Enrollment, 'before_update')
+def move_enrollment(mapper, connection, target):
+    Enrollment.move_seats(
+        connection, Counter([get_committed_seat(connection, target)]),
+        Counter([get_seat(target.class_session_id, target.terminated)]))
+
+
+@event.listens_for(Enrollment, 'before_delete')
+def release_enrollment(mapper, connection, target):
+    Enrollment.move_seats(
+        connection, Counter([get_committed_seat(connection, target)]),
+        Counter())
@@ -0,0 +1,56 @@
+"""Overlap queries over half-open [start, end) intervals."""
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import accumulate
+
+Interval = namedtuple('Interval', ['start', 'end', 'key'])
+
+
+class IntervalIndex(object):
+    """Static index of intervals sorted by start.
+
+    Next to the sorted starts it keeps the running maximum of the ends, so
+    whether an interval overlaps any indexed one is answered with a single
+    bisection, in O(log n). Listing the overlaps costs O(log n) plus the
+    intervals walked back from the bisection point, which stops as soon as
+    no earlier interval can reach the start.
+    """
+
+    def __init__(self, intervals=()):
+        self.intervals = sorted(intervals,
+                                key=lambda interval: interval[:2])
+        self.starts = [interval.start for interval in self.intervals]
+        self.max_ends = list(accumulate(
+            (interval.end for interval in self.intervals), max))
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def has_overlap(self, start, end):
+        # only the intervals starting before end can overlap
+        count = bisect_left(self.starts, end)
+        return count > 0 and self.max_ends[count - 1] > start
+
+    def overlaps(self, start, end):
+        """Return the indexed intervals overlapping [start, end), ordered by
+        start."""
+        return self.overlaps_before(bisect_left(self.starts, end), start)
+
+    def conflicts(self):
+        """Return every pair of overlapping indexed intervals, the one that
+        starts first being first."""
+        return [(other, interval)
+                for index, interval in enumerate(self.intervals)
+                for other in self.overlaps_before(index, interval.start)]
+
+    def overlaps_before(self, count, start):
+        """Return the overlaps of the first count intervals with an interval
+        starting at start and ending after all of them start."""
+        found = []
+        index = count - 1
+        while index >= 0 and self.max_ends[index] > start:
+            if self.intervals[index].end > start:
+                found.append(self.intervals[index])
+            index -= 1
+        found.reverse()
+        return found
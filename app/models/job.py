@@ -0,0 +1,80 @@
+import enum
+import json
+from datetime import datetime
+from .database import db, Model, SurrogatePK, TimestampMixin
+
+
+class JobStatus(enum.Enum):
+    PENDING = 1
+    RUNNING = 2
+    SUCCEEDED = 3
+    FAILED = 4
+
+
+class Job(SurrogatePK, TimestampMixin, Model):
+    """A unit of background work, run by app.jobs.job_queue.
+
+    name selects the handler, payload holds its keyword arguments as JSON.
+    """
+    __tablename__ = 'job'
+    name = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(
+        db.Enum(JobStatus, validate_strings=True),
+        default=JobStatus.PENDING,
+        nullable=False,
+        index=True,
+    )
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    @property
+    def arguments(self):
+        return json.loads(self.payload)
+
+    @classmethod
+    def insert(cls, connection, name, **arguments):
+        """Insert a pending job with one Core statement and return its id.
+
+        Unlike create, this can run inside a flush, from session or mapper
+        events.
+        """
+        result = connection.execute(cls.__table__.insert().values(
+            name=name, payload=json.dumps(arguments),
+            status=JobStatus.PENDING))
+        return result.inserted_primary_key[0]
+
+    @classmethod
+    def claim(cls, id):
+        """Move the job from pending to running and return whether this
+        caller got it; concurrent workers race on one conditional UPDATE."""
+        count = db.session.query(cls).filter(
+            cls.id == id, cls.status == JobStatus.PENDING).update(
+                {cls.status: JobStatus.RUNNING,
+                 cls.started_at: datetime.utcnow()},
+                synchronize_session=False)
+        db.session.commit()
+        return count == 1
+
+    @classmethod
+    def requeue_stale(cls, started_before):
+        """Move the jobs running since before started_before back to
+        pending, as their worker is taken to have died, and return how many
+        were moved."""
+        count = db.session.query(cls).filter(
+            cls.status == JobStatus.RUNNING,
+            cls.started_at < started_before).update(
+                {cls.status: JobStatus.PENDING, cls.started_at: None},
+                synchronize_session=False)
+        db.session.commit()
+        return count
+
+    def finish(self, error=None):
+        self.status = JobStatus.FAILED if error else JobStatus.SUCCEEDED
+        self.error = error
+        self.finished_at = datetime.utcnow()
+        self.save()
+
+    def __repr__(self):
+        return '<Job {} {} {}>'.format(self.id, self.name, self.status.name)
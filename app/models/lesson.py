@@ -1,8 +1,12 @@
-from datetime import datetime
-from sqlalchemy import event
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.base import NO_VALUE
-from .database import db, Model, SurrogatePK, TimestampMixin
+from .counters import RowCount
+from .database import db, Model, ConflictError, SurrogatePK, TimestampMixin
+from .intervals import Interval, IntervalIndex
 
 
 template_lesson_instructor_association = (
@@ -11,7 +15,7 @@ template_lesson_instructor_association = (
                        db.ForeignKey('template_lesson.id'),
                        primary_key=True),
              db.Column('instructor_id', db.Integer, db.ForeignKey('person.id'),
-                       primary_key=True)
+                       primary_key=True, index=True)
              )
 )
 
@@ -20,7 +24,7 @@ lesson_instructor_association = (
              db.Column('lesson_id', db.Integer, db.ForeignKey('lesson.id'),
                        primary_key=True),
              db.Column('instructor_id', db.Integer, db.ForeignKey('person.id'),
-                       primary_key=True)
+                       primary_key=True, index=True)
              )
 )
 
@@ -30,7 +34,7 @@ lesson_guest_student_association = (
                        primary_key=True),
              db.Column('guest_student_id', db.Integer,
                        db.ForeignKey('person.id'),
-                       primary_key=True)
+                       primary_key=True, index=True)
              )
 )
 
@@ -47,30 +51,45 @@ lesson_guest_student_association = (
 
 class TemplateLesson(SurrogatePK, TimestampMixin, Model):
     __tablename__ = 'template_lesson'
-    time_slot_id = db.Column(db.Integer, db.ForeignKey('time_slot.id'))
+    time_slot_id = db.Column(db.Integer, db.ForeignKey('time_slot.id'),
+                             index=True)
     location_id = db.Column(
         db.Integer,
-        db.ForeignKey('address.id')
+        db.ForeignKey('address.id'),
+        index=True,
     )
     class_session_id = db.Column(
         db.Integer,
-        db.ForeignKey('class_session.id')
+        db.ForeignKey('class_session.id'),
+        index=True,
+    )
+    #  the job materializing the lessons, when there are too many of them
+    #  to create within the request
+    materialization_job_id = db.Column(
+        db.Integer,
+        db.ForeignKey('job.id'),
+        index=True,
     )
 
     time_slot = db.relationship(
         'TimeSlot',
-        lazy='subquery'
+        lazy='select'
+    )
+
+    materialization_job = db.relationship(
+        'Job',
+        lazy='select'
     )
 
     instructors = db.relationship(
         'Person',
         secondary=template_lesson_instructor_association,
-        lazy='subquery'
+        lazy='select'
     )
 
     location = db.relationship(
         'Address',
-        lazy='subquery'
+        lazy='select'
     )
 
     #  locations = db.relationship(
@@ -79,17 +98,9 @@ class TemplateLesson(SurrogatePK, TimestampMixin, Model):
     #      lazy='subquery'
     #  )
 @event.listens_for(TemplateLesson.class_session_id, 'set')
-def link_template_lesson_to_class_session_id(
+def unlink_template_lesson_from_class_session_id(
         target, value, oldvalue, initiator):
-    from . import ClassSession, TimeSlot
-    if (value is not None and oldvalue == NO_VALUE and
-            target.time_slot_id is not None):
-        class_session = ClassSession.get_with_id(value)
-        target.time_slot = TimeSlot.get_with_id(target.time_slot_id)
-        db.session.add_all(
-            class_session.create_lessons_for_template_lesson(target))
-    elif (value is None and oldvalue is not NO_VALUE):
-        class_session = ClassSession.get_with_id(oldvalue)
+    if (value is None and oldvalue is not NO_VALUE):
         lessons = db.session.query(RepeatedLesson).filter_by(
             template_lesson_id=target.id).all()
         for lesson in lessons:
@@ -97,16 +108,27 @@ def link_template_lesson_to_class_session_id(
         db.session.add_all(lessons)
 
 
-@event.listens_for(TemplateLesson.time_slot_id, 'set')
-def link_template_lesson_to_class_session_id(
-        target, value, oldvalue, initiator):
-    from . import ClassSession, TimeSlot
-    if (value is not None and oldvalue == NO_VALUE and
-            target.class_session_id is not None):
-        class_session = ClassSession.get_with_id(target.class_session_id)
-        target.time_slot = TimeSlot.get_with_id(value)
-        db.session.add_all(
-            class_session.create_lessons_for_template_lesson(target))
+class InstructorConflictError(ConflictError):
+
+    def __init__(self, instructor_id, conflicts):
+        super().__init__(
+            'instructor {} would teach overlapping lessons: {}'.format(
+                instructor_id, ', '.join(
+                    '{} and {}'.format(first.key, second.key)
+                    for first, second in conflicts)))
+        self.instructor_id = instructor_id
+        self.conflicts = conflicts
+
+
+def get_end_at(start_at, duration):
+    # duration is in minutes
+    if start_at is None:
+        return None
+    return start_at + timedelta(minutes=duration or 0)
+
+
+def lesson_interval(lesson_id, start_at, duration):
+    return Interval(start_at, get_end_at(start_at, duration), lesson_id)
 
 
 class Lesson(SurrogatePK, TimestampMixin, Model):
@@ -115,6 +137,8 @@ class Lesson(SurrogatePK, TimestampMixin, Model):
     type = db.Column(db.String(50))
     start_at = db.Column(db.DateTime)
     duration = db.Column(db.Integer)
+    #  materialized start_at + duration, for overlap queries
+    end_at = db.Column(db.DateTime)
 
     class_session_id = db.Column(
         db.Integer,
@@ -130,20 +154,20 @@ class Lesson(SurrogatePK, TimestampMixin, Model):
     instructors = db.relationship(
         'Person',
         secondary=lesson_instructor_association,
-        lazy='subquery',
+        lazy='select',
         backref=db.backref('instructed_lessons', lazy='dynamic')
     )
 
     guest_students = db.relationship(
         'Person',
         secondary=lesson_guest_student_association,
-        lazy='subquery',
-        backref=db.backref('visiting_lessons', lazy='subquery')
+        lazy='select',
+        backref=db.backref('visiting_lessons', lazy='select')
     )
 
     location = db.relationship(
         'Address',
-        lazy='subquery'
+        lazy='select'
     )
 
     __mapper_args__ = {
@@ -151,6 +175,228 @@ class Lesson(SurrogatePK, TimestampMixin, Model):
         'polymorphic_on': type,
     }
 
+    __table_args__ = (
+        db.Index('ix_lesson_class_session_id_start_at',
+                 'class_session_id', 'start_at'),
+        db.Index('ix_lesson_location_id_start_at',
+                 'location_id', 'start_at'),
+        #  makes max(duration), the lower bound of overlap queries, one
+        #  index lookup
+        db.Index('ix_lesson_duration', 'duration'),
+        #  the keyset order of lesson pages
+        db.Index('ix_lesson_start_at_id', 'start_at', 'id'),
+    )
+
+    @classmethod
+    def get_keyset(cls):
+        return [cls.start_at, cls.id]
+
+    @classmethod
+    def bulk_create(cls, mappings, commit=True):
+        lesson_count.increment(db.session, [
+            mapping.get('class_session_id') for mapping in mappings])
+        return super().bulk_create(mappings, commit=commit)
+
+    @classmethod
+    def bulk_update(cls, ids, values, commit=True):
+        if 'class_session_id' in values:
+            old_ids = [id for (id,) in db.session.query(
+                Lesson.class_session_id).filter(
+                    Lesson.id.in_(list(dict.fromkeys(ids))))]
+            lesson_count.decrement(db.session, old_ids)
+            lesson_count.increment(
+                db.session, [values['class_session_id']] * len(old_ids))
+        count = super().bulk_update(ids, values, commit=False)
+        if 'start_at' in values or 'duration' in values:
+            # like the mapper events, keep the materialized end_at in line
+            lesson = Lesson.__table__
+            rows = db.session.query(Lesson.id, Lesson.start_at,
+                                    Lesson.duration).filter(
+                Lesson.id.in_(list(ids))).all()
+            if rows:
+                db.session.execute(
+                    lesson.update().where(
+                        lesson.c.id == db.bindparam('lesson_id')).values(
+                            end_at=db.bindparam('lesson_end_at')),
+                    [dict(lesson_id=id,
+                          lesson_end_at=get_end_at(start_at, duration))
+                     for id, start_at, duration in rows])
+        if commit:
+            db.session.commit()
+        return count
+
+    @classmethod
+    def get_max_duration(cls):
+        return db.session.query(db.func.max(cls.duration)).scalar() or 0
+
+    @classmethod
+    def get_overlap_criteria(cls, start, end):
+        """Return the criteria of the lessons overlapping [start, end).
+
+        Both bounds are put on start_at, so an index on start_at reads only
+        the lessons starting between start minus the longest duration and
+        end instead of every lesson before end. end_at drops the lessons
+        that end before start among them.
+        """
+        lesson = cls.__table__
+        return [
+            lesson.c.start_at >= start - timedelta(
+                minutes=cls.get_max_duration()),
+            lesson.c.start_at < end,
+            lesson.c.end_at > start,
+        ]
+
+    @classmethod
+    def get_calendar(cls, person_id, start=None, end=None, roles=None,
+                     overlapping=False):
+        """Return the lessons of person_id starting at or after start and
+        before end, as rows of lesson_id, start_at, duration,
+        class_session_id, location_id and role, ordered by start. With
+        overlapping, the lessons overlapping [start, end) instead.
+
+        The person attends a lesson as a student through an enrollment in
+        its class session, as a guest student, or teaches it as an
+        instructor of the lesson or of its class session. All of them are
+        read with one UNION of range queries on the lesson start. Without
+        start or end the range is open on that side; roles restricts the
+        roles looked at.
+        """
+        from . import Enrollment
+        from .class_session import class_session_instructor_association
+        lesson = cls.__table__
+        enrollment = Enrollment.__table__
+        in_range = []
+        if overlapping:
+            in_range = cls.get_overlap_criteria(start, end)
+        elif start is not None:
+            in_range.append(lesson.c.start_at >= start)
+        if end is not None and not overlapping:
+            in_range.append(lesson.c.start_at < end)
+
+        def select(role, table, onclause, *criteria):
+            return db.select([
+                lesson.c.id.label('lesson_id'), lesson.c.start_at,
+                lesson.c.duration, lesson.c.class_session_id,
+                lesson.c.location_id, db.literal(role).label('role'),
+            ]).select_from(lesson.join(table, onclause)).where(db.and_(
+                *(in_range + list(criteria))))
+
+        branches = [
+            ('student', enrollment,
+             enrollment.c.class_session_id == lesson.c.class_session_id,
+             enrollment.c.enrolled_person_id == person_id,
+             enrollment.c.terminated == db.false()),
+            ('guest', lesson_guest_student_association,
+             lesson_guest_student_association.c.lesson_id == lesson.c.id,
+             lesson_guest_student_association.c.guest_student_id == person_id),
+            ('instructor', lesson_instructor_association,
+             lesson_instructor_association.c.lesson_id == lesson.c.id,
+             lesson_instructor_association.c.instructor_id == person_id),
+            ('instructor', class_session_instructor_association,
+             class_session_instructor_association.c.class_session_id
+             == lesson.c.class_session_id,
+             class_session_instructor_association.c.instructor_id
+             == person_id),
+        ]
+        selects = [select(*branch) for branch in branches
+                   if roles is None or branch[0] in roles]
+        calendar = db.union(*selects).alias('calendar')
+        return db.session.execute(db.select([calendar]).order_by(
+            calendar.c.start_at, calendar.c.lesson_id, calendar.c.role)
+        ).fetchall()
+
+    @classmethod
+    def get_instructor_index(cls, person_id, start=None, end=None,
+                             exclude_ids=()):
+        """Return an IntervalIndex of the lessons person_id teaches, keyed
+        by lesson id, leaving out exclude_ids. With start and end, only of
+        the lessons overlapping [start, end)."""
+        if start is not None and end is not None:
+            rows = cls.get_calendar(person_id, start, end,
+                                    roles=('instructor',), overlapping=True)
+        else:
+            rows = cls.get_calendar(person_id, roles=('instructor',))
+        return IntervalIndex(
+            lesson_interval(row.lesson_id, row.start_at, row.duration)
+            for row in rows
+            if row.start_at is not None and row.lesson_id not in exclude_ids)
+
+    @classmethod
+    def check_instructor_conflicts(cls, person_id, lessons):
+        """Raise InstructorConflictError if person_id cannot teach lessons
+        because they overlap each other or a lesson person_id teaches."""
+        candidates = [lesson_interval(lesson.id, lesson.start_at,
+                                      lesson.duration)
+                      for lesson in lessons if lesson.start_at is not None]
+        if not candidates:
+            return
+        # only the lessons that can overlap a candidate are read
+        index = cls.get_instructor_index(
+            person_id, min(candidate.start for candidate in candidates),
+            max(candidate.end for candidate in candidates),
+            {lesson.id for lesson in lessons})
+        conflicts = [(other, candidate) for candidate in candidates
+                     for other in index.overlaps(candidate.start,
+                                                 candidate.end)]
+        conflicts.extend(IntervalIndex(candidates).conflicts())
+        if conflicts:
+            raise InstructorConflictError(person_id, conflicts)
+
+    @classmethod
+    def get_occupancy(cls, address_ids, start, end):
+        """Return, for every address id, the lessons taking place there
+        that overlap [start, end), ordered by start, with the ids of the
+        other lessons overlapping each of them.
+
+        A lesson takes place at its own location, or at the locations of
+        its class session when it has none. The lessons of all addresses
+        are read with one query on the materialized lesson times and
+        checked with one sweep per address.
+        """
+        from .class_session import class_session_address_association
+        lesson = cls.__table__
+        session_address = class_session_address_association
+        columns = [lesson.c.id.label('lesson_id'), lesson.c.start_at,
+                   lesson.c.end_at, lesson.c.class_session_id]
+        in_range = cls.get_overlap_criteria(start, end)
+        occupancy = db.union(
+            db.select([lesson.c.location_id.label('address_id')] + columns)
+            .where(db.and_(lesson.c.location_id.in_(address_ids),
+                           *in_range)),
+            # from the class sessions at the addresses to their lessons in
+            # range, through the (class_session_id, start_at) index; the
+            # coalesce keeps the planner from reading every lesson without
+            # a location through the location index instead
+            db.select([session_address.c.address_id] + columns)
+            .select_from(session_address.join(
+                lesson, lesson.c.class_session_id
+                == session_address.c.class_session_id))
+            .where(db.and_(session_address.c.address_id.in_(address_ids),
+                           db.func.coalesce(lesson.c.location_id, 0) == 0,
+                           *in_range)),
+        ).alias('occupancy')
+        rows = db.session.execute(db.select([occupancy]).order_by(
+            occupancy.c.address_id, occupancy.c.start_at,
+            occupancy.c.lesson_id))
+
+        rows_by_address = {id: [] for id in address_ids}
+        for row in rows:
+            rows_by_address[row.address_id].append(row)
+        occupancy_by_address = {}
+        for address_id, address_rows in rows_by_address.items():
+            index = IntervalIndex(Interval(row.start_at, row.end_at,
+                                           row.lesson_id)
+                                  for row in address_rows)
+            conflicting_ids = {row.lesson_id: [] for row in address_rows}
+            for first, second in index.conflicts():
+                conflicting_ids[first.key].append(second.key)
+                conflicting_ids[second.key].append(first.key)
+            occupancy_by_address[address_id] = [
+                dict(row, conflicting_lesson_ids=sorted(
+                    conflicting_ids[row.lesson_id]))
+                for row in address_rows]
+        return occupancy_by_address
+
 
 class RepeatedLesson(Lesson):
     __tablename__ = 'repeated_lesson'
@@ -163,10 +409,124 @@ class RepeatedLesson(Lesson):
 
     template_lesson = db.relationship(
         'TemplateLesson',
-        lazy='subquery'
+        lazy='select'
     )
 
     __mapper_args__ = {
         'polymorphic_identity': __tablename__,
     }
 
+    __table_args__ = (
+        db.UniqueConstraint('template_lesson_id', 'index_of_rep',
+                            name='template_lesson_index_of_rep_unique'),
+    )
+
+
+# ClassSession.lesson_count
+lesson_count = RowCount('lesson_count', Lesson.__table__.c.class_session_id)
+lesson_count.listen(Lesson)
+
+
+@event.listens_for(Lesson, 'before_insert', propagate=True)
+@event.listens_for(Lesson, 'before_update', propagate=True)
+def auto_set_end_at_for_lesson(mapper, connection, target):
+    target.end_at = get_end_at(target.start_at, target.duration)
+
+
+@event.listens_for(TemplateLesson, 'after_update')
+def move_repeated_lessons_with_template_lesson(mapper, connection, target):
+    # the repeated lessons that did not get a location of their own
+    # follow the location of their template lesson
+    history = inspect(target).attrs.location_id.history
+    if not history.has_changes():
+        return
+    old_location_id = history.deleted[0] if history.deleted else None
+    lesson = Lesson.__table__
+    repeated_lesson_ids = db.select([RepeatedLesson.__table__.c.id]).where(
+        RepeatedLesson.__table__.c.template_lesson_id == target.id)
+    location_criterion = (lesson.c.location_id.is_(None)
+                          if old_location_id is None
+                          else lesson.c.location_id == old_location_id)
+    connection.execute(lesson.update().where(db.and_(
+        lesson.c.id.in_(repeated_lesson_ids), location_criterion)).values(
+            location_id=target.location_id))
+
+
+@event.listens_for(db.session, 'before_flush')
+def check_instructor_conflicts(session, flush_context, instances):
+    from . import ClassSession
+    lessons_by_instructor = {}
+    for target in list(session.new) + list(session.dirty):
+        if not isinstance(target, (Lesson, ClassSession)):
+            continue
+        instructors = inspect(target).attrs.instructors.history.added
+        if not instructors:
+            continue
+        if isinstance(target, Lesson):
+            lessons = [target]
+        else:
+            # not target.lessons, a dynamic relationship flushes first
+            lessons = [lesson for lesson in session.new
+                       if isinstance(lesson, Lesson)
+                       and lesson.class_session is target]
+            if target.id is not None:
+                lessons.extend(session.query(Lesson).filter_by(
+                    class_session_id=target.id))
+        for instructor in instructors:
+            lessons_by_instructor.setdefault(instructor, []).extend(lessons)
+    for instructor, lessons in lessons_by_instructor.items():
+        Lesson.check_instructor_conflicts(instructor.id,
+                                          list(dict.fromkeys(lessons)))
+
+
+@event.listens_for(db.session, 'after_flush')
+def materialize_lessons_of_linked_template_lessons(session, flush_context):
+    # once a template lesson has both a class session and a time slot, its
+    # lessons are inserted in bulk, after the flush wrote the ids they need
+    from . import ClassSession, TimeSlot, Job
+    threshold = (current_app.config.get('LESSON_JOB_THRESHOLD')
+                 if has_app_context() else None)
+    pending_template_lessons = {
+        lesson.template_lesson for lesson in session.new
+        if isinstance(lesson, RepeatedLesson)}
+    template_lessons_by_session_id = {}
+    for target in list(session.new) + list(session.dirty):
+        if (not isinstance(target, TemplateLesson)
+                or target.class_session_id is None
+                or target.time_slot_id is None
+                or target in pending_template_lessons):
+            continue
+        if target not in session.new:
+            state = inspect(target)
+            linked = False
+            for key in ('class_session_id', 'time_slot_id'):
+                history = state.attrs[key].history
+                if history.added and all(old is None
+                                         for old in history.deleted):
+                    linked = True
+            if not linked:
+                continue
+        template_lessons_by_session_id.setdefault(
+            target.class_session_id, []).append(target)
+    for class_session_id, template_lessons in (
+            template_lessons_by_session_id.items()):
+        for tl in template_lessons:
+            # pending instances do not lazy load, and set_committed_value
+            # leaves the flushed state untouched
+            if tl.time_slot is None:
+                set_committed_value(tl, 'time_slot', session.query(
+                    TimeSlot).get(tl.time_slot_id))
+        class_session = session.query(ClassSession).get(class_session_id)
+        _, counts = class_session.count_lessons(template_lessons)
+        if threshold is None or counts.sum() <= threshold:
+            class_session.materialize_lessons(template_lessons)
+            continue
+        # too many for the request, hand them to the job queue
+        connection = session.connection()
+        template_lesson_table = TemplateLesson.__table__
+        for tl in template_lessons:
+            job_id = Job.insert(connection, 'materialize_lessons',
+                                template_lesson_id=tl.id)
+            connection.execute(template_lesson_table.update().where(
+                template_lesson_table.c.id == tl.id).values(
+                    materialization_job_id=job_id))
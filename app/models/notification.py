@@ -8,6 +8,7 @@ class NotificationDelivery(SurrogatePK, TimestampMixin, Model):
     notification_id = db.Column(
         db.Integer,
         db.ForeignKey('notification.id'),
+        index=True,
     )
     receiver_id = db.Column(
         db.Integer,
@@ -18,13 +19,19 @@ class NotificationDelivery(SurrogatePK, TimestampMixin, Model):
     notification = db.relationship(
         'Notification',
         back_populates='deliveries',
-        lazy='subquery'
+        lazy='select'
     )
 
     receiver = db.relationship(
         'Person',
         back_populates='notification_deliveries',
-        lazy='subquery'
+        lazy='select'
+    )
+
+    __table_args__ = (
+        #  the undelivered notifications of a receiver
+        db.Index('ix_notification_person_delivery_receiver_id_delivered_at',
+                 'receiver_id', 'delivered_at'),
     )
 
 
@@ -34,7 +41,8 @@ class Notification(SurrogatePK, TimestampMixin, Model):
     sender_id = db.Column(
         db.Integer,
         db.ForeignKey('person.id'),
-        nullable=False
+        nullable=False,
+        index=True,
     )
 
     deliveries = db.relationship(
@@ -45,7 +53,7 @@ class Notification(SurrogatePK, TimestampMixin, Model):
 
     sender = db.relationship(
         'Person',
-        lazy='subquery',
+        lazy='select',
         backref=db.backref('posted_notifications', lazy='dynamic'),
     )
 
@@ -13,20 +13,26 @@ class OrganizationPersonAssociation(SurrogatePK, TimestampMixin, Model):
     associated_person_id = db.Column(
         db.Integer,
         db.ForeignKey('person.id'),
+        index=True,
     )
     terminated = db.Column(db.Boolean, nullable=False, default=False)
-    initiator_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    initiator_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
 
     organization = db.relationship(
         'Organization',
         back_populates='organization_person_associations',
-        lazy='subquery'
+        lazy='select'
     )
 
     associated_person = db.relationship(
         'Person',
         back_populates='organization_person_associations',
-        lazy='subquery'
+        lazy='select'
+    )
+
+    __table_args__ = (
+        db.Index('ix_organization_person_association_organization_id_'
+                 'terminated', 'organization_id', 'terminated'),
     )
 
 
@@ -34,7 +40,8 @@ class Organization(SurrogatePK, TimestampMixin, Model):
     __tablename__ = 'organization'
 
     name = db.Column(db.String(100), nullable=None)
-    creator_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=None)
+    creator_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=None,
+                           index=True)
 
     organization_person_associations = db.relationship(
         'OrganizationPersonAssociation',
@@ -46,7 +53,7 @@ class Organization(SurrogatePK, TimestampMixin, Model):
     creator = db.relationship(
         'User',
         backref='created_organizations',
-        lazy='subquery'
+        lazy='select'
     )
 
     def __repr__(self):
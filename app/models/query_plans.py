@@ -0,0 +1,230 @@
+"""Query plans of the hot queries of the app.
+
+Every function registered with hot_query builds one statement the app runs
+on a hot path, with representative parameters. find_full_scans runs a
+statement through the EXPLAIN of the database and returns the tables it
+reads from start to end, which the index-advisor command reports as
+missing indexes.
+"""
+from datetime import datetime
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from .database import db
+from .class_session import (ClassSession, class_session_address_association,
+                            class_session_instructor_association)
+from .enrollment import Enrollment, WaitlistEntry
+from .lesson import (Lesson, RepeatedLesson, TemplateLesson,
+                     lesson_guest_student_association,
+                     lesson_instructor_association)
+from .notification import NotificationDelivery
+from .organization import OrganizationPersonAssociation
+from .schedule import TimeSlot
+
+#  name -> function building the statement
+hot_queries = {}
+
+
+def hot_query(name):
+    def register(build):
+        hot_queries[name] = build
+        return build
+    return register
+
+
+class Explain(Executable, ClauseElement):
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def visit_explain(element, compiler, **kw):
+    return 'EXPLAIN ' + compiler.process(element.statement, **kw)
+
+
+@compiles(Explain, 'sqlite')
+def visit_explain_sqlite(element, compiler, **kw):
+    return 'EXPLAIN QUERY PLAN ' + compiler.process(element.statement, **kw)
+
+
+def get_plan(connection, statement):
+    """Return the lines of the query plan of statement."""
+    if connection.dialect.name == 'postgresql':
+        # tables of a few rows are always read sequentially, only an index
+        # that cannot be used at all should show up as a scan
+        connection.execute('SET LOCAL enable_seqscan = off')
+    rows = connection.execute(Explain(statement)).fetchall()
+    if connection.dialect.name == 'sqlite':
+        return [row.detail for row in rows]
+    return [row[0] for row in rows]
+
+
+def get_scanned_table(dialect_name, line):
+    """Return the table a line of a query plan reads in full, if any."""
+    words = line.split()
+    if dialect_name == 'sqlite':
+        # SCAN <table> [USING [COVERING] INDEX <index>], or SCAN TABLE
+        # <table> before SQLite 3.36
+        if words[:1] != ['SCAN'] or len(words) < 2:
+            return None
+        table = words[2] if words[1] == 'TABLE' else words[1]
+    else:
+        if 'Seq Scan on' not in line:
+            return None
+        table = words[words.index('on') + 1]
+    # subqueries and unions are scanned too, only tables matter
+    return table if table in db.metadata.tables else None
+
+
+def find_full_scans(connection, statement):
+    """Return the names of the tables statement reads in full, with the
+    plan it was found in."""
+    plan = get_plan(connection, statement)
+    tables = [get_scanned_table(connection.dialect.name, line)
+              for line in plan]
+    return [table for table in tables if table is not None], plan
+
+
+@hot_query('active enrollments of a class session')
+def active_enrollments():
+    enrollment = Enrollment.__table__
+    return db.select([enrollment]).where(db.and_(
+        enrollment.c.class_session_id == 1,
+        enrollment.c.terminated == db.false()))
+
+
+@hot_query('enrollments of a person')
+def person_enrollments():
+    enrollment = Enrollment.__table__
+    return db.select([enrollment]).where(
+        enrollment.c.enrolled_person_id == 1)
+
+
+@hot_query('class sessions of a class')
+def class_sessions():
+    class_session = ClassSession.__table__
+    return db.select([class_session]).where(class_session.c.class_id == 1)
+
+
+@hot_query('head of a waitlist')
+def waitlist_head():
+    entry = WaitlistEntry.__table__
+    return db.select([entry]).where(entry.c.class_session_id == 1).order_by(
+        entry.c.position).limit(10)
+
+
+@hot_query('waitlist entries of a person')
+def person_waitlist_entries():
+    entry = WaitlistEntry.__table__
+    return db.select([entry]).where(entry.c.person_id == 1)
+
+
+@hot_query('time slots of a schedule')
+def schedule_time_slots():
+    time_slot = TimeSlot.__table__
+    return db.select([time_slot]).where(
+        time_slot.c.schedule_id == 1).order_by(time_slot.c.start_at)
+
+
+@hot_query('template lessons of a class session')
+def class_session_template_lessons():
+    template_lesson = TemplateLesson.__table__
+    return db.select([template_lesson]).where(
+        template_lesson.c.class_session_id == 1)
+
+
+@hot_query('lessons of a class session in a month')
+def class_session_lessons():
+    lesson = Lesson.__table__
+    return db.select([lesson]).where(db.and_(
+        lesson.c.class_session_id == 1,
+        lesson.c.start_at >= datetime(2018, 3, 1),
+        lesson.c.start_at < datetime(2018, 4, 1))).order_by(
+            lesson.c.start_at)
+
+
+@hot_query('repeated lessons of a template lesson')
+def template_lesson_lessons():
+    repeated_lesson = RepeatedLesson.__table__
+    return db.select([repeated_lesson]).where(
+        repeated_lesson.c.template_lesson_id == 1).order_by(
+            repeated_lesson.c.index_of_rep)
+
+
+@hot_query('calendar of a person')
+def person_calendar():
+    # the branches of Lesson.get_calendar
+    lesson = Lesson.__table__
+    enrollment = Enrollment.__table__
+    guest = lesson_guest_student_association
+    instructor = lesson_instructor_association
+    session_instructor = class_session_instructor_association
+    in_range = [lesson.c.start_at >= datetime(2018, 3, 1),
+                lesson.c.start_at < datetime(2018, 4, 1)]
+    return db.union(
+        db.select([lesson.c.id]).select_from(lesson.join(
+            enrollment,
+            enrollment.c.class_session_id == lesson.c.class_session_id))
+        .where(db.and_(enrollment.c.enrolled_person_id == 1,
+                       enrollment.c.terminated == db.false(), *in_range)),
+        db.select([lesson.c.id]).select_from(lesson.join(
+            guest, guest.c.lesson_id == lesson.c.id))
+        .where(db.and_(guest.c.guest_student_id == 1, *in_range)),
+        db.select([lesson.c.id]).select_from(lesson.join(
+            instructor, instructor.c.lesson_id == lesson.c.id))
+        .where(db.and_(instructor.c.instructor_id == 1, *in_range)),
+        db.select([lesson.c.id]).select_from(lesson.join(
+            session_instructor, session_instructor.c.class_session_id
+            == lesson.c.class_session_id))
+        .where(db.and_(session_instructor.c.instructor_id == 1, *in_range)))
+
+
+@hot_query('lessons of an instructor overlapping new lessons')
+def instructor_overlaps():
+    # the instructor branches of Lesson.get_calendar with overlapping
+    lesson = Lesson.__table__
+    instructor = lesson_instructor_association
+    session_instructor = class_session_instructor_association
+    in_range = Lesson.get_overlap_criteria(datetime(2018, 3, 1, 9),
+                                           datetime(2018, 3, 1, 10))
+    return db.union(
+        db.select([lesson.c.id]).select_from(lesson.join(
+            instructor, instructor.c.lesson_id == lesson.c.id))
+        .where(db.and_(instructor.c.instructor_id == 1, *in_range)),
+        db.select([lesson.c.id]).select_from(lesson.join(
+            session_instructor, session_instructor.c.class_session_id
+            == lesson.c.class_session_id))
+        .where(db.and_(session_instructor.c.instructor_id == 1, *in_range)))
+
+
+@hot_query('occupancy of an address')
+def address_occupancy():
+    # the branches of Lesson.get_occupancy
+    lesson = Lesson.__table__
+    session_address = class_session_address_association
+    in_range = Lesson.get_overlap_criteria(datetime(2018, 3, 1),
+                                           datetime(2018, 3, 8))
+    return db.union(
+        db.select([lesson.c.id]).where(db.and_(
+            lesson.c.location_id.in_([1, 2]), *in_range)),
+        db.select([lesson.c.id]).select_from(session_address.join(
+            lesson, lesson.c.class_session_id
+            == session_address.c.class_session_id))
+        .where(db.and_(session_address.c.address_id.in_([1, 2]),
+                       db.func.coalesce(lesson.c.location_id, 0) == 0,
+                       *in_range)))
+
+
+@hot_query('undelivered notifications of a person')
+def undelivered_notifications():
+    delivery = NotificationDelivery.__table__
+    return db.select([delivery]).where(db.and_(
+        delivery.c.receiver_id == 1, delivery.c.delivered_at.is_(None)))
+
+
+@hot_query('members of an organization')
+def organization_members():
+    association = OrganizationPersonAssociation.__table__
+    return db.select([association]).where(db.and_(
+        association.c.organization_id == 1,
+        association.c.terminated == db.false()))
@@ -0,0 +1,105 @@
+"""Batch expansion of RepeatOption recurrences with NumPy.
+
+Occurrences are computed relative to their base start, exactly like
+RepeatOption.get_repeat_datetime: monthly and yearly repeats keep the day of
+the base start and clamp it to the last day of shorter months, so a slot
+starting on Jan 31 repeats on Feb 28 (or 29), Mar 31, Apr 30 and so on.
+"""
+import numpy as np
+
+DATETIME_UNIT = 'datetime64[us]'
+
+#  repeat option name -> days between occurrences
+PERIOD_DAYS = {'DAILY': 1, 'WEEKLY': 7, 'BIWEEKLY': 14}
+#  repeat option name -> months between occurrences
+PERIOD_MONTHS = {'MONTHLY': 1, 'YEARLY': 12}
+
+
+def to_datetime64(datetimes):
+    return np.asarray(datetimes, dtype=DATETIME_UNIT)
+
+
+def to_datetimes(datetime64s):
+    return datetime64s.astype(DATETIME_UNIT).astype(object).tolist()
+
+
+def add_months(starts, months):
+    """Add months to every start, clamping the day to the month length."""
+    start_months = starts.astype('datetime64[M]')
+    start_days = starts.astype('datetime64[D]')
+    day_offsets = start_days - start_months.astype('datetime64[D]')
+    times_of_day = starts - start_days
+
+    target_months = start_months + months.astype('timedelta64[M]')
+    target_first_days = target_months.astype('datetime64[D]')
+    month_lengths = (
+        (target_months + np.timedelta64(1, 'M')).astype('datetime64[D]')
+        - target_first_days)
+    day_offsets = np.minimum(day_offsets,
+                             month_lengths - np.timedelta64(1, 'D'))
+    return target_first_days + day_offsets + times_of_day
+
+
+def repeat_datetimes(repeat_option, starts, nums):
+    """Return the occurrence nums[i] of a slot starting at starts[i], for
+    every i, as a datetime64 array."""
+    starts = to_datetime64(starts)
+    nums = np.asarray(nums, dtype=np.int64)
+    name = repeat_option.name
+    if name in PERIOD_DAYS:
+        return starts + (nums * PERIOD_DAYS[name]).astype('timedelta64[D]')
+    if name in PERIOD_MONTHS:
+        return add_months(starts, nums * PERIOD_MONTHS[name])
+    if name == 'NEVER':
+        if np.any(nums != 0):
+            raise ValueError('{} has no repeats'.format(repeat_option))
+        return starts
+    raise ValueError(
+        'occurrences of {} cannot be computed'.format(repeat_option))
+
+
+def count_occurrences(repeat_option, starts, end_at, inclusive=True):
+    """Return how many occurrences of each slot start at or before end_at
+    (strictly before it unless inclusive)."""
+    starts = to_datetime64(starts)
+    end_at = np.datetime64(end_at, 'us')
+    name = repeat_option.name
+    if name == 'NEVER':
+        last_nums = np.zeros(starts.shape, dtype=np.int64)
+    elif name in PERIOD_DAYS:
+        period = np.timedelta64(PERIOD_DAYS[name], 'D')
+        last_nums = (end_at - starts) // period
+    elif name in PERIOD_MONTHS:
+        months = (end_at.astype('datetime64[M]')
+                  - starts.astype('datetime64[M]')).astype(np.int64)
+        last_nums = months // PERIOD_MONTHS[name]
+    else:
+        raise ValueError(
+            'occurrences of {} cannot be computed'.format(repeat_option))
+    # the estimate is exact or one too far when days get clamped
+    last_nums = np.maximum(last_nums, 0)
+    last = repeat_datetimes(repeat_option, starts, last_nums)
+    past_end = last > end_at if inclusive else last >= end_at
+    last_nums = last_nums - past_end
+    return np.where(starts > end_at if inclusive else starts >= end_at,
+                    0, last_nums + 1)
+
+
+def expand(repeat_option, starts, counts, first_nums=None):
+    """Expand counts[i] occurrences of every slot starting at starts[i],
+    from its repeat number first_nums[i] on (0 by default).
+
+    Return the occurrences, the index into starts of the slot each one
+    repeats and its repeat number, as three arrays ordered by slot, then
+    repeat number.
+    """
+    starts = to_datetime64(starts)
+    counts = np.asarray(counts, dtype=np.int64)
+    base_indexes = np.repeat(np.arange(len(starts)), counts)
+    # 0, 1, ..., counts[0] - 1, 0, 1, ..., counts[1] - 1, ...
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    nums = np.arange(len(base_indexes)) - offsets
+    if first_nums is not None:
+        nums += np.asarray(first_nums, dtype=np.int64)[base_indexes]
+    return (repeat_datetimes(repeat_option, starts[base_indexes], nums),
+            base_indexes, nums)
@@ -1,9 +1,15 @@
 import enum
+import heapq
+from collections import namedtuple
 from datetime import datetime, timedelta
+from operator import attrgetter
 from calendar import monthrange
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy import event
+import numpy as np
 from .database import db, Model, SurrogatePK, TimestampMixin
+from .recurrence import (count_occurrences, expand, repeat_datetimes,
+                         to_datetime64, to_datetimes)
 
 
 class RepeatOption(enum.Enum):
@@ -60,21 +66,33 @@ class RepeatOption(enum.Enum):
             return None
 
 
-class TimeSlot(SurrogatePK, Model):
+#  One occurrence of a base time slot of a schedule
+Occurrence = namedtuple('Occurrence',
+                        ['start_at', 'duration', 'base_slot_id', 'repeat_num'])
+
+
+class TimeSlot(SurrogatePK, TimestampMixin, Model):
     __tablename__ = 'time_slot'
     start_at = db.Column(db.DateTime, nullable=False)
     # duration is in minutes
     duration = db.Column(db.Integer, default=0, nullable=False)
     schedule_id = db.Column(db.Integer, db.ForeignKey('schedule.id'))
 
+    __table_args__ = (
+        #  the time slots of a schedule in order of start_at
+        db.Index('ix_time_slot_schedule_id_start_at',
+                 'schedule_id', 'start_at'),
+    )
+
     def __repr__(self):
         return '<TimeSlot> {} seconds long that starts at: {}'.format(
             self.duration, self.start_at)
 
 
-class RepeatTimeSlot(SurrogatePK, Model):
+class RepeatTimeSlot(SurrogatePK, TimestampMixin, Model):
     __tablename__ = 'repeat_time_slot'
-    base_time_slot_id = db.Column(db.Integer, db.ForeignKey('time_slot.id'))
+    base_time_slot_id = db.Column(db.Integer, db.ForeignKey('time_slot.id'),
+                                  index=True)
     repeat_option = db.Column(
         db.Enum(RepeatOption, validate_strings=True),
         default=RepeatOption.NEVER,
@@ -88,7 +106,12 @@ class RepeatTimeSlot(SurrogatePK, Model):
 
     base_time_slot = db.relationship(
         'TimeSlot',
-        lazy='subquery'
+        lazy='select'
+    )
+
+    __table_args__ = (
+        db.Index('ix_repeat_time_slot_schedule_id_start_at',
+                 'schedule_id', 'start_at'),
     )
 
     def get_start_at(self):
@@ -109,7 +132,7 @@ def auto_set_start_at_for_repeat_time_slot(mapper, connection, target):
     target.start_at = target.get_start_at()
 
 
-class Schedule(SurrogatePK, Model):
+class Schedule(SurrogatePK, TimestampMixin, Model):
     __tablename__ = 'schedule'
     repeat_option = db.Column(
         db.Enum(RepeatOption, validate_strings=True),
@@ -119,12 +142,12 @@ class Schedule(SurrogatePK, Model):
     repeat_end_at = db.Column(db.DateTime)
     base_time_slots = db.relationship(
         'TimeSlot',
-        lazy='subquery',
+        lazy='select',
         order_by=(TimeSlot.start_at)
     )
     repeat_time_slots = db.relationship(
         'RepeatTimeSlot',
-        lazy='subquery',
+        lazy='select',
         order_by=(RepeatTimeSlot.start_at,)
     )
 
@@ -143,30 +166,12 @@ class Schedule(SurrogatePK, Model):
         elif self.repeat_end_at is None:
             return None
 
-        repeat_num = 0
-        all_rep_slots = []
         base_slots = self.base_time_slots
-        while len(base_slots) > 0:
-            new_base_slots = []
-            for base_time_slot in base_slots:
-                new_start_at = (
-                    self.repeat_option.get_repeat_datetime(
-                        base_time_slot.start_at,
-                        repeat_num
-                    )
-                )
-                print(new_start_at)
-                if new_start_at > self.repeat_end_at:
-                    break
-                new_rep_slot = RepeatTimeSlot(base_time_slot=base_time_slot,
-                                              repeat_num=repeat_num,
-                                              repeat_option=self.repeat_option)
-                all_rep_slots.append(new_rep_slot)
-                new_base_slots.append(base_time_slot)
-            repeat_num = repeat_num + 1
-            base_slots = new_base_slots
-
-        return all_rep_slots
+        _, base_indexes, nums = self.expand_base_time_slots()
+        return [RepeatTimeSlot(base_time_slot=base_slots[index],
+                               repeat_num=num,
+                               repeat_option=self.repeat_option)
+                for index, num in zip(base_indexes, nums)]
 
     def get_all_time_slots(self):
         if self.repeat_option == RepeatOption.SPECIFIC:
@@ -176,22 +181,113 @@ class Schedule(SurrogatePK, Model):
         elif self.repeat_end_at is None:
             return None
 
+        base_slots = self.base_time_slots
         all_time_slots = []
+        for start_at, index, num in zip(*self.expand_base_time_slots()):
+            if num == 0:
+                all_time_slots.append(base_slots[index])
+            else:
+                all_time_slots.append(TimeSlot(
+                    start_at=start_at, duration=base_slots[index].duration))
+        return all_time_slots
+
+    def iter_time_slots(self):
+        """Yield an Occurrence for every time slot of the schedule, in start
+        order, like get_all_time_slots but lazily and without building ORM
+        instances. Callers may stop early: without repeat_end_at the
+        repeats never end.
+        """
+        if self.repeat_option != RepeatOption.SPECIFIC:
+            return self.iter_repeat_time_slots()
+        base_occurrences = (Occurrence(ts.start_at, ts.duration, ts.id, 0)
+                            for ts in self.base_time_slots[:1])
+        return heapq.merge(base_occurrences, self.iter_repeat_time_slots(),
+                           key=attrgetter('start_at'))
+
+    def iter_repeat_time_slots(self):
+        """Yield an Occurrence for every repeat time slot of the schedule,
+        like get_repeat_time_slots but lazily and in start order, merging
+        the repeats of all base time slots."""
+        if self.repeat_option == RepeatOption.SPECIFIC:
+            return (Occurrence(rts.start_at, rts.base_time_slot.duration,
+                               rts.base_time_slot_id, rts.repeat_num)
+                    for rts in self.repeat_time_slots)
+        return heapq.merge(*(self.iter_repeats_of_time_slot(ts)
+                             for ts in self.base_time_slots),
+                           key=attrgetter('start_at'))
+
+    def iter_repeats_of_time_slot(self, time_slot, chunk_size=64):
+        """Yield the repeats of time_slot up to repeat_end_at, computing
+        chunk_size of them at a time."""
+        if self.repeat_option == RepeatOption.NEVER:
+            yield Occurrence(time_slot.start_at, time_slot.duration,
+                             time_slot.id, 0)
+            return
+        starts = np.repeat(to_datetime64([time_slot.start_at]), chunk_size)
+        first_num = 0
+        while True:
+            nums = np.arange(first_num, first_num + chunk_size)
+            occurrences = to_datetimes(
+                repeat_datetimes(self.repeat_option, starts, nums))
+            for num, start_at in zip(nums.tolist(), occurrences):
+                if (self.repeat_end_at is not None
+                        and start_at > self.repeat_end_at):
+                    return
+                yield Occurrence(start_at, time_slot.duration, time_slot.id,
+                                 num)
+            first_num += chunk_size
+
+    def occurrences_between(self, start, end):
+        """Return the occurrences starting at or after start and before end,
+        ordered by start.
+
+        The first repeat of each base slot inside the window is found by
+        arithmetic instead of by walking from the base slot, so the cost
+        depends on the size of the window, not on the age of the schedule.
+        Without repeat_end_at a schedule repeats forever.
+        """
         base_slots = self.base_time_slots
-        while len(base_slots) > 0:
-            new_base_slots = []
-            for base_time_slot in base_slots:
-                if base_time_slot.start_at > self.repeat_end_at:
-                    break
-                all_time_slots.append(base_time_slot)
-                new_start_at = self.repeat_option.get_repeat_datetime(
-                    base_time_slot.start_at, num=1)
-                base_time_slot = TimeSlot(start_at=new_start_at,
-                                          duration=base_time_slot.duration)
-                new_base_slots.append(base_time_slot)
-            base_slots = new_base_slots
+        if self.repeat_option == RepeatOption.SPECIFIC:
+            occurrences = [Occurrence(ts.start_at, ts.duration, ts.id, 0)
+                           for ts in base_slots[:1]]
+            occurrences.extend(
+                Occurrence(rts.start_at, rts.base_time_slot.duration,
+                           rts.base_time_slot_id, rts.repeat_num)
+                for rts in self.repeat_time_slots)
+            return sorted((occurrence for occurrence in occurrences
+                           if start <= occurrence.start_at < end),
+                          key=lambda occurrence: occurrence.start_at)
 
-        return all_time_slots
+        starts = [ts.start_at for ts in base_slots]
+        first_nums = count_occurrences(self.repeat_option, starts, start,
+                                       inclusive=False)
+        stop_nums = count_occurrences(self.repeat_option, starts, end,
+                                      inclusive=False)
+        if self.repeat_end_at is not None:
+            stop_nums = np.minimum(stop_nums, count_occurrences(
+                self.repeat_option, starts, self.repeat_end_at))
+        occurrences, indexes, nums = expand(
+            self.repeat_option, starts,
+            np.maximum(stop_nums - first_nums, 0), first_nums)
+        order = np.argsort(occurrences, kind='stable')
+        return [Occurrence(start_at, base_slots[index].duration,
+                           base_slots[index].id, num)
+                for start_at, index, num in zip(
+                    to_datetimes(occurrences[order]),
+                    indexes[order].tolist(), nums[order].tolist())]
+
+    def expand_base_time_slots(self):
+        """Return the start of every repeat of the base time slots up to
+        repeat_end_at, with the index of its base slot and its repeat
+        number, ordered by repeat number and then base slot."""
+        starts = [ts.start_at for ts in self.base_time_slots]
+        counts = count_occurrences(self.repeat_option, starts,
+                                   self.repeat_end_at)
+        occurrences, base_indexes, nums = expand(self.repeat_option, starts,
+                                                 counts)
+        order = np.lexsort((base_indexes, nums))
+        return (to_datetimes(occurrences[order]),
+                base_indexes[order].tolist(), nums[order].tolist())
 
 
 
@@ -0,0 +1,81 @@
+"""Compare creating users and addresses one POST at a time with one bulk
+POST per collection.
+
+    python benchmarks/bulk_create.py [count]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from app import create_app, db  # noqa: E402
+from app.config import TestConfig  # noqa: E402
+from app.models import User  # noqa: E402
+
+
+class BenchmarkConfig(TestConfig):
+    DEBUG = False
+
+
+def make_users(count, prefix):
+    return [dict(username='{}{}'.format(prefix, i),
+                 email='{}{}@example.com'.format(prefix, i),
+                 first_name='first', last_name='last')
+            for i in range(count)]
+
+
+def make_addresses(count, creator_id):
+    return [dict(primary_street='{} Main st'.format(i), city='Springfield',
+                 state='IL', zipcode='62701', country='USA',
+                 creator_id=creator_id)
+            for i in range(count)]
+
+
+def post(client, url, data):
+    rp = client.post(url, data=json.dumps(data),
+                     content_type='application/json')
+    assert rp.status_code == 200, rp.data
+    return rp
+
+
+def one_by_one(client, count):
+    for user in make_users(count, 'single'):
+        post(client, '/api/v1/users', user)
+    for address in make_addresses(count, 1):
+        post(client, '/api/v1/addresses', address)
+
+
+def bulk(client, count):
+    post(client, '/api/v1/users', make_users(count, 'bulk'))
+    post(client, '/api/v1/addresses', make_addresses(count, 1))
+
+
+def main(count):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    BenchmarkConfig.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+    app = create_app(BenchmarkConfig)
+    try:
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(username='creator',
+                                email='creator@example.com',
+                                first_name='first', last_name='last'))
+            db.session.commit()
+        client = app.test_client()
+        for name, run in (('one by one', one_by_one), ('bulk', bulk)):
+            start = time.perf_counter()
+            run(client, count)
+            elapsed = time.perf_counter() - start
+            print('{:<12}{:>5} users + {:>5} addresses: {:8.3f}s'.format(
+                name, count, count, elapsed))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
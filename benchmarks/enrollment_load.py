@@ -0,0 +1,100 @@
+"""Hammer POST /enrollments from concurrent workers and check that a class
+session never admits more enrollments than its capacity.
+
+    python benchmarks/enrollment_load.py [requests] [workers] [capacity]
+
+Exits with status 1 if the session was oversold or its seat counter does
+not match its enrollments.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from app import create_app, db  # noqa: E402
+from app.config import TestConfig  # noqa: E402
+from app.models import (  # noqa: E402
+    Class, ClassSession, Dependent, Enrollment, RepeatOption, Schedule,
+    TimeSlot, User)
+
+
+class BenchmarkConfig(TestConfig):
+    DEBUG = False
+    # writers queue on the database lock instead of failing right away
+    SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}}
+
+
+def make_class_session(requests, capacity):
+    user = User(username='parent', email='parent@example.com',
+                first_name='first', last_name='last')
+    user.dependents = [Dependent(first_name='kid {}'.format(i),
+                                 last_name='last')
+                       for i in range(requests)]
+    schedule = Schedule(repeat_option=RepeatOption.NEVER,
+                        base_time_slots=[TimeSlot(
+                            start_at=datetime(2018, 1, 1, 9), duration=60)])
+    class_session = ClassSession(
+        parent_class=Class(title='popular class', creator=user),
+        creator=user, schedule=schedule, capacity=capacity)
+    db.session.add_all([user, class_session])
+    db.session.commit()
+    return (class_session.id, user.id,
+            [dependent.id for dependent in user.dependents])
+
+
+def main(requests, workers, capacity):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    BenchmarkConfig.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+    app = create_app(BenchmarkConfig)
+    try:
+        with app.app_context():
+            db.create_all()
+            class_session_id, user_id, person_ids = make_class_session(
+                requests, capacity)
+
+        def enroll(person_id):
+            client = app.test_client()
+            rp = client.post('/api/v1/enrollments', data=json.dumps(dict(
+                class_session_id=class_session_id,
+                enrolled_person_id=person_id, initiator_id=user_id)),
+                content_type='application/json')
+            return rp.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            statuses = Counter(executor.map(enroll, person_ids))
+        elapsed = time.perf_counter() - start
+
+        with app.app_context():
+            enrolled = Enrollment.query.filter_by(
+                class_session_id=class_session_id, terminated=False).count()
+            seats = ClassSession.get_with_id(
+                class_session_id).enrollment_count
+    finally:
+        os.remove(path)
+
+    print('{} requests from {} workers in {:.3f}s ({:.0f} requests/s)'
+          .format(requests, workers, elapsed, requests / elapsed))
+    print('responses: {}'.format(', '.join(
+        '{} x {}'.format(count, status)
+        for status, count in sorted(statuses.items()))))
+    print('capacity {}, enrolled {}, seat counter {}'.format(
+        capacity, enrolled, seats))
+    if enrolled > capacity or seats != enrolled:
+        print('OVERSOLD' if enrolled > capacity else 'COUNTER DRIFT')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:4]]
+    defaults = [500, 16, 50]
+    sys.exit(main(*(args + defaults[len(args):])))
@@ -0,0 +1,83 @@
+"""Compare materializing the lessons of a daily class session through the
+ORM with ClassSession.create_lessons_for_template_lessons and in bulk with
+ClassSession.materialize_lessons.
+
+    python benchmarks/materialize_lessons.py [years]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from app import create_app, db  # noqa: E402
+from app.config import TestConfig  # noqa: E402
+from app.models import (  # noqa: E402
+    Class, ClassSession, RepeatedLesson, RepeatOption, Schedule,
+    TemplateLesson, TimeSlot, User)
+
+
+class BenchmarkConfig(TestConfig):
+    DEBUG = False
+
+
+def make_template_lesson(years, index):
+    user = User.query.first()
+    cls = Class(title='class {}'.format(index), creator=user)
+    start_at = datetime(2018, 1, 1, 9)
+    time_slot = TimeSlot(start_at=start_at, duration=60)
+    schedule = Schedule(repeat_option=RepeatOption.DAILY,
+                        repeat_end_at=start_at.replace(year=2018 + years),
+                        base_time_slots=[time_slot])
+    class_session = ClassSession(parent_class=cls, creator=user,
+                                 schedule=schedule)
+    # not linked to the class session, so no lessons are materialized yet
+    template_lesson = TemplateLesson(time_slot=time_slot)
+    db.session.add_all([class_session, template_lesson])
+    db.session.commit()
+    return class_session, template_lesson
+
+
+def orm(class_session, template_lesson):
+    db.session.add_all(class_session.create_lessons_for_template_lessons(
+        [template_lesson]))
+    db.session.commit()
+
+
+def bulk(class_session, template_lesson):
+    class_session.materialize_lessons([template_lesson])
+    db.session.commit()
+
+
+def main(years):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    BenchmarkConfig.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+    app = create_app(BenchmarkConfig)
+    try:
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(username='creator',
+                                email='creator@example.com',
+                                first_name='first', last_name='last'))
+            db.session.commit()
+            for index, (name, run) in enumerate((('orm', orm),
+                                                 ('bulk', bulk))):
+                class_session, template_lesson = make_template_lesson(
+                    years, index)
+                start = time.perf_counter()
+                run(class_session, template_lesson)
+                elapsed = time.perf_counter() - start
+                count = RepeatedLesson.query.filter_by(
+                    template_lesson_id=template_lesson.id).count()
+                print('{:<6}{:>6} lessons: {:8.3f}s'.format(
+                    name, count, elapsed))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2)
@@ -0,0 +1,53 @@
+"""Compare expanding multi-year schedules one occurrence at a time with
+RepeatOption.get_repeat_datetime and in one batch with app.models.recurrence.
+
+    python benchmarks/recurrence.py [years]
+"""
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from app.models import RepeatOption  # noqa: E402
+from app.models.recurrence import count_occurrences, expand  # noqa: E402
+
+STARTS = [datetime(2018, 1, 1, 9), datetime(2018, 1, 3, 9),
+          datetime(2018, 1, 31, 18)]
+
+
+def one_by_one(repeat_option, end_at):
+    occurrences = []
+    for start in STARTS:
+        num = 0
+        occurrence = start
+        while occurrence <= end_at:
+            occurrences.append(occurrence)
+            num += 1
+            occurrence = repeat_option.get_repeat_datetime(start, num)
+    return occurrences
+
+
+def batch(repeat_option, end_at):
+    counts = count_occurrences(repeat_option, STARTS, end_at)
+    return expand(repeat_option, STARTS, counts)[0]
+
+
+def main(years):
+    end_at = datetime(2018 + years, 1, 1)
+    for repeat_option in (RepeatOption.DAILY, RepeatOption.WEEKLY,
+                          RepeatOption.MONTHLY):
+        count = len(one_by_one(repeat_option, end_at))
+        assert count == len(batch(repeat_option, end_at))
+        for name, run in (('one by one', one_by_one), ('batch', batch)):
+            number = 10 if name == 'one by one' else 1000
+            elapsed = timeit.timeit(lambda: run(repeat_option, end_at),
+                                    number=number) / number
+            print('{:<10}{:>7} occurrences {:<12}{:10.1f}us'.format(
+                repeat_option.name, count, name, elapsed * 1e6))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -1,5 +1,5 @@
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 from app_test import APPTestCase
 from app.utils import print_json
@@ -10,12 +10,20 @@ from app.models import (
     Lesson, TemplateLesson, Class, ClassSession, RepeatedLesson,
     Person, User, Dependent, Enrollment,
     Organization, OrganizationPersonAssociation,
-    Notification, NotificationDelivery, Address,
+    Notification, NotificationDelivery, Address, Job, JobStatus,
 )
 from app.api.v1 import (
     UserSchema, PersonSchema, DependentSchema,
-    # EnrollmentSchema,
+    EnrollmentSchema,
 )
+from app.api.v1.pagination import keyset_queries
+from app.commands import run_jobs_command
+from app.jobs import job_queue
+from app.models.database import LookupCache
+from app.models.lesson import lesson_instructor_association
+from app.models.query_plans import get_plan
+from marshmallow import ValidationError
+from sqlalchemy import event
 
 
 
@@ -676,6 +684,781 @@ class APITestCase(APPTestCase):
         rp = self.test_client.get('/api/v1/enrollments/1,2')
         # print_json(rp.data)
 
+    def test_enrollment_capacity(self):
+        rp = self.test_client.patch(
+            '/api/v1/class-sessions/1',
+            data=json.dumps(dict(capacity=1)),
+            content_type='application/json')
+        assert rp.status_code == 200
+
+        def enroll(person_id):
+            return self.test_client.post(
+                '/api/v1/enrollments',
+                data=json.dumps(dict(enrolled_person_id=person_id,
+                                     class_session_id=1, initiator_id=1)),
+                content_type='application/json')
+        assert enroll(1).status_code == 200
+        rp = enroll(2)
+        assert rp.status_code == 409
+        assert json.loads(rp.data)['errors'][0]['message'] == (
+            'class session 1 is full')
+
+        rp = self.test_client.post(
+            '/api/v1/enrollments',
+            data=json.dumps([dict(enrolled_person_id=person_id,
+                                  class_session_id=1, initiator_id=1)
+                             for person_id in (2, 3)]),
+            content_type='application/json')
+        assert rp.status_code == 207
+        assert [item['status'] for item in json.loads(rp.data)['data']] == [
+            409, 409]
+
+        rp = self.test_client.patch(
+            '/api/v1/enrollments/1',
+            data=json.dumps(dict(terminated=True)),
+            content_type='application/json')
+        assert rp.status_code == 200
+        assert enroll(2).status_code == 200
+        rp = self.test_client.patch(
+            '/api/v1/enrollments/1,2',
+            data=json.dumps(dict(terminated=False)),
+            content_type='application/json')
+        assert rp.status_code == 409
+
+        rp = self.test_client.get('/api/v1/class-sessions/1')
+        assert json.loads(rp.data)['data']['enrollment_count'] == 1
+
+    def test_waitlist(self):
+        rp = self.test_client.patch(
+            '/api/v1/class-sessions/1',
+            data=json.dumps(dict(capacity=1)),
+            content_type='application/json')
+        assert rp.status_code == 200
+
+        def enroll(person_id):
+            return self.test_client.post(
+                '/api/v1/enrollments?waitlist=true',
+                data=json.dumps(dict(enrolled_person_id=person_id,
+                                     class_session_id=1, initiator_id=1)),
+                content_type='application/json')
+        assert enroll(1).status_code == 200
+        rp = enroll(2)
+        assert rp.status_code == 202
+        entry = json.loads(rp.data)['waitlist_entry']
+        assert (entry['person_id'], entry['position']) == (2, 1)
+        assert rp.headers['Location'].endswith(
+            '/api/v1/waitlist-entries/{}'.format(entry['id']))
+        for person_id in (3, 4):
+            rp = self.test_client.post(
+                '/api/v1/waitlist-entries',
+                data=json.dumps(dict(person_id=person_id,
+                                     class_session_id=1)),
+                content_type='application/json')
+            assert rp.status_code == 202
+        assert enroll(2).status_code == 409
+        assert enroll(1).status_code == 409
+
+        def counts():
+            data = json.loads(self.test_client.get(
+                '/api/v1/class-sessions/1').data)['data']
+            return data['enrollment_count'], data['waitlist_count']
+        assert counts() == (1, 3)
+
+        # the freed seat goes to the head of the line
+        rp = self.test_client.patch(
+            '/api/v1/enrollments/1',
+            data=json.dumps(dict(terminated=True)),
+            content_type='application/json')
+        assert rp.status_code == 200
+        assert counts() == (1, 2)
+        with self.app.app_context():
+            assert [e.enrolled_person_id for e in Enrollment.query.filter_by(
+                terminated=False)] == [2]
+            entry_ids = [entry.id for entry in
+                         ClassSession.get_with_id(1).waitlist_entries]
+
+        rp = self.test_client.delete(
+            '/api/v1/waitlist-entries/{}'.format(entry_ids[0]))
+        assert rp.status_code == 200
+        assert counts() == (1, 1)
+
+        # raising the capacity promotes in bulk
+        rp = self.test_client.patch(
+            '/api/v1/class-sessions/1',
+            data=json.dumps(dict(capacity=5)),
+            content_type='application/json')
+        assert rp.status_code == 200
+        assert counts() == (2, 0)
+        with self.app.app_context():
+            assert sorted(
+                e.enrolled_person_id for e in Enrollment.query.filter_by(
+                    terminated=False)) == [2, 4]
+
+        # with a free seat, joining the waitlist enrolls right away
+        rp = self.test_client.post(
+            '/api/v1/waitlist-entries',
+            data=json.dumps(dict(person_id=3, class_session_id=1)),
+            content_type='application/json')
+        assert rp.status_code == 200
+        assert json.loads(rp.data)['data']['enrolled_person_id'] == 3
+
+    def test_get_with_int_list_keeps_order(self):
+
+        rp = self.test_client.get('/api/v1/persons/4,1,3')
+        assert rp.status_code == 200
+        data = json.loads(rp.data)['data']
+        assert [item['id'] for item in data] == [4, 1, 3]
+
+        rp = self.test_client.get('/api/v1/persons/4,99,1,98')
+        assert rp.status_code == 404
+        error = json.loads(rp.data)['errors'][0]
+        assert error['missing_ids'] == [99, 98]
+
+    def test_batched_related_id_validation(self):
+        with self.app.app_context():
+            payload = [
+                dict(enrolled_person_id=1, class_session_id=1,
+                     initiator_id=1),
+                dict(enrolled_person_id=77, class_session_id=1,
+                     initiator_id=3),
+                dict(enrolled_person_id=2, class_session_id=9,
+                     initiator_id=1),
+            ]
+            statements = []
+
+            def count_statement(conn, cursor, statement, *args):
+                statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', count_statement)
+            try:
+                EnrollmentSchema(many=True).load(payload)
+            except ValidationError as err:
+                errors = err.messages
+            finally:
+                event.remove(db.engine, 'before_cursor_execute',
+                             count_statement)
+            # one IN query per referenced Model class
+            assert len(statements) == 3
+            assert set(errors.keys()) == {1, 2}
+            assert set(errors[1].keys()) == {'enrolled_person_id',
+                                             'initiator_id'}
+            assert set(errors[2].keys()) == {'class_session_id'}
+
+    def get_all_pages(self, url):
+        items = []
+        while url is not None:
+            rp = self.test_client.get(url)
+            assert rp.status_code == 200
+            body = json.loads(rp.data)
+            items.extend(body['data'])
+            url = body['pagination']['next']
+        return items
+
+    def test_keyset_pagination(self):
+        persons = self.get_all_pages('/api/v1/persons?limit=3')
+        assert [p['id'] for p in persons] == [1, 2, 3, 4]
+
+        with self.app.app_context():
+            self.db.session.add_all(
+                [Lesson(class_session_id=1) for i in range(3)] +
+                [Lesson(class_session_id=1, duration=30,
+                        start_at=datetime(2018, 3, 1 + i % 3, 10))
+                 for i in range(5)])
+            self.db.session.commit()
+        lessons = self.get_all_pages(
+            '/api/v1/class-sessions/1/lessons?limit=2')
+        assert [l['id'] for l in lessons] == [1, 2, 3, 4, 7, 5, 8, 6]
+
+        # the pages are read in index order, without sorting the rows
+        with self.app.app_context():
+            keyset = Lesson.get_keyset()
+            queries = (keyset_queries(Lesson.query, keyset)
+                       + keyset_queries(
+                           Lesson.query.filter_by(class_session_id=1),
+                           keyset, [datetime(2018, 3, 1), 4]))
+            for query in queries:
+                plan = get_plan(db.session.connection(),
+                                query.limit(3).statement)
+                assert not [line for line in plan if 'TEMP B-TREE' in line]
+
+        rp = self.test_client.get(
+            '/api/v1/lessons?limit=2&continuation_token=garbage')
+        assert rp.status_code == 400
+
+    def test_filters(self):
+        enrollments = [dict(enrolled_person_id=person_id, class_session_id=1,
+                            initiator_id=1)
+                       for person_id in (1, 2, 3, 4)]
+        rp = self.test_client.post('/api/v1/enrollments',
+                                   data=json.dumps(enrollments),
+                                   content_type='application/json')
+        assert rp.status_code == 200
+        rp = self.test_client.patch(
+            '/api/v1/enrollments/2',
+            data=json.dumps(dict(terminated=True)),
+            content_type='application/json')
+        assert rp.status_code == 200
+
+        def get_ids(url):
+            return [item['id'] for item in self.get_all_pages(url)]
+        assert get_ids('/api/v1/enrollments?class_session_id=1'
+                       '&terminated=false') == [1, 3, 4]
+        assert get_ids('/api/v1/enrollments?terminated=true') == [2]
+        assert get_ids('/api/v1/enrollments?limit=2'
+                       '&enrolled_person_id[in]=4,1,3') == [1, 3, 4]
+        assert get_ids('/api/v1/enrollments?enrolled_person_id[ne]=1'
+                       '&enrolled_person_id[lt]=4') == [2, 3]
+        # repeated arguments are ANDed on every page
+        assert get_ids('/api/v1/enrollments?limit=1'
+                       '&enrolled_person_id[ne]=1'
+                       '&enrolled_person_id[ne]=3') == [2, 4]
+
+        with self.app.app_context():
+            self.db.session.add_all(
+                [Lesson(class_session_id=1, duration=30,
+                        start_at=datetime(2018, 3, day, 10))
+                 for day in (1, 2, 3, 4)] + [Lesson(class_session_id=1)])
+            self.db.session.commit()
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        with self.app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                ids = get_ids('/api/v1/lessons?start_at[gte]=2018-03-02'
+                              '&start_at[lt]=2018-03-04T00:00:00')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+        assert ids == [2, 3]
+        # one query for the lessons without start_at, one for the others,
+        # each with the filters in its WHERE clause
+        selects = [s for s in statements
+                   if s.startswith('SELECT') and 'FROM lesson' in s]
+        assert len(selects) == 2
+        assert all('lesson.start_at >=' in s for s in selects)
+        assert get_ids('/api/v1/lessons?start_at=null') == [5]
+
+        rp = self.test_client.get('/api/v1/enrollments?created_at[like]=x')
+        assert rp.status_code == 400
+        rp = self.test_client.get('/api/v1/enrollments?terminated=maybe')
+        assert rp.status_code == 400
+        rp = self.test_client.get('/api/v1/classes?title=english')
+        assert rp.status_code == 400
+        error = json.loads(rp.data)['errors'][0]
+        assert 'creator_id' in error['filter_fields']
+
+    def test_loading_profiles(self):
+        rp = self.test_client.get('/api/v1/class-sessions/1')
+        assert 'schedule' in json.loads(rp.data)['data']
+
+        rp = self.test_client.get('/api/v1/class-sessions/1?profile=summary')
+        data = json.loads(rp.data)['data']
+        assert 'schedule' not in data and 'creator' not in data
+        assert data['schedule_id'] == 1
+
+        rp = self.test_client.get('/api/v1/class-sessions/1?include=schedule')
+        data = json.loads(rp.data)['data']
+        assert 'schedule' in data and 'creator' not in data
+
+        rp = self.test_client.get('/api/v1/class-sessions/1?profile=all')
+        assert rp.status_code == 400
+        rp = self.test_client.get('/api/v1/class-sessions/1?include=foo')
+        assert rp.status_code == 400
+
+    def test_sparse_fieldsets(self):
+        rp = self.test_client.get('/api/v1/classes/1?fields[Class]=id,title')
+        data = json.loads(rp.data)['data']
+        assert set(data) == {'id', '_type', 'title'}
+
+        rp = self.test_client.get(
+            '/api/v1/classes/1?fields[Class]=title,creator')
+        data = json.loads(rp.data)['data']
+        assert set(data) == {'id', '_type', 'title', 'creator'}
+
+        rp = self.test_client.get(
+            '/api/v1/class-sessions/1/lessons?fields[Lesson]=duration')
+        for lesson in json.loads(rp.data)['data']:
+            assert set(lesson) == {'id', '_type', 'duration'}
+
+        rp = self.test_client.get('/api/v1/classes/1?fields[Class]=foo')
+        assert rp.status_code == 400
+
+    def test_bulk_create(self):
+        users = [dict(username='user{}'.format(i),
+                      email='user{}@gmail.com'.format(i),
+                      first_name='user', last_name=str(i))
+                 for i in range(3)]
+        users.append(dict(username='thornpig', email='pig@gmail.com',
+                          first_name='pig', last_name='pig'))
+        users.append(dict(username='user0', email='pig@gmail.com',
+                          first_name='pig', last_name='pig'))
+        users.append(dict(username='nomail', first_name='a', last_name='b'))
+
+        rp = self.test_client.post('/api/v1/users?atomic=true',
+                                   data=json.dumps(users),
+                                   content_type='application/json')
+        assert rp.status_code == 400
+        with self.app.app_context():
+            assert User.query.count() == 2
+
+        rp = self.test_client.post('/api/v1/users',
+                                   data=json.dumps(users),
+                                   content_type='application/json')
+        assert rp.status_code == 207
+        results = json.loads(rp.data)['data']
+        assert [r['status'] for r in results] == [201, 201, 201, 409, 409,
+                                                  400]
+        assert results[0]['data']['username'] == 'user0'
+        assert 'username' in results[3]['errors']
+        assert 'email' in results[5]['errors']
+        with self.app.app_context():
+            assert User.query.count() == 5
+
+        addresses = [dict(primary_street='{} ABC st'.format(i), city='XYZ',
+                          state='FL', zipcode='12345', country='USA',
+                          creator_id=1)
+                     for i in range(20)]
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        with self.app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                rp = self.test_client.post(
+                    '/api/v1/addresses?atomic=true',
+                    data=json.dumps(addresses),
+                    content_type='application/json')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+        assert rp.status_code == 200
+        assert len(json.loads(rp.data)['data']) == 20
+        assert len([s for s in statements if s.startswith('INSERT')]) == 1
+
+    def test_bulk_patch(self):
+        enrollments = [dict(enrolled_person_id=person_id, class_session_id=1,
+                            initiator_id=1)
+                       for person_id in (1, 2, 3, 4)]
+        rp = self.test_client.post('/api/v1/enrollments',
+                                   data=json.dumps(enrollments),
+                                   content_type='application/json')
+        assert rp.status_code == 200
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        with self.app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                rp = self.test_client.patch(
+                    '/api/v1/enrollments/3,1,2',
+                    data=json.dumps(dict(terminated=True)),
+                    content_type='application/json')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+        assert rp.status_code == 200
+        data = json.loads(rp.data)['data']
+        assert [e['id'] for e in data] == [3, 1, 2]
+        assert all(e['terminated'] for e in data)
+        # one UPDATE for the enrollments, one for the seats they gave back
+        assert len([s for s in statements
+                    if s.startswith('UPDATE enrollment')]) == 1
+        assert len([s for s in statements
+                    if s.startswith('UPDATE class_session')]) == 1
+        with self.app.app_context():
+            assert not Enrollment.get_with_id(4).terminated
+
+        rp = self.test_client.patch('/api/v1/enrollments/1,9',
+                                    data=json.dumps(dict(terminated=False)),
+                                    content_type='application/json')
+        assert rp.status_code == 404
+        assert json.loads(rp.data)['errors'][0]['missing_ids'] == [9]
+        with self.app.app_context():
+            assert Enrollment.get_with_id(1).terminated
+
+        with self.app.app_context():
+            with self.assertRaises(ValueError):
+                Address.bulk_update([1], dict(creator=None))
+
+    def test_streaming(self):
+        with self.app.app_context():
+            Lesson.bulk_create([
+                dict(class_session_id=1, duration=30,
+                     start_at=datetime(2018, 3, 1, 9, 0, i % 60))
+                for i in range(250)])
+
+        rp = self.test_client.get(
+            '/api/v1/class-sessions/1/lessons?stream=true')
+        assert rp.status_code == 200 and rp.is_streamed
+        data = json.loads(rp.data)['data']
+        assert len(data) == 250
+        keys = [(lesson['start_at'], lesson['id']) for lesson in data]
+        assert keys == sorted(keys)
+
+        with self.test_client:
+            rp = self.test_client.get('/api/v1/lessons/3,1,2?stream=true')
+            assert [lesson['id']
+                    for lesson in json.loads(rp.data)['data']] == [3, 1, 2]
+            # the streamed items are not kept for the rest of the request
+            assert LookupCache.current().stats()['size'] == 0
+        rp = self.test_client.get('/api/v1/lessons/1,999?stream=true')
+        assert rp.status_code == 404
+
+    def test_conditional_requests(self):
+        rp = self.test_client.get('/api/v1/class-sessions/1')
+        etag = rp.headers['ETag']
+        assert rp.headers['Last-Modified']
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        with self.app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                rp = self.test_client.get('/api/v1/class-sessions/1',
+                                          headers={'If-None-Match': etag})
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+        assert rp.status_code == 304 and rp.data == b''
+        assert len(statements) == 1
+
+        rp = self.test_client.get('/api/v1/class-sessions/1?profile=summary',
+                                  headers={'If-None-Match': etag})
+        assert rp.status_code == 200
+
+        # a new enrollment is embedded in the class session
+        rp = self.test_client.post(
+            '/api/v1/enrollments',
+            data=json.dumps(dict(enrolled_person_id=3, class_session_id=1,
+                                 initiator_id=1)),
+            content_type='application/json')
+        rp = self.test_client.get('/api/v1/class-sessions/1',
+                                  headers={'If-None-Match': etag})
+        assert rp.status_code == 200
+        assert rp.headers['ETag'] != etag
+
+        rp = self.test_client.get('/api/v1/classes/1')
+        etag = rp.headers['ETag']
+        rp = self.test_client.patch('/api/v1/classes/1',
+                                    data=json.dumps(dict(capacity=5)),
+                                    content_type='application/json',
+                                    headers={'If-Match': etag})
+        assert rp.status_code == 200
+        rp = self.test_client.patch('/api/v1/classes/1',
+                                    data=json.dumps(dict(capacity=6)),
+                                    content_type='application/json',
+                                    headers={'If-Match': etag})
+        assert rp.status_code == 412
+
+        # lessons are dumped per class, the tag is a hash of the body
+        rp = self.test_client.get('/api/v1/persons/1')
+        etag = rp.headers['ETag']
+        rp = self.test_client.get('/api/v1/persons/1',
+                                  headers={'If-None-Match': etag})
+        assert rp.status_code == 304
+
+    def test_schedule_occurrences(self):
+        rp = self.test_client.get(
+            '/api/v1/schedules/1/occurrences'
+            '?from=2018-03-05T00:00:00&to=2018-03-12T00:00:00')
+        data = json.loads(rp.data)['data']
+        assert [(o['start_at'][:19], o['repeat_num']) for o in data] == [
+            ('2018-03-06T11:59:59', 1), ('2018-03-07T11:59:59', 1)]
+        assert [o['duration'] for o in data] == [30, 60]
+
+        # the schedule ends on 2018-03-14
+        rp = self.test_client.get(
+            '/api/v1/schedules/1/occurrences'
+            '?from=2018-03-14T00:00:00&to=2019-01-01T00:00:00')
+        assert json.loads(rp.data)['data'] == []
+
+        rp = self.test_client.get(
+            '/api/v1/schedules/1/occurrences?from=2018-03-12T00:00:00')
+        assert rp.status_code == 400
+
+    def test_person_calendar(self):
+        with self.app.app_context():
+            d0 = Dependent.query.filter_by(first_name='adela').one()
+            u0 = User.query.filter_by(username='thornpig').one()
+            u1 = User.query.filter_by(username='shirly').one()
+            cs0 = ClassSession.query.one()
+            self.db.session.add_all([
+                TemplateLesson(class_session_id=cs0.id, time_slot_id=ts.id)
+                for ts in cs0.schedule.base_time_slots])
+            self.db.session.add(Enrollment(class_session_id=cs0.id,
+                                           enrolled_person_id=d0.id))
+            cs0.instructors.append(u0)
+            guest_lesson = cs0.lessons.order_by(Lesson.start_at)[-1]
+            guest_lesson.guest_students.append(u1)
+            self.db.session.commit()
+            ids = (d0.id, u0.id, u1.id)
+
+        window = '?from=2018-03-01T00:00:00&to=2018-03-08T00:00:00'
+        rp = self.test_client.get(
+            '/api/v1/persons/{}/calendar{}'.format(ids[0], window))
+        data = json.loads(rp.data)['data']
+        assert [(entry['start_at'][:19], entry['duration'], entry['role'])
+                for entry in data] == [
+            ('2018-03-06T11:59:59', 30, 'student'),
+            ('2018-03-07T11:59:59', 60, 'student')]
+
+        rp = self.test_client.get(
+            '/api/v1/persons/{}/calendar{}'.format(ids[1], window))
+        assert [entry['role'] for entry in json.loads(rp.data)['data']] == [
+            'instructor', 'instructor']
+
+        rp = self.test_client.get(
+            '/api/v1/persons/{}/calendar'
+            '?from=2018-02-01T00:00:00&to=2018-04-01T00:00:00'.format(ids[2]))
+        data = json.loads(rp.data)['data']
+        assert [(entry['start_at'][:19], entry['role'])
+                for entry in data] == [('2018-03-13T11:59:59', 'guest')]
+
+        rp = self.test_client.get('/api/v1/persons/100/calendar' + window)
+        assert rp.status_code == 404
+
+    def test_icalendar(self):
+        with self.app.app_context():
+            d0 = Dependent.query.filter_by(first_name='adela').one()
+            cs0 = ClassSession.query.one()
+            self.db.session.add_all([
+                TemplateLesson(class_session_id=cs0.id, time_slot_id=ts.id)
+                for ts in cs0.schedule.base_time_slots])
+            self.db.session.add(Enrollment(class_session_id=cs0.id,
+                                           enrolled_person_id=d0.id))
+            self.db.session.commit()
+            tl0 = cs0.template_lessons.order_by(TemplateLesson.id).first()
+            repeats = RepeatedLesson.query.filter_by(
+                template_lesson_id=tl0.id).order_by(
+                    RepeatedLesson.index_of_rep).all()
+            self.db.session.delete(repeats[1])
+            repeats[2].start_at = datetime(2018, 3, 14, 8)
+            self.db.session.commit()
+            ids = (cs0.id, d0.id, tl0.id)
+
+        url = '/api/v1/class-sessions/{}/calendar.ics'.format(ids[0])
+        rp = self.test_client.get(url)
+        assert rp.status_code == 200
+        assert rp.mimetype == 'text/calendar'
+        lines = rp.data.decode().split('\r\n')
+        assert lines[0] == 'BEGIN:VCALENDAR'
+        assert lines.count('BEGIN:VEVENT') == 3
+        assert lines.count('RRULE:FREQ=WEEKLY;COUNT=3') == 1
+        assert lines.count('RRULE:FREQ=WEEKLY;COUNT=2') == 1
+        assert 'EXDATE:20180306T115959Z' in lines
+        override = lines.index('RECURRENCE-ID:20180313T115959Z')
+        assert lines[override - 2] == 'UID:template-lesson-{}@classdoor'.format(
+            ids[2])
+        assert lines[override + 1] == 'DTSTART:20180314T080000Z'
+
+        etag = rp.headers['ETag']
+        rp = self.test_client.get(url, headers={'If-None-Match': etag})
+        assert rp.status_code == 304
+        assert rp.data == b''
+
+        rp = self.test_client.get(
+            '/api/v1/persons/{}/calendar.ics'.format(ids[1]))
+        assert rp.status_code == 200
+        assert rp.data.decode().split('\r\n').count('BEGIN:VEVENT') == 3
+
+        with self.app.app_context():
+            lesson = RepeatedLesson.query.filter_by(
+                template_lesson_id=ids[2], index_of_rep=0).one()
+            lesson.duration = 45
+            self.db.session.commit()
+        rp = self.test_client.get(url, headers={'If-None-Match': etag})
+        assert rp.status_code == 200
+        assert rp.headers['ETag'] != etag
+        assert 'RECURRENCE-ID:20180227T115959Z' in rp.data.decode()
+
+        # standalone lessons are read with a fixed number of queries
+        person_url = '/api/v1/persons/{}/calendar.ics'.format(ids[1])
+
+        def count_statements():
+            with self.app.app_context():
+                d0 = Dependent.get_with_id(ids[1])
+                for day in range(1, 6):
+                    lesson = Lesson(start_at=datetime(2018, 4, day, 10),
+                                    duration=30,
+                                    location=Address.query.first())
+                    lesson.guest_students.append(d0)
+                    self.db.session.add(lesson)
+                self.db.session.commit()
+            statements = []
+
+            def count(conn, cursor, statement, *args):
+                statements.append(statement)
+            with self.app.app_context():
+                event.listen(db.engine, 'before_cursor_execute', count)
+                try:
+                    # the feed is streamed, the body runs the queries
+                    rp = self.test_client.get(person_url)
+                    rp.get_data()
+                finally:
+                    event.remove(db.engine, 'before_cursor_execute', count)
+            assert rp.status_code == 200
+            return len(statements)
+        assert count_statements() == count_statements()
+
+        # a changed address changes the LOCATION of the feed
+        rp = self.test_client.get(person_url)
+        etag = rp.headers['ETag']
+        assert 'LOCATION:12345 ABC st\\, XYZ' in rp.data.decode()
+        rp = self.test_client.patch(
+            '/api/v1/addresses/1', data=json.dumps(dict(city='UVW')),
+            content_type='application/json')
+        assert rp.status_code == 200
+        rp = self.test_client.get(person_url,
+                                  headers={'If-None-Match': etag})
+        assert rp.status_code == 200
+        assert 'LOCATION:12345 ABC st\\, UVW' in rp.data.decode()
+
+        rp = self.test_client.get('/api/v1/class-sessions/100/calendar.ics')
+        assert rp.status_code == 404
+
+    def test_person_conflicts(self):
+        with self.app.app_context():
+            u0 = User.query.filter_by(username='thornpig').one()
+            cs0 = ClassSession.query.one()
+            self.db.session.add_all([
+                TemplateLesson(class_session_id=cs0.id, time_slot_id=ts.id)
+                for ts in cs0.schedule.base_time_slots])
+            cs0.instructors.append(u0)
+            l0 = Lesson(start_at=datetime(2018, 3, 6, 12, 15), duration=30)
+            self.db.session.add(l0)
+            self.db.session.commit()
+            # assigned behind the back of the conflict check
+            self.db.session.execute(lesson_instructor_association.insert(),
+                                    {'lesson_id': l0.id,
+                                     'instructor_id': u0.id})
+            self.db.session.commit()
+            ids = (u0.id, l0.id)
+
+        rp = self.test_client.get('/api/v1/persons/{}/conflicts'.format(
+            ids[0]))
+        [conflict] = json.loads(rp.data)['data']
+        assert conflict['lesson_ids'][1] == ids[1]
+        assert conflict['start_at'][:19] == '2018-03-06T12:15:00'
+        assert conflict['end_at'][:19] == '2018-03-06T12:29:59'
+
+        rp = self.test_client.get('/api/v1/persons/2/conflicts')
+        assert json.loads(rp.data)['data'] == []
+
+    def test_address_occupancy(self):
+        with self.app.app_context():
+            addr0 = Address.query.one()
+            cs0 = ClassSession.query.one()
+            ts0, ts1 = cs0.schedule.base_time_slots
+            tl0 = TemplateLesson(location_id=addr0.id,
+                                 class_session_id=cs0.id,
+                                 time_slot_id=ts0.id)
+            tl1 = TemplateLesson(class_session_id=cs0.id,
+                                 time_slot_id=ts1.id)
+            l0 = Lesson(start_at=datetime(2018, 3, 6, 12, 15), duration=30,
+                        location_id=addr0.id)
+            self.db.session.add_all([tl0, tl1, l0])
+            self.db.session.commit()
+            # moving the template lesson moves its lessons
+            tl1.location_id = addr0.id
+            self.db.session.commit()
+            ids = (addr0.id, l0.id)
+
+        rp = self.test_client.get(
+            '/api/v1/addresses/{}/occupancy'
+            '?from=2018-03-01T00:00:00&to=2018-03-08T00:00:00'.format(ids[0]))
+        [occupancy] = json.loads(rp.data)['data']
+        assert occupancy['address_id'] == ids[0]
+        lessons = occupancy['lessons']
+        assert [(lesson['start_at'][:19], lesson['end_at'][:19])
+                for lesson in lessons] == [
+            ('2018-03-06T11:59:59', '2018-03-06T12:29:59'),
+            ('2018-03-06T12:15:00', '2018-03-06T12:45:00'),
+            ('2018-03-07T11:59:59', '2018-03-07T12:59:59')]
+        assert [lesson['conflicting_lesson_ids'] for lesson in lessons] == [
+            [ids[1]], [lessons[0]['lesson_id']], []]
+
+        # lessons that started before the window still overlap it
+        rp = self.test_client.get(
+            '/api/v1/addresses/{}/occupancy'
+            '?from=2018-03-06T12:20:00&to=2018-03-06T12:40:00'.format(ids[0]))
+        [occupancy] = json.loads(rp.data)['data']
+        assert [lesson['start_at'][:19] for lesson in occupancy['lessons']] \
+            == ['2018-03-06T11:59:59', '2018-03-06T12:15:00']
+
+        rp = self.test_client.get(
+            '/api/v1/addresses/{},100/occupancy'
+            '?from=2018-03-01T00:00:00&to=2018-03-08T00:00:00'.format(ids[0]))
+        assert rp.status_code == 404
+
+    def test_lesson_materialization_job(self):
+        with self.app.app_context():
+            cs0 = ClassSession.query.one()
+            ts0 = cs0.schedule.base_time_slots[0]
+            ids = (cs0.id, ts0.id)
+        self.app.config['LESSON_JOB_THRESHOLD'] = 2
+
+        rp = self.test_client.post(
+            '/api/v1/template-lessons',
+            data=json.dumps(dict(class_session_id=ids[0],
+                                 time_slot_id=ids[1])),
+            content_type='application/json')
+        assert rp.status_code == 202
+        data = json.loads(rp.data)
+        job_id = data['job']['id']
+        assert data['data']['materialization_job_id'] == job_id
+        assert rp.headers['Location'].endswith('/api/v1/jobs/{}'.format(
+            job_id))
+
+        rp = self.test_client.get('/api/v1/jobs/{}'.format(job_id))
+        job = json.loads(rp.data)['data']
+        assert job['status'] == 'JobStatus.SUCCEEDED'
+        assert job['arguments'] == {
+            'template_lesson_id': data['data']['id']}
+
+        with self.app.app_context():
+            def lesson_count():
+                return RepeatedLesson.query.filter_by(
+                    template_lesson_id=data['data']['id']).count()
+            assert lesson_count() == 3
+            # a retried job creates no duplicates
+            job_queue.handlers['materialize_lessons'](
+                template_lesson_id=data['data']['id'])
+            job_queue.run(job_id)
+            assert lesson_count() == 3
+
+    def test_job_recovery(self):
+        self.app.config['LESSON_JOB_THRESHOLD'] = 2
+        with self.app.app_context():
+            cs0 = ClassSession.query.one()
+            # created outside the API, so nothing submits their jobs
+            tl0, tl1 = [TemplateLesson(class_session_id=cs0.id,
+                                       time_slot_id=ts.id)
+                        for ts in cs0.schedule.base_time_slots]
+            self.db.session.add_all([tl0, tl1])
+            self.db.session.commit()
+            job0, job1 = (tl0.materialization_job, tl1.materialization_job)
+            # the worker running job1 died an hour ago
+            job1.status = JobStatus.RUNNING
+            job1.started_at = datetime.utcnow() - timedelta(hours=1)
+            # while job2 is still being worked on
+            job2 = Job(name='materialize_lessons', status=JobStatus.RUNNING,
+                       started_at=datetime.utcnow())
+            self.db.session.add(job2)
+            self.db.session.commit()
+            ids = (job0.id, job1.id, job2.id, tl0.id, tl1.id)
+
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(run_jobs_command)
+        assert result.exit_code == 0, result.output
+        assert 'requeued 1 stale jobs, ran 2 jobs' in result.output
+        with self.app.app_context():
+            assert [Job.get_with_id(id).status for id in ids[:3]] == [
+                JobStatus.SUCCEEDED, JobStatus.SUCCEEDED, JobStatus.RUNNING]
+            assert [RepeatedLesson.query.filter_by(
+                template_lesson_id=id).count() for id in ids[3:]] == [3, 2]
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,16 +1,27 @@
+import os
+import sqlite3
+import tempfile
 import unittest
 from datetime import datetime
+from itertools import islice
 import json
+from sqlalchemy import event
 from app_test import APPTestCase
 from app import create_app, db
 from app.config import TestConfig
 from app.models import (
-    RepeatOption, TimeSlot, Schedule,
+    RepeatOption, TimeSlot, Schedule, Occurrence,
     Lesson, TemplateLesson, Class, ClassSession, RepeatedLesson,
     Person, User, Dependent, Enrollment,
     Organization, OrganizationPersonAssociation,
-    Notification, NotificationDelivery, Address,
+    Notification, NotificationDelivery, Address, InstructorConflictError,
+    ClassSessionFullError, WaitlistEntry,
 )
+from app.commands import index_advisor_command, reconcile_counters_command
+from app.models.database import ConflictError, LookupCache
+from app.models.intervals import Interval, IntervalIndex
+from app.models.query_plans import find_full_scans, hot_queries
+from app.models import recurrence
 
 
 class DBTestCase(APPTestCase):
@@ -281,8 +292,569 @@ class DBTestCase(APPTestCase):
             ems = Enrollment.get_enrollments(cs1.id, d1.id)
             print(ems)
 
+    def test_lookup_cache(self):
+        with self.app.app_context():
+            u0 = User(username='thornpig', email='zack@gmail.com',
+                      first_name='zack', last_name='zhu')
+            db.session.add(u0)
+            db.session.commit()
+
+            cache = LookupCache.current()
+            assert User.get_with_id(1) is User.get_with_id(1)
+            assert User.get_with_id(2) is None
+            assert User.get_with_id(2) is None
+            assert cache.stats()['hits'] == 2
+            assert cache.stats()['misses'] == 2
+
+            assert [u.id for u in User.get_with_ids([2, 1])] == [1]
+            assert cache.stats()['hits'] == 4
+
+            u1 = User(username='shirly', email='shirly@gmail.com',
+                      first_name='shirly', last_name='zheng')
+            db.session.add(u1)
+            db.session.flush()
+            assert cache.stats()['size'] == 0
+            assert User.get_with_id(2) is u1
+
+    def test_allocate_ids(self):
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+
+        class FileConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + db_path
+
+        app = create_app(config_class=FileConfig)
+        try:
+            with app.app_context():
+                db.create_all()
+                User.create(username='thornpig', email='zack@gmail.com',
+                            first_name='zack', last_name='zhu')
+                assert User.allocate_ids(2) == [2, 3]
+
+                # other inserts wait until the reserved ids are used
+                other = sqlite3.connect(db_path, timeout=0)
+                insert = ("INSERT INTO person (type, first_name, last_name, "
+                          "created_at) VALUES ('person', 'amy', 'wu', "
+                          "'2018-01-01 00:00:00')")
+                with self.assertRaises(sqlite3.OperationalError):
+                    other.execute(insert)
+                db.session.rollback()
+                other.execute(insert)
+                other.commit()
+                other.close()
+                assert User.bulk_create([
+                    dict(username=name, email=name + '@gmail.com',
+                         first_name=name, last_name='zheng')
+                    for name in ('shirly', 'jenny')]) == [3, 4]
+                db.session.rollback()
+                db.session.remove()
+                db.drop_all()
+        finally:
+            os.remove(db_path)
+
+    def test_recurrence_expansion(self):
+        starts = [datetime(2016, 1, 31, 10, 30), datetime(2016, 2, 29, 8),
+                  datetime(2017, 12, 31, 23, 59, 59)]
+        nums = [0, 1, 13, 25]
+        for option in (RepeatOption.DAILY, RepeatOption.WEEKLY,
+                       RepeatOption.BIWEEKLY, RepeatOption.MONTHLY,
+                       RepeatOption.YEARLY):
+            expected = [option.get_repeat_datetime(start, num)
+                        for start in starts for num in nums]
+            occurrences = recurrence.repeat_datetimes(
+                option,
+                [start for start in starts for num in nums],
+                nums * len(starts))
+            assert recurrence.to_datetimes(occurrences) == expected
+
+        end_at = datetime(2016, 5, 31, 10, 30)
+        counts = recurrence.count_occurrences(
+            RepeatOption.MONTHLY, starts, end_at)
+        assert counts.tolist() == [5, 4, 0]
+        counts = recurrence.count_occurrences(
+            RepeatOption.MONTHLY, starts, end_at, inclusive=False)
+        assert counts.tolist() == [4, 4, 0]
+
+        occurrences, indexes, nums = recurrence.expand(
+            RepeatOption.MONTHLY, starts[:2], [3, 2])
+        assert recurrence.to_datetimes(occurrences) == [
+            datetime(2016, 1, 31, 10, 30), datetime(2016, 2, 29, 10, 30),
+            datetime(2016, 3, 31, 10, 30),
+            datetime(2016, 2, 29, 8), datetime(2016, 3, 29, 8)]
+        assert indexes.tolist() == [0, 0, 0, 1, 1]
+        assert nums.tolist() == [0, 1, 2, 0, 1]
+
+    def test_occurrences_between(self):
+        with self.app.app_context():
+            ts0 = TimeSlot(start_at=datetime(2016, 1, 31, 9), duration=45)
+            ts1 = TimeSlot(start_at=datetime(2016, 2, 10, 9), duration=30)
+            schedule = Schedule(repeat_option=RepeatOption.MONTHLY,
+                                base_time_slots=[ts0, ts1])
+            db.session.add(schedule)
+            db.session.commit()
+
+            start, end = datetime(2024, 2, 1), datetime(2024, 5, 1)
+            expected = sorted(
+                (RepeatOption.MONTHLY.get_repeat_datetime(ts.start_at, num),
+                 ts.id, num)
+                for ts in (ts0, ts1) for num in range(200)
+                if start <= RepeatOption.MONTHLY.get_repeat_datetime(
+                    ts.start_at, num) < end)
+            occurrences = schedule.occurrences_between(start, end)
+            assert [(o.start_at, o.base_slot_id, o.repeat_num)
+                    for o in occurrences] == expected
+            assert occurrences[0].start_at == datetime(2024, 2, 10, 9)
+            assert occurrences[1].start_at == datetime(2024, 2, 29, 9)
+
+            schedule.repeat_end_at = datetime(2024, 3, 10, 9)
+            assert len(schedule.occurrences_between(start, end)) == 3
+
+    def test_iter_time_slots(self):
+        with self.app.app_context():
+            ts0 = TimeSlot(start_at=datetime(2018, 1, 1, 9), duration=45)
+            ts1 = TimeSlot(start_at=datetime(2018, 1, 3, 9), duration=30)
+            schedule = Schedule(repeat_option=RepeatOption.WEEKLY,
+                                base_time_slots=[ts0, ts1])
+            db.session.add(schedule)
+            db.session.commit()
+
+            # open ended, only the consumed occurrences are computed
+            occurrences = list(islice(schedule.iter_time_slots(), 200))
+            assert [o.start_at for o in occurrences] == sorted(
+                o.start_at for o in occurrences)
+            assert occurrences[:3] == [
+                Occurrence(datetime(2018, 1, 1, 9), 45, ts0.id, 0),
+                Occurrence(datetime(2018, 1, 3, 9), 30, ts1.id, 0),
+                Occurrence(datetime(2018, 1, 8, 9), 45, ts0.id, 1)]
+            assert occurrences[-1] == Occurrence(
+                datetime(2019, 11, 27, 9), 30, ts1.id, 99)
+            assert not db.session.new
+
+            schedule.repeat_end_at = datetime(2018, 3, 1)
+            occurrences = list(schedule.iter_repeat_time_slots())
+            assert occurrences == schedule.occurrences_between(
+                datetime(2018, 1, 1), schedule.repeat_end_at)
+            assert [(o.start_at, o.base_slot_id, o.repeat_num)
+                    for o in occurrences] == sorted(
+                (RepeatOption.WEEKLY.get_repeat_datetime(
+                    rts.base_time_slot.start_at, rts.repeat_num),
+                 rts.base_time_slot.id, rts.repeat_num)
+                for rts in schedule.get_repeat_time_slots())
+
+    def test_sync_lessons(self):
+        with self.app.app_context():
+            u0 = User(username='thornpig', email='zack@gmail.com',
+                      first_name='zack', last_name='zhu')
+            c0 = Class(title='swimming class')
+            u0.created_classes.append(c0)
+            db.session.add(u0)
+            db.session.commit()
 
+            ts0 = TimeSlot(start_at=datetime(2018, 1, 1, 9), duration=30)
+            ts1 = TimeSlot(start_at=datetime(2018, 1, 3, 9), duration=60)
+            sch0 = Schedule(repeat_option=RepeatOption.WEEKLY,
+                            repeat_end_at=datetime(2018, 12, 31),
+                            base_time_slots=[ts0, ts1])
+            cs0 = ClassSession(class_id=c0.id, creator_id=u0.id,
+                               schedule=sch0)
+            db.session.add(cs0)
+            db.session.commit()
+            # linking a template lesson creates its lessons
+            db.session.add_all([
+                TemplateLesson(class_session_id=cs0.id, time_slot_id=ts.id)
+                for ts in (ts0, ts1)])
+            db.session.commit()
+            assert cs0.lessons.count() == 104
+            lesson_ids = {lesson.id for lesson in cs0.lessons}
+
+            def lessons():
+                return [(lesson.template_lesson.time_slot, lesson.index_of_rep,
+                         lesson.start_at, lesson.duration)
+                        for lesson in cs0.lessons.order_by(Lesson.start_at)]
+
+            # one more week adds one lesson per template lesson
+            sch0.repeat_end_at = datetime(2019, 1, 7)
+            db.session.commit()
+            assert cs0.lessons.count() == 106
+            assert lesson_ids < {lesson.id for lesson in cs0.lessons}
+            assert lessons()[-2:] == [
+                (ts0, 52, datetime(2018, 12, 31, 9), 30),
+                (ts1, 52, datetime(2019, 1, 2, 9), 60)]
+
+            # and cutting the course short deletes only the tail
+            sch0.repeat_end_at = datetime(2018, 1, 10)
+            db.session.commit()
+            assert lessons() == [
+                (ts0, 0, datetime(2018, 1, 1, 9), 30),
+                (ts1, 0, datetime(2018, 1, 3, 9), 60),
+                (ts0, 1, datetime(2018, 1, 8, 9), 30)]
+            assert lesson_ids > {lesson.id for lesson in cs0.lessons}
+
+    def test_waitlist_promotion(self):
+        with self.app.app_context():
+            u0 = User(username='thornpig', email='zack@gmail.com',
+                      first_name='zack', last_name='zhu')
+            people = [Dependent(first_name='kid{}'.format(i), last_name='zhu')
+                      for i in range(5)]
+            u0.dependents.extend(people)
+            c0 = Class(title='swimming class', capacity=1)
+            u0.created_classes.append(c0)
+            db.session.add(u0)
+            db.session.commit()
+            cs0 = ClassSession(class_id=c0.id, creator_id=u0.id,
+                               schedule=Schedule(
+                                   repeat_option=RepeatOption.NEVER))
+            db.session.add(cs0)
+            db.session.commit()
 
+            e0 = Enrollment.create(class_session_id=cs0.id,
+                                   enrolled_person_id=people[0].id)
+            for person in people[1:]:
+                entry, enrollment_id = WaitlistEntry.join(cs0.id, person.id)
+                assert enrollment_id is None
+            assert [entry.position for entry in cs0.waitlist_entries] == [
+                1, 2, 3, 4]
+            assert cs0.waitlist_count == 4
+
+            def enrolled():
+                return sorted(e.enrolled_person_id
+                              for e in Enrollment.query.filter_by(
+                                  class_session_id=cs0.id, terminated=False))
+
+            Enrollment.bulk_update([e0.id], dict(terminated=True))
+            assert enrolled() == [people[1].id]
+
+            # the class capacity applies, two seats go in one promotion
+            statements = []
+
+            def count(conn, cursor, statement, *args):
+                statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                c0.update(capacity=3)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            assert enrolled() == [person.id for person in people[1:4]]
+            assert len([s for s in statements
+                        if s.startswith('DELETE FROM waitlist_entry')]) == 1
+
+            ClassSession.bulk_update([cs0.id], dict(capacity=10))
+            db.session.refresh(cs0)
+            assert enrolled() == [person.id for person in people[1:]]
+            assert (cs0.enrollment_count, cs0.waitlist_count) == (4, 0)
+
+            # moving a session to a larger class frees seats as well
+            c1 = Class(title='diving class', capacity=1)
+            c2 = Class(title='surfing class', capacity=2)
+            c3 = Class(title='sailing class', capacity=3)
+            u0.created_classes.extend([c1, c2, c3])
+            db.session.commit()
+            cs1 = ClassSession(class_id=c1.id, creator_id=u0.id,
+                               schedule=Schedule(
+                                   repeat_option=RepeatOption.NEVER))
+            db.session.add(cs1)
+            db.session.commit()
+            Enrollment.create(class_session_id=cs1.id,
+                              enrolled_person_id=people[0].id)
+            WaitlistEntry.join(cs1.id, people[1].id)
+            cs1.update(class_id=c2.id)
+            ClassSession.bulk_update([cs1.id], dict(class_id=c1.id))
+            WaitlistEntry.join(cs1.id, people[2].id)
+            ClassSession.bulk_update([cs1.id], dict(class_id=c3.id))
+            assert cs1.waitlist_entries.count() == 0
+            assert [e.enrolled_person_id for e in Enrollment.query.filter_by(
+                class_session_id=cs1.id)] == [
+                    person.id for person in people[:3]]
+
+            # a seat freed without a promotion goes to the head of the line,
+            # not to whoever joins next
+            ClassSession.bulk_update([cs1.id], dict(class_id=c1.id))
+            WaitlistEntry.join(cs1.id, people[3].id)
+            db.session.execute(Class.__table__.update().where(
+                Class.id == c1.id).values(capacity=4))
+            entry, enrollment_id = WaitlistEntry.join(cs1.id, people[4].id)
+            assert enrollment_id is None
+            assert entry.person_id == people[4].id
+            assert [e.person_id for e in cs1.waitlist_entries] == [
+                people[4].id]
+            assert Enrollment.query.filter_by(
+                class_session_id=cs1.id,
+                enrolled_person_id=people[3].id).count() == 1
+
+    def test_counters(self):
+        with self.app.app_context():
+            u0 = User(username='thornpig', email='zack@gmail.com',
+                      first_name='zack', last_name='zhu')
+            c0 = Class(title='swimming class')
+            u0.created_classes.append(c0)
+            db.session.add(u0)
+            db.session.commit()
+
+            ts0 = TimeSlot(start_at=datetime(2018, 1, 1, 9), duration=30)
+            sch0 = Schedule(repeat_option=RepeatOption.WEEKLY,
+                            repeat_end_at=datetime(2018, 12, 31),
+                            base_time_slots=[ts0])
+            cs0 = ClassSession(class_id=c0.id, creator_id=u0.id,
+                               schedule=sch0)
+            cs1 = ClassSession(parent_class=c0, creator=u0,
+                               schedule=Schedule(
+                                   repeat_option=RepeatOption.NEVER))
+            db.session.add_all([cs0, cs1])
+            db.session.commit()
+            assert c0.num_of_sessions == 2
+
+            # materialized in bulk, synced in bulk, and through the ORM
+            db.session.add(TemplateLesson(class_session_id=cs0.id,
+                                          time_slot_id=ts0.id))
+            db.session.commit()
+            assert cs0.num_of_lessons == 52
+            sch0.repeat_end_at = datetime(2018, 1, 10)
+            db.session.commit()
+            assert cs0.num_of_lessons == 2
+            l0 = Lesson(start_at=datetime(2018, 2, 1, 9), duration=30,
+                        class_session=cs0)
+            db.session.add(l0)
+            db.session.commit()
+            assert cs0.num_of_lessons == 3
+            l0.class_session = cs1
+            db.session.commit()
+            assert (cs0.num_of_lessons, cs1.num_of_lessons) == (2, 1)
+            Lesson.bulk_update([l0.id], dict(class_session_id=cs0.id))
+            assert (cs0.num_of_lessons, cs1.num_of_lessons) == (3, 0)
+            l0.delete()
+            assert cs0.num_of_lessons == cs0.lessons.count() == 2
+
+            Enrollment.create(class_session_id=cs1.id,
+                              enrolled_person_id=u0.id)
+            assert cs1.num_of_enrollments == 1
+
+            # the hybrids are columns to queries
+            assert ClassSession.query.filter(
+                ClassSession.num_of_lessons > 0).all() == [cs0]
+            assert ClassSession.query.order_by(
+                ClassSession.num_of_enrollments.desc()).first() == cs1
+
+            # drift is found and repaired with one GROUP BY per counter
+            db.session.execute(ClassSession.__table__.update().values(
+                lesson_count=7, enrollment_count=0))
+            db.session.commit()
+            ids = [cs0.id, cs1.id]
+
+        def counts():
+            with self.app.app_context():
+                return [(cs.num_of_lessons, cs.num_of_enrollments)
+                        for cs in map(ClassSession.get_with_id, ids)]
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(reconcile_counters_command, ['--dry-run'])
+        assert 'class_session.lesson_count: 2 drifted' in result.output
+        assert counts() == [(7, 0), (7, 0)]
+        result = runner.invoke(reconcile_counters_command)
+        assert 'class_session.enrollment_count: 1 repaired' in result.output
+        assert 'class.session_count: 0 repaired' in result.output
+        assert counts() == [(2, 0), (0, 1)]
+
+    def test_index_advisor(self):
+        with self.app.app_context():
+            address = Address.__table__
+            tables, plan = find_full_scans(
+                db.session.connection(),
+                db.select([address]).where(address.c.city == 'XYZ'))
+            assert tables == ['address']
+            tables, plan = find_full_scans(
+                db.session.connection(),
+                db.select([address]).where(address.c.creator_id == 1))
+            assert tables == []
+
+            # overlap queries read a bounded range of the start index
+            tables, plan = find_full_scans(
+                db.session.connection(),
+                hot_queries['occupancy of an address']())
+            assert [line for line in plan if 'SEARCH lesson' in line] and all(
+                'start_at>? AND start_at<?' in line
+                for line in plan if 'SEARCH lesson' in line)
+
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(index_advisor_command)
+        assert result.exit_code == 0, result.output
+        assert 'active enrollments of a class session: ok' in result.output
+
+    def test_interval_index(self):
+        index = IntervalIndex([Interval(0, 10, 'a'), Interval(2, 3, 'b'),
+                               Interval(5, 7, 'c'), Interval(12, 15, 'd')])
+        assert index.has_overlap(6, 8)
+        assert not index.has_overlap(10, 12)
+        assert [i.key for i in index.overlaps(4, 13)] == ['a', 'c', 'd']
+        assert index.overlaps(15, 20) == []
+        assert [(first.key, second.key)
+                for first, second in index.conflicts()] == [
+            ('a', 'b'), ('a', 'c')]
+
+    def test_instructor_conflicts(self):
+        with self.app.app_context():
+            u0 = User(username='thornpig', email='zack@gmail.com',
+                      first_name='zack', last_name='zhu')
+            c0 = Class(title='swimming class')
+            u0.created_classes.append(c0)
+            db.session.add(u0)
+            db.session.commit()
+            ts0 = TimeSlot(start_at=datetime(2018, 1, 1, 9), duration=60)
+            sch0 = Schedule(repeat_option=RepeatOption.WEEKLY,
+                            repeat_end_at=datetime(2018, 12, 31),
+                            base_time_slots=[ts0])
+            cs0 = ClassSession(class_id=c0.id, creator_id=u0.id,
+                               schedule=sch0)
+            db.session.add(cs0)
+            db.session.commit()
+            db.session.add(TemplateLesson(class_session_id=cs0.id,
+                                          time_slot_id=ts0.id))
+            cs0.instructors.append(u0)
+            db.session.commit()
+            assert len(Lesson.get_instructor_index(u0.id)) == 52
+
+            # 9:30 on the third Monday overlaps the weekly 9:00 lesson
+            l0 = Lesson(class_session_id=cs0.id, duration=30,
+                        start_at=datetime(2018, 1, 15, 9, 30))
+            l0.instructors.append(u0)
+            db.session.add(l0)
+            with self.assertRaises(InstructorConflictError) as cm:
+                db.session.commit()
+            [(first, second)] = cm.exception.conflicts
+            assert (first.start, second.start) == (
+                datetime(2018, 1, 15, 9), datetime(2018, 1, 15, 9, 30))
+            db.session.rollback()
+
+            l0.start_at = datetime(2018, 1, 15, 10)
+            db.session.add(l0)
+            db.session.commit()
+            assert len(Lesson.get_instructor_index(u0.id)) == 53
+            assert Lesson.get_instructor_index(u0.id).conflicts() == []
+            assert isinstance(cm.exception, ConflictError)
+            # only the lessons overlapping the window are read
+            index = Lesson.get_instructor_index(
+                u0.id, datetime(2018, 1, 15, 9, 15),
+                datetime(2018, 1, 15, 10, 15))
+            assert [interval.start for interval in index.intervals] == [
+                datetime(2018, 1, 15, 9), datetime(2018, 1, 15, 10)]
+
+    def test_enrollment_capacity(self):
+        with self.app.app_context():
+            u0 = User(username='thornpig', email='zack@gmail.com',
+                      first_name='zack', last_name='zhu')
+            people = [Dependent(first_name='kid{}'.format(i), last_name='zhu')
+                      for i in range(4)]
+            u0.dependents.extend(people)
+            c0 = Class(title='swimming class', capacity=2)
+            u0.created_classes.append(c0)
+            db.session.add(u0)
+            db.session.commit()
+            sch0 = Schedule(repeat_option=RepeatOption.NEVER,
+                            base_time_slots=[TimeSlot(
+                                start_at=datetime(2018, 1, 1, 9),
+                                duration=30)])
+            cs0 = ClassSession(class_id=c0.id, creator_id=u0.id,
+                               schedule=sch0)
+            db.session.add(cs0)
+            db.session.commit()
+
+            # the capacity of the class applies to its sessions
+            e0, e1 = [Enrollment.create(class_session_id=cs0.id,
+                                        enrolled_person_id=person.id)
+                      for person in people[:2]]
+            assert cs0.enrollment_count == 2
+            with self.assertRaises(ClassSessionFullError):
+                Enrollment.create(class_session_id=cs0.id,
+                                  enrolled_person_id=people[2].id)
+            db.session.rollback()
+            assert Enrollment.query.count() == 2
+
+            # terminating frees the seat, resuming takes it again
+            e0.update(terminated=True)
+            assert cs0.enrollment_count == 1
+            e2 = Enrollment.create(class_session_id=cs0.id,
+                                   enrolled_person_id=people[2].id)
+            with self.assertRaises(ClassSessionFullError):
+                e0.update(terminated=False)
+            db.session.rollback()
+            e1.delete()
+            assert cs0.enrollment_count == 1
+
+            # the bulk paths take and give back seats as well
+            cs0.update(capacity=3)
+            with self.assertRaises(ClassSessionFullError):
+                Enrollment.bulk_create([
+                    dict(class_session_id=cs0.id,
+                         enrolled_person_id=person.id)
+                    for person in people[:3]])
+            db.session.rollback()
+            Enrollment.bulk_update([e0.id], dict(terminated=False))
+            Enrollment.bulk_create([dict(class_session_id=cs0.id,
+                                         enrolled_person_id=people[3].id)])
+            Enrollment.bulk_update([e0.id, e2.id], dict(terminated=True))
+            db.session.refresh(cs0)
+            assert cs0.enrollment_count == 1
+            assert cs0.enrollment_count == Enrollment.query.filter_by(
+                class_session_id=cs0.id, terminated=False).count()
+
+    def test_materialize_lessons(self):
+        with self.app.app_context():
+            u0 = User(username='thornpig', email='zack@gmail.com',
+                      first_name='zack', last_name='zhu')
+            c0 = Class(title='swimming class')
+            u0.created_classes.append(c0)
+            db.session.add(u0)
+            db.session.commit()
+            ts0 = TimeSlot(start_at=datetime(2018, 1, 1, 9), duration=30)
+            sch0 = Schedule(repeat_option=RepeatOption.DAILY,
+                            repeat_end_at=datetime(2020, 1, 1),
+                            base_time_slots=[ts0])
+            cs0 = ClassSession(class_id=c0.id, creator_id=u0.id,
+                               schedule=sch0)
+            db.session.add(cs0)
+            db.session.commit()
+
+            statements = []
+
+            def count_statement(conn, cursor, statement, *args):
+                statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', count_statement)
+            try:
+                db.session.add(TemplateLesson(class_session_id=cs0.id,
+                                              time_slot_id=ts0.id))
+                db.session.commit()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute',
+                             count_statement)
+            # one executemany per table of RepeatedLesson
+            inserts = [statement.split('(')[0] for statement in statements
+                       if statement.startswith('INSERT')]
+            assert sorted(inserts) == ['INSERT INTO lesson ',
+                                       'INSERT INTO repeated_lesson ',
+                                       'INSERT INTO template_lesson ']
+
+            lessons = cs0.lessons.order_by(Lesson.start_at).all()
+            assert len(lessons) == 730
+            assert all(type(lesson) is RepeatedLesson for lesson in lessons)
+            assert [lesson.index_of_rep for lesson in lessons] == list(
+                range(730))
+            assert lessons[-1].start_at == datetime(2019, 12, 31, 9)
+            assert lessons[-1].end_at == datetime(2019, 12, 31, 9, 30)
+
+            # the ORM path only builds the lessons the flush did not insert
+            tl1 = TemplateLesson(class_session_id=cs0.id, time_slot=ts0)
+            db.session.add(tl1)
+            assert cs0.create_lessons_for_template_lessons([tl1]) == []
+            RepeatedLesson.query.filter(
+                RepeatedLesson.template_lesson_id == tl1.id,
+                RepeatedLesson.index_of_rep >= 700).delete(
+                    synchronize_session=False)
+            lessons = cs0.create_lessons()
+            assert [(lesson.template_lesson, lesson.index_of_rep)
+                    for lesson in lessons] == [
+                        (tl1, index) for index in range(700, 730)]
+            db.session.add_all(lessons)
+            db.session.commit()
+            assert RepeatedLesson.query.filter_by(
+                template_lesson_id=tl1.id).count() == 730
 
 
 if __name__ == '__main__':